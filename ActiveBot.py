@@ -1,19 +1,47 @@
+import asyncio
 import logging
 import os
-from telegram import Update
-from telegram.ext import ApplicationBuilder, CommandHandler, MessageHandler, ContextTypes, filters
-from Database import Database
+import secrets
+import tempfile
+from datetime import datetime
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
+from telegram.ext import ApplicationBuilder, CallbackQueryHandler, CommandHandler, MessageHandler, ContextTypes, filters
+from telegram.helpers import escape_markdown
+from Analytics import DWELL, TRANSIT, TransitStats
+from AsyncDatabase import AsyncDatabase
+from Exporter import EXPORT_FORMATS, write_export
+from Importer import MAX_IMPORT_BYTES, parse_shipment_csv, parse_shipment_lines, split_tracking_number
+from Poller import Poller
+from Providers import TrackingEvent
+from Webhook import WebhookServer
 
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
     level=logging.INFO
 )
 
-db = Database.get_instance()
+db = AsyncDatabase()
+
+ONGOING_PAGE_SIZE = 20
+# transit_stats is re-read at most this often (in seconds); the pollers only add to it every minute or so.
+STATS_MAX_AGE = 60
+
+
+def format_duration(seconds: float) -> str:
+    hours = seconds / 3600
+    return f"{hours / 24:.1f}d" if hours >= 48 else f"{hours:.1f}h"
 
 class TelegramBot:
-    def __init__(self, token):
-        self.application = ApplicationBuilder().token(token).build()
+    def __init__(self, token, poller: Poller = None, api_url: str = None):
+        builder = ApplicationBuilder().token(token)
+        if api_url is not None:
+            builder.base_url(f"{api_url}/bot")
+        self.application = builder.build()
+        # Only a poller in the same process (main.py with BOT_WEBHOOK_URL) can share its cached upstream
+        # responses with /track; the standalone bot shows the events that poller stored instead.
+        self.poller = poller
+        self._stats = None
+        self._stats_loaded_at = 0.0
         self.add_handlers()
 
     def add_handlers(self):
@@ -22,9 +50,13 @@ class TelegramBot:
         self.application.add_handler(CommandHandler('add_shipment', self.add_shipment))
         self.application.add_handler(CommandHandler('track', self.track_shipment))
         self.application.add_handler(CommandHandler('status', self.update_status))
+        self.application.add_handler(CommandHandler('stats', self.stats))
         self.application.add_handler(CommandHandler('providers', self.list_providers))
         self.application.add_handler(CommandHandler('add_provider', self.add_provider))
         self.application.add_handler(CommandHandler('ongoing_shipments', self.ongoing_shipment))
+        self.application.add_handler(CallbackQueryHandler(self.ongoing_shipment_page, pattern=r'^ongoing:'))
+        self.application.add_handler(CommandHandler('export', self.export))
+        self.application.add_handler(MessageHandler(filters.Document.FileExtension('csv') | filters.Document.FileExtension('txt'), self.import_document))
         self.application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, self.unknown_command))
 
 
@@ -36,34 +68,106 @@ class TelegramBot:
                                         text="""Available commands:
 /start: Start the bot.
 /help: Show this help message.
-/add_shipment `code` `provider`: Add a new shipment (code and provider are required).
-/ongoing_shipments: Return all shipment that are not dilivered.
-/track `shipment_id`: Track a shipment by its ID.
+/add_shipment `code` `provider`: Add a new shipment (code and provider are required). Put one `code provider` pair per line to add many at once, or upload them as a CSV file. SPX codes need the token from spx.vn's tracking page, given as `code|token`.
+/ongoing_shipments: Return all shipment that are not dilivered, one page at a time.
+/export [`csv`|`jsonl`]: Download all shipments and their tracking history as a file.
+/track `shipment_id`: Track a shipment by its ID, with an estimated delivery date.
+/stats [`provider`]: Show delivery times per provider, and the statuses parcels wait longest in.
 /status `shipment_id` `status`: Update the status of a shipment (status can be False: Pending, True:Delivered).
 /providers: List all available shipping providers.
 /add_provider `name` `url`: Add a new shipping provider (name and url are required).""")
 
     async def ongoing_shipment(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        ongoing = db.get_all_ongoing_shipments()
-        await context.bot.send_message(chat_id=update.effective_chat.id, text=f"```\n{ongoing}\n```", parse_mode="Markdown")
-        
-                                       
+        text, reply_markup = await self.ongoing_page()
+        await context.bot.send_message(chat_id=update.effective_chat.id, text=text, reply_markup=reply_markup, parse_mode="Markdown")
+
+    async def ongoing_shipment_page(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        query = update.callback_query
+        await query.answer()
+        text, reply_markup = await self.ongoing_page(query.data.split(":", 1)[1])
+        await query.edit_message_text(text=text, reply_markup=reply_markup, parse_mode="Markdown")
+
+    async def ongoing_page(self, after_id: str = None):
+        """Renders one page of ongoing shipments, with a button for the next one if there is more."""
+        # One extra row tells whether a next page exists without counting them all.
+        rows = await db.get_ongoing_shipments_page(after_id, ONGOING_PAGE_SIZE + 1)
+        if not rows:
+            return ("No more ongoing shipments." if after_id else "No ongoing shipments."), None
+        page = rows[:ONGOING_PAGE_SIZE]
+        text = "Ongoing shipments:\n" + "\n".join(f"`{code}` {escape_markdown(provider)} `{shipment_id}`"
+                                                   for shipment_id, code, provider in page)
+        reply_markup = None
+        if len(rows) > ONGOING_PAGE_SIZE:
+            # Callback data is limited to 64 bytes; a shipment ID is 36.
+            reply_markup = InlineKeyboardMarkup([[InlineKeyboardButton("Next page", callback_data=f"ongoing:{page[-1][0]}")]])
+        return text, reply_markup
+
+    async def export(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        parts = update.message.text.split()
+        export_format = parts[1].lower() if len(parts) > 1 else "csv"
+        if export_format not in EXPORT_FORMATS:
+            await context.bot.send_message(chat_id=update.effective_chat.id, text="Usage: /export [`csv`|`jsonl`]", parse_mode="Markdown")
+            return
+        try:
+            # Rows are streamed from the database into a temporary file on a worker thread.
+            with tempfile.TemporaryFile() as file:
+                await db.run(write_export, file, export_format)
+                file.seek(0)
+                filename = f"shipments-{datetime.now():%Y%m%d-%H%M%S}.{export_format}"
+                await context.bot.send_document(chat_id=update.effective_chat.id, document=file, filename=filename)
+        except Exception as e:
+            await context.bot.send_message(chat_id=update.effective_chat.id, text=f"Error exporting shipments:\n```\n{e}\n```", parse_mode="Markdown")
+
     async def add_shipment(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         try:
             message = update.message.text
+            lines = message.strip().split("\n")
+            if len(lines) > 1:
+                # Bulk import: the first pair may follow the command, the others one per line.
+                await self.import_shipments(update, context, lines[0].split(None, 1)[1:] + lines[1:])
+                return
             parts = message.split()
             if len(parts) < 3:
-                await context.bot.send_message(chat_id=update.effective_chat.id, text="Usage: `/add_shipment code provider`", parse_mode="Markdown")
+                await context.bot.send_message(chat_id=update.effective_chat.id, text="Usage: `/add_shipment code[|token] provider`", parse_mode="Markdown")
             else:
-                code = parts[1]
+                code, tracking_number = split_tracking_number(parts[1])
                 provider = parts[2]
-                shipment_id = db.insert_shipment(code, provider, False)
-                db.add_to_current_tracking(shipment_id)
+                shipment_id = await db.insert_shipment(code, provider, False, tracking_number)
+                await db.add_to_current_tracking(shipment_id)
                 await context.bot.send_message(chat_id=update.effective_chat.id, text=f"Shipment added with ID:\n```\n{shipment_id}\n```", parse_mode="Markdown")
         except Exception as e:
             await context.bot.send_message(chat_id=update.effective_chat.id, text=f"Error adding shipment:\n```\n{e}\n```", parse_mode="Markdown")
 
 
+    async def import_document(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        document = update.message.document
+        if document.file_size and document.file_size > MAX_IMPORT_BYTES:
+            await context.bot.send_message(chat_id=update.effective_chat.id, text=f"File too large, the limit is {MAX_IMPORT_BYTES // (1024 * 1024)} MB.")
+            return
+        try:
+            data = await (await document.get_file()).download_as_bytearray()
+            shipments, invalid = parse_shipment_csv(bytes(data))
+            await self.import_shipments(update, context, shipments=shipments, invalid=invalid)
+        except Exception as e:
+            await context.bot.send_message(chat_id=update.effective_chat.id, text=f"Error importing shipments:\n```\n{e}\n```", parse_mode="Markdown")
+
+    async def import_shipments(self, update: Update, context: ContextTypes.DEFAULT_TYPE, lines=None, shipments=None, invalid=None):
+        """Adds every parsed `code provider` pair in one transaction and replies with a summary."""
+        if lines is not None:
+            shipments, invalid = parse_shipment_lines(lines)
+        if not shipments:
+            await context.bot.send_message(chat_id=update.effective_chat.id, text="No `code provider` pairs found.", parse_mode="Markdown")
+            return
+        result = await db.import_shipments(shipments)
+        summary = [f"Added {len(result.added)} of {len(shipments)} shipments."]
+        if result.duplicates:
+            summary.append(f"Skipped {len(result.duplicates)} already tracked: {', '.join(result.duplicates[:10])}" + (" ..." if len(result.duplicates) > 10 else ""))
+        if result.unknown_providers:
+            summary.append(f"Unknown providers: {', '.join(result.unknown_providers)}")
+        if invalid:
+            summary.append(f"Unreadable lines: {', '.join(map(str, invalid[:10]))}" + (" ..." if len(invalid) > 10 else ""))
+        await context.bot.send_message(chat_id=update.effective_chat.id, text="\n".join(summary))
+
     async def track_shipment(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         text = update.message.text.split()
         if len(text) < 2:
@@ -71,14 +175,73 @@ class TelegramBot:
             return
         try:
             input_text = update.message.text.split()[1]
-            shipment = db.get_shipment(input_text)
+            shipment = await db.get_shipment(input_text)
             if shipment:
-                await context.bot.send_message(chat_id=update.effective_chat.id, text=f"Shipment details:\nID: `{shipment[0]}`\nCode: `{shipment[1]}`\nProvider: `{shipment[2]}`\nStatus: `{shipment[3]}`", parse_mode="Markdown")
+                text = f"Shipment details:\nID: `{shipment[0]}`\nCode: `{shipment[1]}`\nProvider: `{shipment[2]}`\nStatus: `{shipment[3]}`"
+                events = await self.latest_events(shipment)
+                if events:
+                    latest = "\n".join(f"`{datetime.fromtimestamp(e.timestamp):%Y-%m-%d %H:%M}` {escape_markdown(e.message or '')}" for e in events[:5])
+                    text += f"\nLatest events:\n{latest}"
+                    eta = await self.eta(shipment, events)
+                    if eta:
+                        text += f"\nEstimated delivery: `{datetime.fromtimestamp(eta[0]):%Y-%m-%d}` (90% by `{datetime.fromtimestamp(eta[1]):%Y-%m-%d}`)"
+                await context.bot.send_message(chat_id=update.effective_chat.id, text=text, parse_mode="Markdown")
             else:
                 await context.bot.send_message(chat_id=update.effective_chat.id, text=f"Shipment not found.")
         except Exception as e:
             await context.bot.send_message(chat_id=update.effective_chat.id, text=f"Error adding shipment:\n```\n{e}\n```", parse_mode="Markdown")
 
+    async def latest_events(self, shipment):
+        """The events of a shipment, newest first: live through the shared poller if there is one, else as stored."""
+        if self.poller is None:
+            history = await db.get_tracking_history(shipment[0])
+            events = [TrackingEvent(*row) for row in history]
+            if events and shipment[3]:
+                events[0] = events[0]._replace(delivered=True)
+            return events
+        provider_name = await db.get_provider_name(shipment[2])
+        if provider_name is None:
+            return None
+        try:
+            return await asyncio.wait_for(self.poller.fetch((shipment[0], shipment[1], provider_name)), timeout=10)
+        except asyncio.TimeoutError:
+            return None
+
+    async def transit_stats(self) -> TransitStats:
+        """The stored delivery-time aggregates, re-read once they are STATS_MAX_AGE old."""
+        now = asyncio.get_running_loop().time()
+        if self._stats is None or now - self._stats_loaded_at > STATS_MAX_AGE:
+            self._stats = await db.run(TransitStats.load)
+            self._stats_loaded_at = now
+        return self._stats
+
+    async def eta(self, shipment, events):
+        """The (median, 90th percentile) delivery time estimates of an undelivered shipment, or None."""
+        if not events or events[0].delivered:
+            return None
+        provider_name = await db.get_provider_name(shipment[2])
+        return (await self.transit_stats()).eta(provider_name, events)
+
+    async def stats(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        try:
+            message = update.message.text.split()
+            stats = await self.transit_stats()
+            providers = [message[1]] if len(message) > 1 else stats.providers()
+            lines = []
+            for provider in providers:
+                transit = stats.get(provider, TRANSIT)
+                if transit is None:
+                    lines.append(f"{provider}: no deliveries yet")
+                    continue
+                lines.append(f"{provider}: {transit.count} delivered, median {format_duration(transit.quantile(0.5))}, "
+                             f"90% within {format_duration(transit.quantile(0.9))}")
+                for status, dwell in stats.slowest(provider, DWELL):
+                    lines.append(f"  {status}: median {format_duration(dwell.quantile(0.5))}, "
+                                 f"90% within {format_duration(dwell.quantile(0.9))}")
+            await context.bot.send_message(chat_id=update.effective_chat.id, text="\n".join(lines) or "No delivery statistics yet.")
+        except Exception as e:
+            await context.bot.send_message(chat_id=update.effective_chat.id, text=f"Error:\n```\n{e}\n```", parse_mode="Markdown")
+
     async def update_status(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         try:
             message = update.message.text.split()
@@ -89,14 +252,14 @@ class TelegramBot:
             shipment_id = message[1]
 
             if len(message) == 2:  # Only shipment ID provided, retrieve status
-                shipment = db.get_shipment(shipment_id)
+                shipment = await db.get_shipment(shipment_id)
                 if shipment:
                     await context.bot.send_message(disable_web_page_preview=True, chat_id=update.effective_chat.id, text=f"Shipment status for ID {shipment_id}: {shipment[3]}")
                 else:
                     await context.bot.send_message(disable_web_page_preview=True, chat_id=update.effective_chat.id, text=f"Shipment with ID '{shipment_id}' not found.")
             else:  # Shipment ID and new status provided, update status
                 status = message[2].lower() == "true"
-                success = db.update_shipment_status(shipment_id, status)
+                success = await db.update_shipment_status(shipment_id, status)
                 if success:
                     await context.bot.send_message(disable_web_page_preview=True, chat_id=update.effective_chat.id, text=f"Shipment status updated successfully.")
                 else:
@@ -106,7 +269,7 @@ class TelegramBot:
 
     async def list_providers(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         try:
-            providers = db.get_all_providers()
+            providers = await db.get_all_providers()
             if providers:
                 provider_list = "\n".join([f"{p[1]} ({p[2]})" for p in providers]) #Format the output nicely
                 await context.bot.send_message(disable_web_page_preview=True, chat_id=update.effective_chat.id, text=f"Available providers:\n{provider_list}")
@@ -123,7 +286,7 @@ class TelegramBot:
                 return
             name = message[1]
             url = message[2]
-            provider_id = db.add_ship_provider(name, url)
+            provider_id = await db.add_ship_provider(name, url)
             if provider_id:
                 await context.bot.send_message(chat_id=update.effective_chat.id, text=f"Provider '{name}' added successfully.")
             else:
@@ -137,8 +300,27 @@ class TelegramBot:
 
 
 
-    def run(self):
-        self.application.run_polling()
+    async def __aenter__(self):
+        await self.application.initialize()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.application.shutdown()
+
+    def webhook(self, secret_token: str, webhook_url: str = None, host: str = "127.0.0.1", port: int = 8443) -> WebhookServer:
+        """A local server feeding updates to this bot; enter the bot first, e.g. alongside the poller in main.py."""
+        return WebhookServer(self.application, secret_token, host, port, webhook_url=webhook_url)
+
+    async def run_webhook(self, webhook_url: str, secret_token: str, host: str = "127.0.0.1", port: int = 8443):
+        async with self, self.webhook(secret_token, webhook_url, host, port):
+            await asyncio.Event().wait()
+
+    def run(self, webhook_url: str = None, secret_token: str = None, host: str = "127.0.0.1", port: int = 8443):
+        """Long-polls Telegram, or with `webhook_url` receives updates on a local webhook server instead."""
+        if webhook_url is None:
+            self.application.run_polling()
+        else:
+            asyncio.run(self.run_webhook(webhook_url, secret_token or secrets.token_urlsafe(32), host, port))
 
 
 if __name__ == '__main__':
@@ -149,6 +331,8 @@ if __name__ == '__main__':
         if not BOT_TOKEN:
             raise ValueError("BOT_TOKEN not found in .env file.")
         bot = TelegramBot(BOT_TOKEN)
-        bot.run()
+        # With BOT_WEBHOOK_URL set, Telegram pushes updates to it; forward it to BOT_WEBHOOK_PORT/telegram.
+        bot.run(os.getenv("BOT_WEBHOOK_URL"), os.getenv("BOT_WEBHOOK_SECRET"),
+                os.getenv("BOT_WEBHOOK_HOST", "127.0.0.1"), int(os.getenv("BOT_WEBHOOK_PORT", "8443")))
     except Exception as e:
         logging.error(f"An error occurred: {e}")
\ No newline at end of file
@@ -0,0 +1,234 @@
+import json
+import math
+import sqlite3
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from Database import Database
+from Providers import TrackingEvent
+
+# (PROVIDER, METRIC, STATUS); STATUS is empty for TRANSIT.
+StatKey = Tuple[str, str, str]
+
+# First event to delivery.
+TRANSIT = "transit"
+# Time from an event with a status until the next event.
+DWELL = "dwell"
+# Time from first reaching a status until delivery; what the ETA is based on.
+REMAINING = "remaining"
+
+# Fewer samples than this for the current status and the ETA falls back to the provider's transit time.
+MIN_ETA_SAMPLES = 5
+
+
+class QuantileSketch:
+    """Streaming quantiles of durations in seconds, within a relative error of `accuracy`.
+
+    Values are counted in buckets whose bounds grow by a constant factor
+    (as in DDSketch), so the size depends on the range of the values, not on
+    how many there are: a few hundred buckets span one second to a year.
+    Sketches of the same accuracy merge by adding their counts.
+    """
+    __slots__ = ("accuracy", "buckets", "count", "total", "_log_gamma")
+
+    def __init__(self, accuracy: float = 0.02, buckets: Dict[int, int] = None, count: int = 0, total: float = 0.0):
+        self.accuracy = accuracy
+        self.buckets: Dict[int, int] = buckets if buckets is not None else {}
+        self.count = count
+        self.total = total
+        self._log_gamma = math.log((1 + accuracy) / (1 - accuracy))
+
+    def add(self, value: float):
+        index = math.ceil(math.log(max(value, 1.0)) / self._log_gamma)
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+
+    def merge(self, other: "QuantileSketch"):
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.count += other.count
+        self.total += other.total
+
+    def quantile(self, q: float) -> Optional[float]:
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen > rank:
+                break
+        # The bucket holds (gamma^(index-1), gamma^index]; this estimate is within `accuracy` of both ends.
+        return 2 * math.exp(index * self._log_gamma) / (1 + math.exp(self._log_gamma))
+
+    def mean(self) -> Optional[float]:
+        return self.total / self.count if self.count else None
+
+    def to_json(self) -> str:
+        return json.dumps({"accuracy": self.accuracy, "count": self.count, "total": self.total,
+                           "buckets": self.buckets}, separators=(",", ":"))
+
+    @staticmethod
+    def from_json(text: str) -> "QuantileSketch":
+        data = json.loads(text)
+        return QuantileSketch(data["accuracy"], {int(index): count for index, count in data["buckets"].items()},
+                              data["count"], data["total"])
+
+
+def status_of(event: TrackingEvent) -> str:
+    return event.status or event.message or ""
+
+
+class TransitStats:
+    """Delivery-time aggregates per provider and per tracking status, updated as events arrive.
+
+    The poller `record`s the events each poll added and `commit`s them once
+    they are stored (or `rollback`s them when the batch was not), and
+    `flush`es now and then, which adds its samples to the aggregates stored
+    in transit_stats (so several pollers can feed the same aggregates) and
+    starts over.
+    Readers `load` the stored aggregates: one row per (provider, metric,
+    status), however much history there is.
+
+    Carriers don't report locations in a common form, so the legs of a
+    journey are the statuses it passes through rather than hubs on a route.
+    """
+
+    def __init__(self, accuracy: float = 0.02):
+        self.accuracy = accuracy
+        self.sketches: Dict[StatKey, QuantileSketch] = {}
+        self._staged: List[Tuple[StatKey, float]] = []
+
+    def _add(self, key: StatKey, value: float):
+        sketch = self.sketches.get(key)
+        if sketch is None:
+            sketch = self.sketches[key] = QuantileSketch(self.accuracy)
+        sketch.add(value)
+
+    def commit(self):
+        """Adds the samples `record`ed since the last commit or rollback."""
+        for key, value in self._staged:
+            self._add(key, value)
+        self._staged.clear()
+
+    def rollback(self):
+        self._staged.clear()
+
+    def record(self, provider: str, events: List[TrackingEvent], new_events: List[TrackingEvent],
+               since: Optional[float] = None):
+        """Stages the samples completed by `new_events`, given all of the shipment's `events`, newest first.
+
+        Only events later than `since`, the newest event time seen before, add
+        dwell samples: a backfilled event or an edit of the newest one doesn't
+        mean the parcel moved on.
+        """
+        if not events or not new_events:
+            return
+        new = set(new_events)
+        history = events[::-1]
+        for previous, event in zip(history, history[1:]):
+            if event in new and (since is None or event.timestamp > since):
+                self._staged.append(((provider, DWELL, status_of(previous)), event.timestamp - previous.timestamp))
+        delivered = history[-1]
+        if not delivered.delivered or delivered not in new:
+            return
+        self._staged.append(((provider, TRANSIT, ""), delivered.timestamp - history[0].timestamp))
+        reached: Dict[str, int] = {}
+        for event in history[:-1]:
+            reached.setdefault(status_of(event), event.timestamp)
+        for status, timestamp in reached.items():
+            self._staged.append(((provider, REMAINING, status), delivered.timestamp - timestamp))
+
+    def get(self, provider: str, metric: str, status: str = "") -> Optional[QuantileSketch]:
+        return self.sketches.get((provider, metric, status))
+
+    def eta(self, provider: str, events: List[TrackingEvent]) -> Optional[Tuple[float, float]]:
+        """Estimates when an undelivered parcel arrives from its events, newest first.
+
+        Returns:
+            The median and the 90th percentile arrival times as Unix timestamps,
+            or None if the parcel is delivered or there is too little data.
+        """
+        if not events or events[0].delivered:
+            return None
+        status = status_of(events[0])
+        sketch = self.get(provider, REMAINING, status)
+        if sketch is not None and sketch.count >= MIN_ETA_SAMPLES:
+            since = min(event.timestamp for event in events if status_of(event) == status)
+        else:
+            sketch = self.get(provider, TRANSIT)
+            if sketch is None or sketch.count < MIN_ETA_SAMPLES:
+                return None
+            since = events[-1].timestamp
+        return since + sketch.quantile(0.5), since + sketch.quantile(0.9)
+
+    def providers(self) -> List[str]:
+        return sorted({key[0] for key in self.sketches})
+
+    def slowest(self, provider: str, metric: str = DWELL, limit: int = 3) -> List[Tuple[str, QuantileSketch]]:
+        """The statuses with the longest median `metric` for `provider`."""
+        sketches = [(key[2], sketch) for key, sketch in self.sketches.items() if key[:2] == (provider, metric)]
+        sketches.sort(key=lambda item: item[1].quantile(0.5), reverse=True)
+        return sketches[:limit]
+
+    def rows(self) -> List[Tuple[str, str, str, str]]:
+        return [(*key, sketch.to_json()) for key, sketch in self.sketches.items()]
+
+    @staticmethod
+    def from_rows(rows: Iterable[Tuple[str, str, str, str]]) -> "TransitStats":
+        stats = TransitStats()
+        for provider, metric, status, sketch in rows:
+            stats.sketches[provider, metric, status] = QuantileSketch.from_json(sketch)
+        return stats
+
+    @staticmethod
+    def load(db: Database) -> "TransitStats":
+        return TransitStats.from_rows(db.get_transit_stats())
+
+    def flush(self, db: Database) -> bool:
+        """Adds the samples recorded since the last flush to transit_stats and forgets them.
+
+        Returns False, keeping the samples for the next flush, if they couldn't be stored.
+        """
+        if not self.sketches:
+            return True
+        try:
+            with db.transaction():
+                stored = TransitStats.load(db)
+                for key, sketch in self.sketches.items():
+                    stored_sketch = stored.sketches.get(key)
+                    if stored_sketch is None:
+                        stored.sketches[key] = sketch
+                    else:
+                        stored_sketch.merge(sketch)
+                if not db.save_transit_stats((*key, stored.sketches[key].to_json()) for key in self.sketches):
+                    return False
+        except sqlite3.OperationalError as e:
+            # E.g. another process held the write lock past busy_timeout.
+            print(f"Could not store delivery-time stats, will retry: {e}")
+            return False
+        self.sketches.clear()
+        return True
+
+    @staticmethod
+    def rebuild(db: Database) -> "TransitStats":
+        """Recomputes the aggregates from the whole of tracking_events, e.g. to seed transit_stats once."""
+        stats = TransitStats()
+        shipment_id, provider, delivered, events = None, None, False, []
+
+        def record():
+            if events:
+                # Stored events don't keep the delivered flag; the shipment's STATUS says whether the newest one is.
+                if delivered:
+                    events[-1] = events[-1]._replace(delivered=True)
+                stats.record(provider, events[::-1], events)
+
+        for row in db.iter_shipment_history():
+            if row[0] != shipment_id:
+                record()
+                shipment_id, provider, delivered, events = row[0], row[2], row[3], []
+            if row[4] is not None:
+                events.append(TrackingEvent(row[4], row[5], row[6]))
+        record()
+        stats.commit()
+        return stats
@@ -0,0 +1,73 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+from Database import Database
+from Metrics import DB_CALL_SECONDS
+
+
+class AsyncDatabase:
+    """Runs Database calls on a thread pool so async handlers never block the event loop.
+
+    Every worker thread keeps its own long-lived connection, so the prepared
+    statements in that connection's statement cache are reused across calls.
+    Any Database method can be awaited on this object:
+
+        shipment = await adb.get_shipment(code)
+    """
+
+    def __init__(self, max_workers: int = 4, db_path: str = None):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="database")
+
+    def _database(self) -> Database:
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = self._local.db = Database.new_connection(self.db_path)
+            with self._lock:
+                self._connections.append(db)
+        return db
+
+    def _call(self, func: Callable[..., Any], args: tuple, kwargs: dict) -> Any:
+        db = self._database()
+        try:
+            return func(db, *args, **kwargs)
+        finally:
+            # A connection is kept for good, so a transaction a call left open would hold the write lock from the poller.
+            if db.conn.in_transaction:
+                db.conn.rollback()
+
+    async def run(self, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """Runs `func(db, *args, **kwargs)` on a worker thread's connection.
+
+        Use this to make several calls in one round trip, e.g. inside `db.transaction()`.
+        """
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        try:
+            return await loop.run_in_executor(self._executor, self._call, func, args, kwargs)
+        finally:
+            DB_CALL_SECONDS.labels(getattr(func, "__name__", "run")).observe(time.perf_counter() - started)
+
+    def __getattr__(self, name: str):
+        method = getattr(Database, name)
+        if not callable(method):
+            raise AttributeError(name)
+
+        async def call(*args, **kwargs):
+            return await self.run(method, *args, **kwargs)
+
+        call.__name__ = name
+        return call
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        with self._lock:
+            for db in self._connections:
+                db.close()
+            self._connections.clear()
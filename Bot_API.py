@@ -1,15 +1,32 @@
+import time
+
 import requests
 
+from Metrics import TELEGRAM_RESPONSES, TELEGRAM_SEND_SECONDS
+
 class TelegramBot:
-    def __init__(self, bot_token, chat_id):
+    def __init__(self, bot_token, chat_id, api_url="https://api.telegram.org"):
         """Initializes the TelegramBot with the bot token and chat ID."""
         self.bot_token = bot_token
         self.chat_id = chat_id
-        self.base_url = f"https://api.telegram.org/bot{self.bot_token}"
+        self.base_url = f"{api_url}/bot{self.bot_token}"
+        self.session = requests.Session()
+
+    def _post(self, method, **kwargs):
+        """Posts to a Bot API method, recording its latency and status in the Telegram metrics."""
+        started = time.perf_counter()
+        try:
+            response = self.session.post(f"{self.base_url}/{method}", **kwargs)
+        except requests.exceptions.RequestException:
+            TELEGRAM_RESPONSES.labels(method, "error").inc()
+            raise
+        finally:
+            TELEGRAM_SEND_SECONDS.labels(method).observe(time.perf_counter() - started)
+        TELEGRAM_RESPONSES.labels(method, response.status_code).inc()
+        return response
 
     def send_message(self, message):
         """Sends a message to the specified chat ID using Markdown formatting."""
-        url = f"{self.base_url}/sendMessage"
         payload = {
             "chat_id": self.chat_id,
             "text": message,
@@ -17,7 +34,7 @@ class TelegramBot:
         }
 
         try:
-            response = requests.post(url, json=payload)
+            response = self._post("sendMessage", json=payload)
             response.raise_for_status()
             print("Message sent successfully!")
             return response.json()
@@ -25,30 +42,37 @@ class TelegramBot:
             print(f"Error sending message: {e}")
             return None
 
-    def send_photo(self, photo_path):
-        """Sends a photo to the specified chat ID."""
-        url = f"{self.base_url}/sendPhoto"
+    def send_photo(self, photo, caption=None):
+        """Sends a photo to the specified chat ID.
+
+        `photo` is either a path or the image itself as bytes, e.g. a PNG straight from ScreenshotClient.
+        """
+        data = {'chat_id': self.chat_id}
+        if caption:
+            data['caption'] = caption
         try:
-            with open(photo_path, 'rb') as photo:
-                files = {'photo': photo}
-                response = requests.post(url, data={'chat_id': self.chat_id}, files=files)
-                response.raise_for_status()
-                print("Photo sent successfully!")
-                return response.json()
+            if isinstance(photo, bytes):
+                files = {'photo': ('snapshot.png', photo, 'image/png')}
+                response = self._post("sendPhoto", data=data, files=files)
+            else:
+                with open(photo, 'rb') as photo_file:
+                    response = self._post("sendPhoto", data=data, files={'photo': photo_file})
+            response.raise_for_status()
+            print("Photo sent successfully!")
+            return response.json()
         except requests.exceptions.RequestException as e:
             print(f"Error sending photo: {e}")
             return None
 
     def send_document(self, document_path, caption=None):
         """Sends a document (file) to the specified chat ID."""
-        url = f"{self.base_url}/sendDocument"
         try:
             with open(document_path, 'rb') as document:
                 files = {'document': document}
                 data = {'chat_id': self.chat_id}
                 if caption:
                     data['caption'] = caption
-                response = requests.post(url, data=data, files=files)
+                response = self._post("sendDocument", data=data, files=files)
                 response.raise_for_status()
                 print("Document sent successfully!")
                 return response.json()
@@ -0,0 +1,103 @@
+import hashlib
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from Database import Database
+from Providers import TrackingEvent
+from StateIndex import StateIndex
+
+Fingerprint = Tuple[int, str, Optional[str]]
+
+
+def event_id(event: TrackingEvent) -> str:
+    """Stable identifier of one tracking event, derived from its time, status and message."""
+    key = f"{event.timestamp}|{event.status}|{event.message}"
+    return hashlib.blake2b(key.encode(), digest_size=8).hexdigest()
+
+
+def event_rows(shipment_id: str, events: Iterable[TrackingEvent]) -> List[Tuple[str, int, str, str, str]]:
+    """Converts tracking events to rows for Database.add_tracking_events."""
+    return [(shipment_id, event.timestamp, event_id(event), event.status, event.message)
+            for event in events]
+
+
+def hash_ids(ids: Iterable[str]) -> str:
+    return hashlib.blake2b("".join(sorted(ids)).encode(), digest_size=8).hexdigest()
+
+
+def head_hash(events: Iterable[TrackingEvent]) -> str:
+    """Order-independent hash of the events sharing the newest timestamp."""
+    return hash_ids(event_id(event) for event in events)
+
+
+class ChangeDetector:
+    """Finds the tracking events added since the previous poll of a shipment.
+
+    Only a compact fingerprint is kept per shipment: the timestamp of its newest
+    event, a hash of the events carrying that timestamp and a hash of all its
+    events. When the events up to the previous newest one still hash the same,
+    the new events are the ones after it. Otherwise an event was backfilled
+    behind the head or edited, and the new events are the ones whose IDs are
+    not in tracking_events yet; this relies on the caller storing every event
+    `diff` reports, as main.py does.
+
+    With an `index` (usually the poller's), the fingerprints of indexed
+    shipments are read from and written to it instead; the poller then
+    stores them with the rest of the batch.
+    """
+
+    def __init__(self, db: Database = None, index: StateIndex = None):
+        self.db = db if db is not None else Database.get_instance()
+        self.index = index
+        self._fingerprints: Dict[str, Optional[Fingerprint]] = {}
+
+    def fingerprint(self, shipment_id: str) -> Optional[Fingerprint]:
+        state = self.index.get(shipment_id) if self.index is not None else None
+        if state is not None:
+            return state.fingerprint
+        if shipment_id not in self._fingerprints:
+            self._fingerprints[shipment_id] = self.db.get_tracking_state(shipment_id)
+        return self._fingerprints[shipment_id]
+
+    def forget(self, shipment_id: str):
+        self._fingerprints.pop(shipment_id, None)
+
+    def diff(self, shipment_id: str, events: List[TrackingEvent]) -> List[TrackingEvent]:
+        """Returns the events that are new since the last call, oldest first.
+
+        The first call for a shipment only records its fingerprint and returns nothing.
+        """
+        previous = self.fingerprint(shipment_id)
+        if not events:
+            if previous is not None:
+                return []
+            # Recorded all the same, so the parcel's first events count as new rather than as its first poll.
+            current = (0, hash_ids([]), hash_ids([]))
+        else:
+            ids = [event_id(event) for event in events]
+            newest_time = events[0].timestamp
+            newest = 1
+            while newest < len(events) and events[newest].timestamp == newest_time:
+                newest += 1
+            current = (newest_time, hash_ids(ids[:newest]), hash_ids(ids))
+            if current == previous:
+                return []
+
+        if self.index is not None and shipment_id in self.index:
+            self.index.set_fingerprint(shipment_id, current)
+        else:
+            self._fingerprints[shipment_id] = current
+            self.db.set_tracking_state(shipment_id, *current)
+        if previous is None or not events:
+            return []
+
+        last_time, _, last_events_hash = previous
+        # Events come newest first; those after the previous head are new if the rest is unchanged.
+        older = 0
+        while older < len(events) and events[older].timestamp > last_time:
+            older += 1
+        if hash_ids(ids[older:]) == last_events_hash:
+            new_events = events[:older]
+        else:
+            stored = self.db.get_tracking_event_ids(shipment_id)
+            new_events = [event for event, key in zip(events, ids) if key not in stored]
+        return sorted(new_events, key=lambda event: event.timestamp)
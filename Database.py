@@ -1,10 +1,28 @@
 import sqlite3
 import uuid
-from typing import Tuple, List, Dict, Optional
+from contextlib import contextmanager
+from typing import Tuple, List, Dict, Iterable, Iterator, NamedTuple, Optional, Set
+
+from Metrics import DB_COMMIT_SECONDS
+
+
+class ImportResult(NamedTuple):
+    """Outcome of Database.import_shipments."""
+    added: List[Tuple[str, str]]
+    duplicates: List[str]
+    unknown_providers: List[str]
+
 
 class Database:
     __instance = None
     DB_PATH = "./database.sqlite"
+    PRAGMAS = (
+        "PRAGMA journal_mode = WAL",
+        "PRAGMA synchronous = NORMAL",
+        "PRAGMA temp_store = MEMORY",
+        "PRAGMA cache_size = -20000",
+        "PRAGMA busy_timeout = 5000",
+    )
 
     @staticmethod
     def get_instance():
@@ -17,9 +35,68 @@ class Database:
             raise Exception("This class is a singleton!")
         else:
             Database.__instance = self
-            self.conn = sqlite3.connect(Database.DB_PATH)
-            self.cursor = self.conn.cursor()
-            self.create_tables()
+            self._open(Database.DB_PATH)
+
+    @staticmethod
+    def new_connection(db_path: str = None) -> "Database":
+        """Returns a Database on its own connection, separate from the singleton.
+
+        sqlite3 connections can't be used from several threads at once, so each
+        worker thread opens its own; it may still be closed from another thread.
+        """
+        db = object.__new__(Database)
+        db._open(db_path or Database.DB_PATH, check_same_thread=False)
+        return db
+
+    def _open(self, db_path: str, check_same_thread: bool = True):
+        self.conn = Database.connect(db_path, check_same_thread)
+        self.cursor = self.conn.cursor()
+        self._transaction_depth = 0
+        # Providers are never renamed or removed, so found IDs can be cached for good.
+        self._provider_ids: Dict[str, int] = {}
+        self.create_tables()
+
+    @staticmethod
+    def connect(db_path: str, check_same_thread: bool = True) -> sqlite3.Connection:
+        """Opens a connection in WAL mode so readers don't block the poller's writes."""
+        conn = sqlite3.connect(db_path, check_same_thread=check_same_thread, cached_statements=256)
+        for pragma in Database.PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        """Groups every write made inside the block into a single commit.
+
+        Nested blocks join the outermost one. The whole transaction is rolled
+        back if the block raises.
+        """
+        self._transaction_depth += 1
+        try:
+            if self._transaction_depth == 1 and not self.conn.in_transaction:
+                # Take the write lock up front; a deferred transaction that reads
+                # first fails instead of waiting when another process wrote meanwhile.
+                self.conn.execute("BEGIN IMMEDIATE")
+            yield self
+        except BaseException:
+            self._transaction_depth -= 1
+            if self._transaction_depth == 0:
+                self.conn.rollback()
+            raise
+        self._transaction_depth -= 1
+        if self._transaction_depth == 0:
+            with DB_COMMIT_SECONDS.time():
+                self.conn.commit()
+
+    def _commit(self):
+        if self._transaction_depth == 0:
+            with DB_COMMIT_SECONDS.time():
+                self.conn.commit()
+
+    def _rollback(self):
+        # A failed write outside transaction() leaves sqlite3's implicit transaction, and its lock, open.
+        if self._transaction_depth == 0 and self.conn.in_transaction:
+            self.conn.rollback()
 
     def create_tables(self):
         self.cursor.execute("""
@@ -36,57 +113,185 @@ class Database:
                 CODE TEXT NOT NULL,
                 PROVIDER_ID INTEGER NOT NULL,
                 STATUS INTEGER NOT NULL,
+                TRACKING_NUMBER TEXT,
                 FOREIGN KEY (PROVIDER_ID) REFERENCES ship_providers(ID)
             )
         """)
+        self.cursor.execute("PRAGMA table_info(shipments)")
+        if "TRACKING_NUMBER" not in {row[1] for row in self.cursor.fetchall()}:
+            self.cursor.execute("ALTER TABLE shipments ADD COLUMN TRACKING_NUMBER TEXT")
         self.cursor.execute("""
             CREATE TABLE IF NOT EXISTS current_tracking (
                 ID INTEGER PRIMARY KEY AUTOINCREMENT,
                 SHIPMENT_ID TEXT NOT NULL UNIQUE,
+                LEASE_OWNER TEXT,
+                LEASE_EXPIRES REAL,
+                NEXT_POLL REAL,
                 FOREIGN KEY (SHIPMENT_ID) REFERENCES shipments(ID)
             )
         """)
+        self.cursor.execute("PRAGMA table_info(current_tracking)")
+        columns = {row[1] for row in self.cursor.fetchall()}
+        for column, column_type in (("LEASE_OWNER", "TEXT"), ("LEASE_EXPIRES", "REAL"), ("NEXT_POLL", "REAL")):
+            if column not in columns:
+                self.cursor.execute(f"ALTER TABLE current_tracking ADD COLUMN {column} {column_type}")
+        self.cursor.execute("""
+            CREATE TABLE IF NOT EXISTS poller_workers (
+                ID TEXT PRIMARY KEY,
+                LAST_SEEN REAL NOT NULL
+            )
+        """)
+        self.cursor.execute("""
+            CREATE TABLE IF NOT EXISTS tracking_state (
+                SHIPMENT_ID TEXT PRIMARY KEY,
+                LAST_EVENT_TIME INTEGER NOT NULL,
+                HEAD_HASH TEXT NOT NULL,
+                EVENTS_HASH TEXT,
+                FOREIGN KEY (SHIPMENT_ID) REFERENCES shipments(ID)
+            )
+        """)
+        self.cursor.execute("PRAGMA table_info(tracking_state)")
+        if "EVENTS_HASH" not in {row[1] for row in self.cursor.fetchall()}:
+            self.cursor.execute("ALTER TABLE tracking_state ADD COLUMN EVENTS_HASH TEXT")
+        self.cursor.execute("""
+            CREATE TABLE IF NOT EXISTS tracking_events (
+                SHIPMENT_ID TEXT NOT NULL,
+                EVENT_TIME INTEGER NOT NULL,
+                EVENT_ID TEXT NOT NULL,
+                STATUS TEXT,
+                MESSAGE TEXT,
+                PRIMARY KEY (SHIPMENT_ID, EVENT_TIME, EVENT_ID),
+                FOREIGN KEY (SHIPMENT_ID) REFERENCES shipments(ID)
+            ) WITHOUT ROWID
+        """)
+        self.cursor.execute("""
+            CREATE TABLE IF NOT EXISTS notification_queue (
+                ID INTEGER PRIMARY KEY AUTOINCREMENT,
+                CHAT_ID TEXT NOT NULL,
+                TEXT TEXT NOT NULL,
+                ATTEMPTS INTEGER NOT NULL DEFAULT 0,
+                NEXT_ATTEMPT REAL NOT NULL
+            )
+        """)
+        self.cursor.execute("""
+            CREATE TABLE IF NOT EXISTS transit_stats (
+                PROVIDER TEXT NOT NULL,
+                METRIC TEXT NOT NULL,
+                STATUS TEXT NOT NULL,
+                SKETCH TEXT NOT NULL,
+                PRIMARY KEY (PROVIDER, METRIC, STATUS)
+            ) WITHOUT ROWID
+        """)
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_shipments_code ON shipments (CODE)")
+        # (STATUS, ID) serves both status filters and keyset pagination by ID.
+        self.cursor.execute("DROP INDEX IF EXISTS idx_shipments_status")
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_shipments_status_id ON shipments (STATUS, ID)")
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_tracking_events_time ON tracking_events (EVENT_TIME)")
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_current_tracking_lease ON current_tracking (LEASE_OWNER)")
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_notification_queue_next ON notification_queue (NEXT_ATTEMPT)")
         self.conn.commit()
 
     def add_ship_provider(self, name: str, url: str = None) -> int:
         try:
             self.cursor.execute("INSERT INTO ship_providers (NAME, URL) VALUES (?, ?)", (name, url))
-            self.conn.commit()
+            self._commit()
             return self.cursor.lastrowid
         except sqlite3.IntegrityError:
+            self._rollback()
             print(f"Ship provider '{name}' already exists.")
             return None
         except sqlite3.Error as e:
+            self._rollback()
             print(f"Database error: {e}")
             return None
 
     def get_provider_id(self, provider_name: str) -> Optional[int]:
+        provider_id = self._provider_ids.get(provider_name)
+        if provider_id is not None:
+            return provider_id
         self.cursor.execute("SELECT ID FROM ship_providers WHERE NAME = ?", (provider_name,))
         result = self.cursor.fetchone()
+        if result is None:
+            return None
+        self._provider_ids[provider_name] = result[0]
+        return result[0]
+
+    def get_provider_name(self, provider_id: int) -> Optional[str]:
+        self.cursor.execute("SELECT NAME FROM ship_providers WHERE ID = ?", (provider_id,))
+        result = self.cursor.fetchone()
         return result[0] if result else None
 
     def get_all_providers(self) -> List[Tuple[int, str, str]]:
         self.cursor.execute("SELECT * FROM ship_providers")
         return self.cursor.fetchall()
 
-    def insert_shipment(self, code: str, provider_name: str, is_delivered: bool = False) -> str:
+    def insert_shipment(self, code: str, provider_name: str, is_delivered: bool = False,
+                        tracking_number: str = None) -> str:
+        """Adds a shipment; `tracking_number` is what the carrier is sent instead of the code, if it differs."""
         provider_id = self.get_provider_id(provider_name)
         if provider_id is None:
             raise ValueError(f"Provider '{provider_name}' not found.")
         shipment_id = str(uuid.uuid4())
         status = 1 if is_delivered else 0
-        self.cursor.execute("INSERT INTO shipments (ID, CODE, PROVIDER_ID, STATUS) VALUES (?, ?, ?, ?)",
-                            (shipment_id, code, provider_id, status))
-        self.conn.commit()
+        self.cursor.execute("INSERT INTO shipments (ID, CODE, PROVIDER_ID, STATUS, TRACKING_NUMBER) VALUES (?, ?, ?, ?, ?)",
+                            (shipment_id, code, provider_id, status, tracking_number))
+        self._commit()
         return shipment_id
 
+    def import_shipments(self, shipments: Iterable[Tuple[str, ...]]) -> ImportResult:
+        """Adds many (code, provider_name) pairs to shipments and current_tracking in one transaction.
+
+        A pair may carry the shipment's tracking number as a third item (see
+        insert_shipment). Codes already stored for the same provider, or
+        repeated in the input, are skipped, as are pairs naming an unknown
+        provider.
+
+        Returns:
+            The (ID, CODE) of every shipment added, the skipped duplicate codes
+            and the unknown provider names.
+        """
+        wanted: Dict[Tuple[str, int], Optional[str]] = {}
+        duplicates = []
+        unknown = []
+        for shipment in shipments:
+            code, provider_name = shipment[:2]
+            provider_id = self.get_provider_id(provider_name)
+            if provider_id is None:
+                if provider_name not in unknown:
+                    unknown.append(provider_name)
+            elif (code, provider_id) in wanted:
+                duplicates.append(code)
+            else:
+                wanted[code, provider_id] = shipment[2] if len(shipment) > 2 else None
+
+        keys = list(wanted)
+        with self.transaction():
+            # Look the codes up through idx_shipments_code, staying under SQLite's bound-parameter limit.
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i + 500]
+                self.cursor.execute(f"SELECT CODE, PROVIDER_ID FROM shipments WHERE CODE IN ({', '.join('?' * len(chunk))})",
+                                    [code for code, _ in chunk])
+                for existing in self.cursor.fetchall():
+                    if tuple(existing) in wanted:
+                        del wanted[tuple(existing)]
+                        duplicates.append(existing[0])
+
+            rows = [(str(uuid.uuid4()), code, provider_id, tracking_number)
+                    for (code, provider_id), tracking_number in wanted.items()]
+            self.cursor.executemany("INSERT INTO shipments (ID, CODE, PROVIDER_ID, STATUS, TRACKING_NUMBER) "
+                                    "VALUES (?, ?, ?, 0, ?)", rows)
+            self.cursor.executemany("INSERT OR IGNORE INTO current_tracking (SHIPMENT_ID) VALUES (?)",
+                                    ((row[0],) for row in rows))
+        return ImportResult([(row[0], row[1]) for row in rows], duplicates, unknown)
+
     def update_shipment_status(self, shipment_id: str, is_delivered: bool) -> bool:
         try:
             status = 1 if is_delivered else 0
             self.cursor.execute("UPDATE shipments SET STATUS = ? WHERE ID = ?", (status, shipment_id))
-            self.conn.commit()
+            self._commit()
             return True
         except sqlite3.Error as e:
+            self._rollback()
             print(f"Database error during update: {e}")
             return False
 
@@ -107,6 +312,7 @@ class Database:
             return None  # Not found by ID or CODE
 
         except sqlite3.Error as e:
+            self._rollback()
             print(f"Database error: {e}")
             return None
 
@@ -120,6 +326,47 @@ class Database:
         rows = self.cursor.fetchall()
         return [(row[0], row[1], row[2], bool(row[3])) for row in rows]
     
+    def get_ongoing_shipments_page(self, after_id: str = None, limit: int = 20) -> List[Tuple[str, str, str]]:
+        """Returns (ID, CODE, PROVIDER_NAME) of up to `limit` undelivered shipments, ordered by ID.
+
+        Pass the ID of the last row as `after_id` to fetch the next page; only
+        that page is read, however many shipments there are.
+        """
+        self.cursor.execute("""
+            SELECT s.ID, s.CODE, p.NAME
+            FROM shipments s
+            JOIN ship_providers p ON p.ID = s.PROVIDER_ID
+            WHERE s.STATUS = 0 AND s.ID > ?
+            ORDER BY s.ID
+            LIMIT ?
+        """, (after_id or "", limit))
+        return self.cursor.fetchall()
+
+    def iter_shipment_history(self, batch_size: int = 1000) -> Iterator[Tuple[str, str, str, bool, Optional[int], Optional[str], Optional[str]]]:
+        """Yields every shipment with its tracking events, without loading them all at once.
+
+        Rows are (ID, CODE, PROVIDER_NAME, DELIVERED, EVENT_TIME, EVENT_STATUS,
+        EVENT_MESSAGE), grouped by shipment with events oldest first. A shipment
+        without stored events yields one row with None event fields. Uses its
+        own cursor, so other calls can be made while iterating.
+        """
+        cursor = self.conn.execute("""
+            SELECT s.ID, s.CODE, p.NAME, s.STATUS, e.EVENT_TIME, e.STATUS, e.MESSAGE
+            FROM shipments s
+            JOIN ship_providers p ON p.ID = s.PROVIDER_ID
+            LEFT JOIN tracking_events e ON e.SHIPMENT_ID = s.ID
+            ORDER BY s.ID, e.EVENT_TIME
+        """)
+        try:
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    return
+                for row in rows:
+                    yield row[0], row[1], row[2], bool(row[3]), row[4], row[5], row[6]
+        finally:
+            cursor.close()
+
     def add_to_current_tracking(self, shipment_id: str) -> bool:
         """Adds a shipment to current_tracking, but only if the shipment exists in the shipments table.
 
@@ -134,27 +381,31 @@ class Database:
             if self.cursor.fetchone():  # Check if shipment exists
                 try:
                     self.cursor.execute("INSERT INTO current_tracking (SHIPMENT_ID) VALUES (?)", (shipment_id,))
-                    self.conn.commit()
+                    self._commit()
                     return True
                 except sqlite3.IntegrityError:
+                    self._rollback()
                     print(f"Shipment '{shipment_id}' already in current_tracking.")
                     return True  # Already in tracking, consider this a success
                 except sqlite3.Error as e:
+                    self._rollback()
                     print(f"Database error adding to current_tracking: {e}")
                     return False
             else:
                 print(f"Shipment '{shipment_id}' not found in shipments table.")
                 return False
         except sqlite3.Error as e:
+            self._rollback()
             print(f"Database error checking shipment existence: {e}")
             return False
 
     def remove_from_current_tracking(self, shipment_id: str) -> bool:
         try:
             self.cursor.execute("DELETE FROM current_tracking WHERE SHIPMENT_ID = ?", (shipment_id,))
-            self.conn.commit()
+            self._commit()
             return True
         except sqlite3.Error as e:
+            self._rollback()
             print(f"Database error: {e}")
             return False
 
@@ -162,16 +413,318 @@ class Database:
         self.cursor.execute("SELECT * FROM current_tracking")
         return self.cursor.fetchall()
 
+    def get_tracked_shipments(self) -> List[Tuple[str, str, str, Optional[float]]]:
+        """Returns (ID, CODE, PROVIDER_NAME, NEXT_POLL) of the undelivered shipments listed in current_tracking."""
+        self.cursor.execute("""
+            SELECT s.ID, s.CODE, p.NAME, c.NEXT_POLL
+            FROM current_tracking c
+            JOIN shipments s ON s.ID = c.SHIPMENT_ID
+            JOIN ship_providers p ON p.ID = s.PROVIDER_ID
+            WHERE s.STATUS = 0
+        """)
+        return self.cursor.fetchall()
+
+    def get_poll_states(self, after_row: int = 0) -> List[Tuple[int, str, str, str, Optional[float], Optional[int], Optional[str], Optional[str]]]:
+        """Returns what the poll loop keeps per undelivered shipment in current_tracking.
+
+        Rows are (ROW, ID, CODE, PROVIDER_NAME, NEXT_POLL, LAST_EVENT_TIME,
+        HEAD_HASH, EVENTS_HASH), ordered by ROW, the current_tracking row ID. Row IDs are
+        never reused, so passing the largest one seen as `after_row` returns
+        only the shipments added since.
+        """
+        # CROSS JOIN keeps current_tracking as the outer loop, so `after_row` is a range seek on its rowid.
+        self.cursor.execute("""
+            SELECT c.ID, s.ID, s.CODE, p.NAME, c.NEXT_POLL, t.LAST_EVENT_TIME, t.HEAD_HASH, t.EVENTS_HASH
+            FROM current_tracking c
+            CROSS JOIN shipments s ON s.ID = c.SHIPMENT_ID
+            JOIN ship_providers p ON p.ID = s.PROVIDER_ID
+            LEFT JOIN tracking_state t ON t.SHIPMENT_ID = s.ID
+            WHERE c.ID > ? AND s.STATUS = 0
+            ORDER BY c.ID
+        """, (after_row,))
+        return self.cursor.fetchall()
+
+    def data_version(self) -> int:
+        """A number that changes whenever another connection commits to the database."""
+        self.cursor.execute("PRAGMA data_version")
+        return self.cursor.fetchone()[0]
+
+    def count_tracked_shipments(self) -> int:
+        self.cursor.execute("SELECT COUNT(*) FROM current_tracking c JOIN shipments s ON s.ID = c.SHIPMENT_ID "
+                            "WHERE s.STATUS = 0")
+        return self.cursor.fetchone()[0]
+
+    def get_tracked_ids(self) -> List[str]:
+        self.cursor.execute("SELECT s.ID FROM current_tracking c JOIN shipments s ON s.ID = c.SHIPMENT_ID "
+                            "WHERE s.STATUS = 0")
+        return [row[0] for row in self.cursor.fetchall()]
+
+    def claim_shipments(self, owner: str, now: float, lease_duration: float,
+                        busy: Iterable[str] = ()) -> Optional[List[Tuple[str, str, str, Optional[float]]]]:
+        """Renews `owner`'s leases and rebalances the tracked shipments between the live workers.
+
+        Every worker that claimed within the last `lease_duration` seconds counts
+        as live and is entitled to an equal share. Owners holding more than their
+        share release the excess, other than the `busy` shipment IDs; owners
+        holding less take unowned shipments and ones whose lease expired. Runs
+        as one write transaction, so two workers never claim the same shipment.
+
+        Returns:
+            (ID, CODE, PROVIDER_NAME, NEXT_POLL) of the shipments leased to `owner`
+            until `now + lease_duration`, or None on a database error.
+        """
+        expires = now + lease_duration
+        try:
+            with self.transaction():
+                self.cursor.execute("INSERT OR REPLACE INTO poller_workers (ID, LAST_SEEN) VALUES (?, ?)", (owner, now))
+                self.cursor.execute("DELETE FROM poller_workers WHERE LAST_SEEN < ?", (now - lease_duration,))
+                self.cursor.execute("SELECT COUNT(*) FROM poller_workers")
+                workers = self.cursor.fetchone()[0]
+                self.cursor.execute("SELECT COUNT(*) FROM current_tracking c JOIN shipments s ON s.ID = c.SHIPMENT_ID "
+                                    "WHERE s.STATUS = 0")
+                share = -(-self.cursor.fetchone()[0] // workers)
+
+                self.cursor.execute("UPDATE current_tracking SET LEASE_EXPIRES = ? WHERE LEASE_OWNER = ?", (expires, owner))
+                held = self.cursor.rowcount
+                if held > share:
+                    # Hand over the idle shipments that are due last, so the new owner isn't rushed.
+                    self.cursor.execute("CREATE TEMP TABLE IF NOT EXISTS busy_shipments (ID TEXT PRIMARY KEY)")
+                    self.cursor.execute("DELETE FROM busy_shipments")
+                    self.cursor.executemany("INSERT OR IGNORE INTO busy_shipments (ID) VALUES (?)",
+                                            ((shipment_id,) for shipment_id in busy))
+                    self.cursor.execute("""
+                        UPDATE current_tracking SET LEASE_OWNER = NULL, LEASE_EXPIRES = NULL
+                        WHERE ID IN (SELECT ID FROM current_tracking WHERE LEASE_OWNER = ?
+                                     AND SHIPMENT_ID NOT IN (SELECT ID FROM busy_shipments)
+                                     ORDER BY NEXT_POLL DESC LIMIT ?)
+                    """, (owner, held - share))
+                elif held < share:
+                    self.cursor.execute("""
+                        UPDATE current_tracking SET LEASE_OWNER = ?, LEASE_EXPIRES = ?
+                        WHERE ID IN (SELECT c.ID FROM current_tracking c JOIN shipments s ON s.ID = c.SHIPMENT_ID
+                                     WHERE s.STATUS = 0 AND (c.LEASE_EXPIRES IS NULL OR c.LEASE_EXPIRES < ?)
+                                     LIMIT ?)
+                    """, (owner, expires, now, share - held))
+
+                self.cursor.execute("""
+                    SELECT s.ID, s.CODE, p.NAME, c.NEXT_POLL
+                    FROM current_tracking c
+                    JOIN shipments s ON s.ID = c.SHIPMENT_ID
+                    JOIN ship_providers p ON p.ID = s.PROVIDER_ID
+                    WHERE c.LEASE_OWNER = ? AND s.STATUS = 0
+                """, (owner,))
+                return self.cursor.fetchall()
+        except sqlite3.Error as e:
+            self._rollback()
+            print(f"Database error claiming shipments: {e}")
+            return None
+
+    def release_shipments(self, owner: str) -> bool:
+        """Gives up all of `owner`'s leases, e.g. on shutdown, so other workers take over at once."""
+        try:
+            with self.transaction():
+                self.cursor.execute("UPDATE current_tracking SET LEASE_OWNER = NULL, LEASE_EXPIRES = NULL "
+                                    "WHERE LEASE_OWNER = ?", (owner,))
+                self.cursor.execute("DELETE FROM poller_workers WHERE ID = ?", (owner,))
+            return True
+        except sqlite3.Error as e:
+            self._rollback()
+            print(f"Database error releasing shipments: {e}")
+            return False
+
+    def set_next_polls(self, next_polls: Iterable[Tuple[str, float]]) -> bool:
+        """Stores when each (shipment_id, next_poll) is due, so a new lease owner keeps the schedule."""
+        try:
+            self.cursor.executemany("UPDATE current_tracking SET NEXT_POLL = ? WHERE SHIPMENT_ID = ?",
+                                    ((next_poll, shipment_id) for shipment_id, next_poll in next_polls))
+            self._commit()
+            return True
+        except sqlite3.Error as e:
+            self._rollback()
+            print(f"Database error: {e}")
+            return False
+
     def update_shipment_status(self, shipment_id: str, status: str) -> bool:
         try:
             self.cursor.execute("UPDATE shipments SET STATUS = ? WHERE ID = ?", (status, shipment_id))
-            self.conn.commit()
+            self._commit()
             if status == "Delivered":
                 self.remove_from_current_tracking(shipment_id)
             return True
         except sqlite3.Error as e:
+            self._rollback()
+            print(f"Database error during update: {e}")
+            return False
+
+    def update_shipment_statuses(self, updates: Iterable[Tuple[str, bool]]) -> bool:
+        """Sets STATUS for many (shipment_id, is_delivered) pairs with one statement."""
+        try:
+            self.cursor.executemany("UPDATE shipments SET STATUS = ? WHERE ID = ?",
+                                    ((1 if is_delivered else 0, shipment_id) for shipment_id, is_delivered in updates))
+            self._commit()
+            return True
+        except sqlite3.Error as e:
+            self._rollback()
             print(f"Database error during update: {e}")
             return False
 
+    def get_tracking_state(self, shipment_id: str) -> Optional[Tuple[int, str, Optional[str]]]:
+        """Returns the (LAST_EVENT_TIME, HEAD_HASH, EVENTS_HASH) fingerprint stored for a shipment."""
+        self.cursor.execute("SELECT LAST_EVENT_TIME, HEAD_HASH, EVENTS_HASH FROM tracking_state WHERE SHIPMENT_ID = ?",
+                            (shipment_id,))
+        row = self.cursor.fetchone()
+        return (row[0], row[1], row[2]) if row else None
+
+    def set_tracking_state(self, shipment_id: str, last_event_time: int, head_hash: str, events_hash: str = None) -> bool:
+        try:
+            self.cursor.execute("INSERT OR REPLACE INTO tracking_state (SHIPMENT_ID, LAST_EVENT_TIME, HEAD_HASH, EVENTS_HASH) "
+                                "VALUES (?, ?, ?, ?)", (shipment_id, last_event_time, head_hash, events_hash))
+            self._commit()
+            return True
+        except sqlite3.Error as e:
+            self._rollback()
+            print(f"Database error: {e}")
+            return False
+
+    def get_tracking_states(self, shipment_ids: Iterable[str]) -> Dict[str, Tuple[int, str, Optional[str]]]:
+        """Returns the stored (LAST_EVENT_TIME, HEAD_HASH, EVENTS_HASH) fingerprints of many shipments, by shipment ID."""
+        shipment_ids = list(shipment_ids)
+        states = {}
+        for i in range(0, len(shipment_ids), 500):
+            chunk = shipment_ids[i:i + 500]
+            self.cursor.execute("SELECT SHIPMENT_ID, LAST_EVENT_TIME, HEAD_HASH, EVENTS_HASH FROM tracking_state "
+                                f"WHERE SHIPMENT_ID IN ({', '.join('?' * len(chunk))})", chunk)
+            for shipment_id, last_event_time, head_hash, events_hash in self.cursor.fetchall():
+                states[shipment_id] = (last_event_time, head_hash, events_hash)
+        return states
+
+    def set_tracking_states(self, states: Iterable[Tuple[str, int, str, Optional[str]]]) -> bool:
+        """Stores many (shipment_id, last_event_time, head_hash, events_hash) fingerprints with one statement."""
+        try:
+            self.cursor.executemany("INSERT OR REPLACE INTO tracking_state (SHIPMENT_ID, LAST_EVENT_TIME, HEAD_HASH, EVENTS_HASH) "
+                                    "VALUES (?, ?, ?, ?)", states)
+            self._commit()
+            return True
+        except sqlite3.Error as e:
+            self._rollback()
+            print(f"Database error: {e}")
+            return False
+
+    def add_tracking_events(self, events: Iterable[Tuple[str, int, str, str, str]]) -> int:
+        """Bulk inserts tracking events, skipping the ones already stored.
+
+        Args:
+            events: (SHIPMENT_ID, EVENT_TIME, EVENT_ID, STATUS, MESSAGE) rows.
+
+        Returns:
+            The number of events inserted.
+        """
+        try:
+            before = self.conn.total_changes
+            self.cursor.executemany(
+                "INSERT OR IGNORE INTO tracking_events (SHIPMENT_ID, EVENT_TIME, EVENT_ID, STATUS, MESSAGE) VALUES (?, ?, ?, ?, ?)",
+                events)
+            self._commit()
+            return self.conn.total_changes - before
+        except sqlite3.Error as e:
+            self._rollback()
+            print(f"Database error: {e}")
+            return 0
+
+    def get_tracking_history(self, shipment_id: str, limit: int = None, before: int = None) -> List[Tuple[int, str, str]]:
+        """Returns (EVENT_TIME, STATUS, MESSAGE) for a shipment, newest first.
+
+        Pass the EVENT_TIME of the last row as `before` to fetch the next page.
+        """
+        query = "SELECT EVENT_TIME, STATUS, MESSAGE FROM tracking_events WHERE SHIPMENT_ID = ?"
+        params: list = [shipment_id]
+        if before is not None:
+            query += " AND EVENT_TIME < ?"
+            params.append(before)
+        query += " ORDER BY EVENT_TIME DESC"
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+        self.cursor.execute(query, params)
+        return self.cursor.fetchall()
+
+    def get_tracking_numbers(self, shipment_ids: Iterable[str]) -> Dict[str, str]:
+        """Returns the TRACKING_NUMBER of those of the shipments that have one, by shipment ID."""
+        shipment_ids = list(shipment_ids)
+        numbers = {}
+        for i in range(0, len(shipment_ids), 500):
+            chunk = shipment_ids[i:i + 500]
+            self.cursor.execute(f"SELECT ID, TRACKING_NUMBER FROM shipments WHERE ID IN ({', '.join('?' * len(chunk))}) "
+                                "AND TRACKING_NUMBER IS NOT NULL", chunk)
+            numbers.update(self.cursor.fetchall())
+        return numbers
+
+    def get_tracking_event_ids(self, shipment_id: str) -> Set[str]:
+        """Returns the EVENT_IDs stored for a shipment."""
+        self.cursor.execute("SELECT EVENT_ID FROM tracking_events WHERE SHIPMENT_ID = ?", (shipment_id,))
+        return {row[0] for row in self.cursor.fetchall()}
+
+    def get_events_between(self, start: int, end: int) -> List[Tuple[str, int, str, str]]:
+        """Returns (SHIPMENT_ID, EVENT_TIME, STATUS, MESSAGE) for events with start <= EVENT_TIME < end."""
+        self.cursor.execute("SELECT SHIPMENT_ID, EVENT_TIME, STATUS, MESSAGE FROM tracking_events "
+                            "WHERE EVENT_TIME >= ? AND EVENT_TIME < ? ORDER BY EVENT_TIME", (start, end))
+        return self.cursor.fetchall()
+
+    def get_transit_stats(self) -> List[Tuple[str, str, str, str]]:
+        """Returns every stored (PROVIDER, METRIC, STATUS, SKETCH) delivery-time aggregate."""
+        self.cursor.execute("SELECT PROVIDER, METRIC, STATUS, SKETCH FROM transit_stats")
+        return self.cursor.fetchall()
+
+    def save_transit_stats(self, stats: Iterable[Tuple[str, str, str, str]]) -> bool:
+        """Stores many (PROVIDER, METRIC, STATUS, SKETCH) aggregates, replacing the ones with the same key."""
+        try:
+            self.cursor.executemany("INSERT OR REPLACE INTO transit_stats (PROVIDER, METRIC, STATUS, SKETCH) "
+                                    "VALUES (?, ?, ?, ?)", stats)
+            self._commit()
+            return True
+        except sqlite3.Error as e:
+            self._rollback()
+            print(f"Database error: {e}")
+            return False
+
+    def enqueue_notification(self, chat_id: str, text: str, attempts: int, next_attempt: float) -> Optional[int]:
+        """Persists a notification that failed to send so it can be retried later."""
+        try:
+            self.cursor.execute("INSERT INTO notification_queue (CHAT_ID, TEXT, ATTEMPTS, NEXT_ATTEMPT) VALUES (?, ?, ?, ?)",
+                                (str(chat_id), text, attempts, next_attempt))
+            self._commit()
+            return self.cursor.lastrowid
+        except sqlite3.Error as e:
+            self._rollback()
+            print(f"Database error: {e}")
+            return None
+
+    def get_due_notifications(self, now: float, limit: int = 100) -> List[Tuple[int, str, str, int]]:
+        """Returns (ID, CHAT_ID, TEXT, ATTEMPTS) of queued notifications due at `now`, oldest first."""
+        self.cursor.execute("SELECT ID, CHAT_ID, TEXT, ATTEMPTS FROM notification_queue WHERE NEXT_ATTEMPT <= ? "
+                            "ORDER BY NEXT_ATTEMPT LIMIT ?", (now, limit))
+        return self.cursor.fetchall()
+
+    def reschedule_notification(self, notification_id: int, attempts: int, next_attempt: float) -> bool:
+        try:
+            self.cursor.execute("UPDATE notification_queue SET ATTEMPTS = ?, NEXT_ATTEMPT = ? WHERE ID = ?",
+                                (attempts, next_attempt, notification_id))
+            self._commit()
+            return True
+        except sqlite3.Error as e:
+            self._rollback()
+            print(f"Database error: {e}")
+            return False
+
+    def delete_notification(self, notification_id: int) -> bool:
+        try:
+            self.cursor.execute("DELETE FROM notification_queue WHERE ID = ?", (notification_id,))
+            self._commit()
+            return True
+        except sqlite3.Error as e:
+            self._rollback()
+            print(f"Database error: {e}")
+            return False
+
     def close(self):
         self.conn.close()
@@ -0,0 +1,55 @@
+import csv
+import io
+import json
+from datetime import datetime, timezone
+from itertools import groupby
+from typing import BinaryIO, Iterable, Iterator, Tuple
+
+from Database import Database
+
+EXPORT_FORMATS = ("csv", "jsonl")
+CSV_HEADER = ("shipment_id", "code", "provider", "delivered", "event_time", "event_status", "event_message")
+
+HistoryRow = Tuple[str, str, str, bool, int, str, str]
+
+
+def _isoformat(timestamp: int) -> str:
+    return datetime.fromtimestamp(timestamp, timezone.utc).isoformat() if timestamp is not None else ""
+
+
+def csv_lines(rows: Iterable[HistoryRow]) -> Iterator[str]:
+    """Yields a CSV document one line at a time, one row per tracking event."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def line(values) -> str:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerow(values)
+        return buffer.getvalue()
+
+    yield line(CSV_HEADER)
+    for shipment_id, code, provider, delivered, event_time, status, message in rows:
+        yield line((shipment_id, code, provider, int(delivered), _isoformat(event_time), status or "", message or ""))
+
+
+def jsonl_lines(rows: Iterable[HistoryRow]) -> Iterator[str]:
+    """Yields one JSON object per shipment, with its events nested, one line at a time."""
+    for (shipment_id, code, provider, delivered), group in groupby(rows, key=lambda row: row[:4]):
+        events = [{"time": _isoformat(row[4]), "status": row[5], "message": row[6]}
+                  for row in group if row[4] is not None]
+        yield json.dumps({"id": shipment_id, "code": code, "provider": provider, "delivered": delivered,
+                          "events": events}, ensure_ascii=False) + "\n"
+
+
+def write_export(db: Database, file: BinaryIO, export_format: str = "csv") -> int:
+    """Streams every shipment and its history into `file` as UTF-8 CSV or JSONL.
+
+    Rows are read and written one batch at a time, so memory use doesn't grow
+    with the number of shipments. Returns the number of bytes written.
+    """
+    lines = jsonl_lines if export_format == "jsonl" else csv_lines
+    written = 0
+    for line in lines(db.iter_shipment_history()):
+        written += file.write(line.encode("utf-8"))
+    return written
@@ -0,0 +1,47 @@
+import csv
+import io
+from typing import Iterable, List, Optional, Tuple
+
+MAX_IMPORT_BYTES = 5 * 1024 * 1024
+
+
+def split_tracking_number(value: str) -> Tuple[str, Optional[str]]:
+    """Splits `code|token` into the code and the whole value, the tracking number SPX is sent.
+
+    A plain code has no tracking number of its own.
+    """
+    if "|" not in value:
+        return value, None
+    return value.split("|", 1)[0], value
+
+
+def parse_shipment_lines(lines: Iterable[str]) -> Tuple[List[Tuple[str, str, Optional[str]]], List[int]]:
+    """Parses `code provider` pairs, one per line, separated by commas, semicolons or whitespace.
+
+    Blank lines, `#` comments and a `code,provider` header are ignored. A code
+    given as `code|token` keeps the whole value as its tracking number.
+
+    Returns:
+        The (code, provider, tracking_number) triples and the 1-based numbers of the lines that couldn't be parsed.
+    """
+    shipments = []
+    invalid = []
+    for number, line in enumerate(lines, start=1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        parts = line.replace(",", " ").replace(";", " ").split()
+        if len(parts) != 2:
+            invalid.append(number)
+        elif (parts[0].lower(), parts[1].lower()) != ("code", "provider"):
+            code, tracking_number = split_tracking_number(parts[0])
+            shipments.append((code, parts[1], tracking_number))
+    return shipments, invalid
+
+
+def parse_shipment_csv(data: bytes) -> Tuple[List[Tuple[str, str, Optional[str]]], List[int]]:
+    """Parses an uploaded CSV with the code in the first column and the provider in the second."""
+    text = data.decode("utf-8-sig")
+    rows = csv.reader(io.StringIO(text))
+    return parse_shipment_lines(" ".join(cell.strip() for cell in row[:2]) if len(row) >= 2 else ",".join(row)
+                                for row in rows)
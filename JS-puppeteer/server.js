@@ -0,0 +1,181 @@
+// Long-lived screenshot service: one Chromium with a pool of warm pages behind a bounded queue.
+//
+// POST /screenshot with a JSON body {"code", "url", "selector"?, "previous_hash"?} answers with the PNG
+// and its content hash in the X-Content-Hash header. The hash covers the tracking text on the page,
+// so when it equals `previous_hash` nothing changed and the reply is an empty 304 without a capture.
+// Concurrent requests for the same code share one capture.
+//
+// Run with: node server.js  (SCREENSHOT_PORT, SCREENSHOT_PAGES, SCREENSHOT_QUEUE to tune)
+const http = require('http');
+const crypto = require('crypto');
+const puppeteer = require('puppeteer');
+
+const PORT = parseInt(process.env.SCREENSHOT_PORT || '8931', 10);
+const POOL_SIZE = parseInt(process.env.SCREENSHOT_PAGES || '4', 10);
+const MAX_QUEUE = parseInt(process.env.SCREENSHOT_QUEUE || '64', 10);
+// Pages are replaced after this many captures so leaked memory doesn't pile up.
+const MAX_USES_PER_PAGE = 200;
+const NAVIGATION_TIMEOUT = 15000;
+const VIEWPORT = { width: 1500, height: 920, deviceScaleFactor: 1, isMobile: false };
+
+let browser = null;
+const idlePages = [];
+const waiting = [];
+const inFlight = new Map();
+const stats = { captures: 0, unchanged: 0, coalesced: 0, rejected: 0 };
+
+async function newPage() {
+    const page = await browser.newPage();
+    await page.setViewport(VIEWPORT);
+    page.setDefaultNavigationTimeout(NAVIGATION_TIMEOUT);
+    page.uses = 0;
+    return page;
+}
+
+function acquirePage() {
+    if (idlePages.length > 0) {
+        return Promise.resolve(idlePages.pop());
+    }
+    return new Promise((resolve) => waiting.push(resolve));
+}
+
+async function releasePage(page) {
+    if (page.uses >= MAX_USES_PER_PAGE || page.isClosed()) {
+        await page.close().catch(() => {});
+        page = await newPage();
+    }
+    const next = waiting.shift();
+    if (next) {
+        next(page);
+    } else {
+        idlePages.push(page);
+    }
+}
+
+async function capture({ url, selector, previous_hash: previousHash }) {
+    const page = await acquirePage();
+    try {
+        page.uses += 1;
+        await page.goto(url, { waitUntil: 'networkidle2' });
+        const text = await page.evaluate((sel) => {
+            const element = sel ? document.querySelector(sel) : document.body;
+            return element ? element.innerText : '';
+        }, selector || null);
+        const hash = crypto.createHash('sha256').update(text).digest('hex').slice(0, 32);
+        if (hash === previousHash) {
+            stats.unchanged += 1;
+            return { hash, image: null };
+        }
+        const image = await page.screenshot({ type: 'png', fullPage: true });
+        stats.captures += 1;
+        return { hash, image: Buffer.from(image) };
+    } finally {
+        // Blank the page so the next capture doesn't wait on this site's timers.
+        await page.goto('about:blank').catch(() => {});
+        await releasePage(page);
+    }
+}
+
+function captureOnce(request) {
+    // Requests for a code that is already being captured share the result.
+    const key = `${request.code}|${request.previous_hash || ''}`;
+    const pending = inFlight.get(key);
+    if (pending) {
+        stats.coalesced += 1;
+        return pending;
+    }
+    const promise = capture(request).finally(() => inFlight.delete(key));
+    inFlight.set(key, promise);
+    return promise;
+}
+
+function readJson(req) {
+    return new Promise((resolve, reject) => {
+        const chunks = [];
+        req.on('data', (chunk) => chunks.push(chunk));
+        req.on('end', () => {
+            try {
+                resolve(JSON.parse(Buffer.concat(chunks).toString('utf8') || '{}'));
+            } catch (error) {
+                reject(error);
+            }
+        });
+        req.on('error', reject);
+    });
+}
+
+async function handle(req, res) {
+    if (req.method === 'GET' && req.url === '/health') {
+        res.writeHead(200, { 'Content-Type': 'application/json' });
+        res.end(JSON.stringify({ idle: idlePages.length, queued: waiting.length, ...stats }));
+        return;
+    }
+    if (req.method !== 'POST' || req.url !== '/screenshot') {
+        res.writeHead(404).end();
+        return;
+    }
+    let request;
+    try {
+        request = await readJson(req);
+    } catch (error) {
+        res.writeHead(400).end('Invalid JSON');
+        return;
+    }
+    if (!request.code || !request.url) {
+        res.writeHead(400).end('code and url are required');
+        return;
+    }
+    if (waiting.length >= MAX_QUEUE && !inFlight.has(`${request.code}|${request.previous_hash || ''}`)) {
+        stats.rejected += 1;
+        res.writeHead(503, { 'Retry-After': '1' }).end('Queue full');
+        return;
+    }
+    try {
+        const { hash, image } = await captureOnce(request);
+        if (!image) {
+            res.writeHead(304, { 'X-Content-Hash': hash }).end();
+            return;
+        }
+        res.writeHead(200, { 'Content-Type': 'image/png', 'Content-Length': image.length, 'X-Content-Hash': hash });
+        res.end(image);
+    } catch (error) {
+        console.error(`An error occurred capturing ${request.code}: ${error}`);
+        res.writeHead(502).end(String(error));
+    }
+}
+
+async function main() {
+    browser = await puppeteer.launch({
+        headless: true,
+        args: ['--no-sandbox', '--disable-setuid-sandbox', '--disable-dev-shm-usage']
+    });
+    for (let i = 0; i < POOL_SIZE; i++) {
+        idlePages.push(await newPage());
+    }
+    const server = http.createServer((req, res) => {
+        handle(req, res).catch((error) => {
+            console.error(`An error occurred: ${error}`);
+            if (!res.headersSent) {
+                res.writeHead(500);
+            }
+            res.end();
+        });
+    });
+    server.keepAliveTimeout = 60000;
+    server.listen(PORT, '127.0.0.1', () => {
+        console.log(`Screenshot service listening on 127.0.0.1:${PORT} with ${POOL_SIZE} pages`);
+    });
+
+    const shutdown = async () => {
+        server.close();
+        await browser.close();
+        process.exit(0);
+    };
+    process.once('SIGINT', shutdown);
+    process.once('SIGTERM', shutdown);
+}
+
+main().catch((error) => {
+    console.error(`An error occurred: ${error}`);
+    process.exit(1);
+});
@@ -0,0 +1,139 @@
+import asyncio
+import logging
+from typing import Dict, List, Optional, Sequence
+
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, start_http_server
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds in seconds, from a cached lookup to a timed-out upstream call.
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Our own registry, so /metrics and summarize() show only this app's series.
+REGISTRY = CollectorRegistry()
+
+
+def counter(name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+    return Counter(name, documentation, labelnames, registry=REGISTRY)
+
+
+def gauge(name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+    return Gauge(name, documentation, labelnames, registry=REGISTRY)
+
+
+def histogram(name: str, documentation: str, labelnames: Sequence[str] = (),
+              buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+    return Histogram(name, documentation, labelnames, buckets=buckets, registry=REGISTRY)
+
+
+UPSTREAM_FETCH_SECONDS = histogram("shopee_alert_upstream_fetch_seconds",
+                                   "Latency of tracking lookups sent to a carrier.", ("provider",))
+UPSTREAM_RESPONSES = counter("shopee_alert_upstream_responses_total",
+                             "Carrier responses by HTTP status; 'error' when no response arrived.",
+                             ("provider", "status"))
+POLL_CYCLE_SECONDS = histogram("shopee_alert_poll_cycle_seconds",
+                               "Time from dispatching a set of due shipments until all their results are in.")
+POLL_LAG_SECONDS = gauge("shopee_alert_poll_lag_seconds",
+                         "How far behind its due time the most overdue shipment was dispatched.")
+RESULT_QUEUE_DEPTH = gauge("shopee_alert_result_queue_depth", "Fetched results waiting to be handled.")
+RESULT_BATCH_SECONDS = histogram("shopee_alert_result_batch_seconds",
+                                 "Time spent handling one batch of results, including its transaction.")
+SCHEDULER_STATS = gauge("shopee_alert_scheduler_stats",
+                        "PollScheduler.metrics() of the running poller: tracked, polls, changes, delivered, "
+                        "baseline_polls (what polling every min_interval would have made) and saved_requests.",
+                        ("stat",))
+DB_CALL_SECONDS = histogram("shopee_alert_db_call_seconds",
+                            "Latency of database calls: the poll loop's own queries, and calls made through "
+                            "AsyncDatabase including queueing.",
+                            ("method",))
+DB_COMMIT_SECONDS = histogram("shopee_alert_db_commit_seconds", "Latency of database commits.")
+TELEGRAM_SEND_SECONDS = histogram("shopee_alert_telegram_send_seconds",
+                                  "Latency of Telegram Bot API send calls, excluding rate-limit waits.",
+                                  ("method",))
+RESPONSE_CACHE_LOOKUPS = counter("shopee_alert_response_cache_lookups_total",
+                                 "Response cache lookups by outcome: hit, miss or coalesced.", ("outcome",))
+TELEGRAM_RESPONSES = counter("shopee_alert_telegram_responses_total",
+                             "Telegram Bot API responses by HTTP status; 'error' when no response arrived.",
+                             ("method", "status"))
+WEBHOOK_REQUESTS = counter("shopee_alert_webhook_requests_total",
+                           "Webhook requests by outcome: accepted, forbidden, invalid, queue_full or not_found.",
+                           ("outcome",))
+WEBHOOK_QUEUE_DEPTH = gauge("shopee_alert_webhook_queue_depth", "Received updates waiting for a handler.")
+WEBHOOK_UPDATE_SECONDS = histogram("shopee_alert_webhook_update_seconds",
+                                   "Time from receiving an update until its handlers finished.")
+
+
+class MetricsServer:
+    """Serves REGISTRY at /metrics over plain HTTP, for Prometheus or curl.
+
+    prometheus_client runs the server on a daemon thread; this only starts
+    and stops it with the bot.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 9108, registry: CollectorRegistry = REGISTRY):
+        self.host = host
+        self.port = port
+        self.registry = registry
+        self._server = None
+
+    async def __aenter__(self):
+        self._server, _ = start_http_server(self.port, self.host, self.registry)
+        self.port = self._server.server_port
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        # shutdown() waits for the serving thread's next poll, up to half a second.
+        await asyncio.to_thread(self._server.shutdown)
+        self._server.server_close()
+
+
+def _series(name: str, labels: Dict[str, str]) -> str:
+    pairs = ",".join(f'{key}="{value}"' for key, value in labels.items())
+    return f"{name}{{{pairs}}}" if pairs else name
+
+
+def _quantile(buckets: List[tuple], count: float, q: float) -> float:
+    """Estimates the q-quantile as the upper bound of the bucket it falls in."""
+    for bound, cumulative in buckets:
+        if cumulative >= q * count:
+            return bound
+    return float("inf")
+
+
+def summarize(registry: CollectorRegistry = REGISTRY) -> List[str]:
+    """One line per counter, gauge and histogram series that has seen any activity."""
+    lines = []
+    for family in registry.collect():
+        if family.type == "histogram":
+            series: Dict[tuple, Dict[str, object]] = {}
+            for sample in family.samples:
+                labels = {key: value for key, value in sample.labels.items() if key != "le"}
+                entry = series.setdefault(tuple(labels.items()), {"labels": labels, "buckets": []})
+                if sample.name.endswith("_bucket"):
+                    entry["buckets"].append((float(sample.labels["le"]), sample.value))
+                elif sample.name.endswith("_count"):
+                    entry["count"] = sample.value
+                elif sample.name.endswith("_sum"):
+                    entry["sum"] = sample.value
+            for entry in series.values():
+                count: Optional[float] = entry.get("count")
+                if not count:
+                    continue
+                buckets = sorted(entry["buckets"])
+                lines.append(f"{_series(family.name, entry['labels'])}: n={count:g} "
+                             f"mean={entry['sum'] / count * 1000:.1f}ms "
+                             f"p50<={_quantile(buckets, count, 0.5) * 1000:g}ms "
+                             f"p99<={_quantile(buckets, count, 0.99) * 1000:g}ms")
+        elif family.type in ("counter", "gauge"):
+            for sample in family.samples:
+                if not sample.name.endswith("_created") and sample.value:
+                    lines.append(f"{_series(sample.name, sample.labels)}: {sample.value:g}")
+    return lines
+
+
+async def log_summary(interval: float = 60, registry: CollectorRegistry = REGISTRY):
+    """Logs `summarize()` every `interval` seconds, forever."""
+    while True:
+        await asyncio.sleep(interval)
+        for line in summarize(registry):
+            logger.info(line)
@@ -0,0 +1,258 @@
+import asyncio
+import time
+from typing import Dict, List, Optional, Set
+
+import httpx
+
+from Database import Database
+from Metrics import TELEGRAM_RESPONSES, TELEGRAM_SEND_SECONDS
+
+TELEGRAM_API_URL = "https://api.telegram.org"
+MAX_MESSAGE_LENGTH = 4096
+
+
+class TokenBucket:
+    """Allows `rate` acquisitions per second on average, with bursts of up to `capacity`."""
+
+    def __init__(self, rate: float, capacity: float = 1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        while True:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+def retry_after(response: httpx.Response) -> float:
+    """The seconds a 429 asks to wait, or 1 if its body doesn't say."""
+    try:
+        return float(response.json()["parameters"]["retry_after"])
+    except (ValueError, TypeError, KeyError):
+        return 1.0
+
+
+def is_permanent(response: Optional[httpx.Response]) -> bool:
+    """Whether resending the same request can't help, e.g. a 400 for text Telegram can't parse."""
+    return response is not None and 400 <= response.status_code < 500 and response.status_code != 429
+
+
+def pack_messages(texts: List[str], limit: int = MAX_MESSAGE_LENGTH) -> List[str]:
+    """Joins texts into as few messages as fit Telegram's length limit."""
+    messages = []
+    current = ""
+    for text in texts:
+        text = text[:limit]
+        if current and len(current) + 2 + len(text) > limit:
+            messages.append(current)
+            current = ""
+        current = f"{current}\n\n{text}" if current else text
+    if current:
+        messages.append(current)
+    return messages
+
+
+class NotificationDispatcher:
+    """Sends Telegram notifications through one connection pool without hitting rate limits.
+
+    Notifications for the same chat that arrive within `merge_window` seconds
+    are merged into one message. Sends are paced by a global token bucket and
+    one bucket per chat. A 429 pauses all sends for the `retry_after` Telegram
+    asks for and puts the message back in line; any other failure is persisted
+    in notification_queue and retried with exponential backoff. Messages
+    rejected with another 4xx are dropped after `max_attempts`, since
+    retrying the same request won't change the answer.
+    """
+
+    def __init__(self, bot_token: str, db: Database = None, global_rate: float = 30, per_chat_rate: float = 1,
+                 merge_window: float = 1.0, workers: int = 8, api_url: str = TELEGRAM_API_URL,
+                 retry_interval: float = 5, max_backoff: float = 3600, max_attempts: int = 5):
+        self.send_url = f"{api_url}/bot{bot_token}/sendMessage"
+        self.photo_url = f"{api_url}/bot{bot_token}/sendPhoto"
+        self._db = db
+        self.per_chat_rate = per_chat_rate
+        self.merge_window = merge_window
+        self.workers = workers
+        self.retry_interval = retry_interval
+        self.max_backoff = max_backoff
+        self.max_attempts = max_attempts
+        self._global_bucket = TokenBucket(global_rate)
+        self._chat_buckets: Dict[str, TokenBucket] = {}
+        self._pending: Dict[str, List[str]] = {}
+        self._scheduled: Set[str] = set()
+        self._ready: Optional[asyncio.Queue] = None
+        self._active = 0
+        self._paused_until = 0.0
+        self._client: Optional[httpx.AsyncClient] = None
+        self._tasks: List[asyncio.Task] = []
+        self.sent = 0
+        self.rate_limited = 0
+        self.failed = 0
+        self.dropped = 0
+
+    @property
+    def db(self) -> Database:
+        if self._db is None:
+            self._db = Database.get_instance()
+        return self._db
+
+    async def __aenter__(self):
+        limits = httpx.Limits(max_connections=self.workers, max_keepalive_connections=self.workers)
+        self._client = httpx.AsyncClient(limits=limits, timeout=30)
+        self._ready = asyncio.Queue()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._retry_loop()))
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.drain()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        await self._client.aclose()
+
+    def notify(self, chat_id, text: str):
+        """Queues `text` for `chat_id`; it goes out merged with anything else sent to that chat meanwhile."""
+        chat_id = str(chat_id)
+        self._pending.setdefault(chat_id, []).append(text)
+        if chat_id not in self._scheduled:
+            self._scheduled.add(chat_id)
+            asyncio.get_running_loop().call_later(self.merge_window, self._ready.put_nowait, chat_id)
+
+    async def send_photo(self, chat_id, photo: bytes, caption: str = None) -> bool:
+        """Sends an in-memory PNG to `chat_id`, paced like messages.
+
+        Photos are a best-effort extra to the text notification: a failed one is
+        not persisted for retry, only a 429 is waited out and retried.
+        """
+        chat_id = str(chat_id)
+        data = {"chat_id": chat_id}
+        if caption:
+            data["caption"] = caption
+        while True:
+            await self._wait_for_slot(chat_id)
+            started = time.perf_counter()
+            try:
+                response = await self._client.post(self.photo_url, data=data,
+                                                   files={"photo": ("snapshot.png", photo, "image/png")})
+            except httpx.HTTPError as e:
+                TELEGRAM_RESPONSES.labels("sendPhoto", "error").inc()
+                print(f"Error sending photo: {e}")
+                return False
+            finally:
+                TELEGRAM_SEND_SECONDS.labels("sendPhoto").observe(time.perf_counter() - started)
+            TELEGRAM_RESPONSES.labels("sendPhoto", response.status_code).inc()
+            if response.status_code == 429:
+                self.rate_limited += 1
+                self._paused_until = max(self._paused_until, time.monotonic() + retry_after(response))
+                continue
+            if response.is_success:
+                self.sent += 1
+                return True
+            self.failed += 1
+            print(f"Error sending photo: {response.status_code}")
+            return False
+
+    async def drain(self):
+        """Waits until every queued notification has been sent or persisted for retry."""
+        while self._pending or self._scheduled or self._active:
+            await asyncio.sleep(0.05)
+
+    async def _worker(self):
+        while True:
+            chat_id = await self._ready.get()
+            self._active += 1
+            messages, index = [], 0
+            try:
+                self._scheduled.discard(chat_id)
+                messages = pack_messages(self._pending.pop(chat_id, []))
+                for index, message in enumerate(messages):
+                    if not await self._send(chat_id, message):
+                        # Rate limited: put the unsent messages back at the front of the line.
+                        self._pending.setdefault(chat_id, [])[:0] = messages[index:]
+                        if chat_id not in self._scheduled:
+                            self._scheduled.add(chat_id)
+                            self._ready.put_nowait(chat_id)
+                        break
+            except Exception as e:
+                # Keep the worker alive, and the messages it took, for the retry loop.
+                print(f"Error sending notifications: {e}")
+                for message in messages[index:]:
+                    self.db.enqueue_notification(chat_id, message, 1, time.time() + self.retry_interval)
+            finally:
+                self._active -= 1
+
+    async def _wait_for_slot(self, chat_id: str):
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.per_chat_rate)
+        await bucket.acquire()
+        while time.monotonic() < self._paused_until:
+            await asyncio.sleep(self._paused_until - time.monotonic())
+        await self._global_bucket.acquire()
+
+    async def _post(self, chat_id: str, text: str) -> Optional[httpx.Response]:
+        await self._wait_for_slot(chat_id)
+        payload = {"chat_id": chat_id, "text": text, "parse_mode": "Markdown"}
+        started = time.perf_counter()
+        try:
+            response = await self._client.post(self.send_url, json=payload)
+        except httpx.HTTPError as e:
+            TELEGRAM_RESPONSES.labels("sendMessage", "error").inc()
+            print(f"Error sending message: {e}")
+            return None
+        finally:
+            TELEGRAM_SEND_SECONDS.labels("sendMessage").observe(time.perf_counter() - started)
+        TELEGRAM_RESPONSES.labels("sendMessage", response.status_code).inc()
+        return response
+
+    async def _send(self, chat_id: str, text: str) -> bool:
+        """Sends one message. Returns False only when Telegram asked us to slow down."""
+        response = await self._post(chat_id, text)
+        if response is not None and response.status_code == 429:
+            self.rate_limited += 1
+            self._paused_until = max(self._paused_until, time.monotonic() + retry_after(response))
+            return False
+        if response is not None and response.is_success:
+            self.sent += 1
+            return True
+        self.failed += 1
+        print(f"Error sending message: {response.status_code if response is not None else 'no response'}")
+        self.db.enqueue_notification(chat_id, text, 1, time.time() + self.retry_interval)
+        return True
+
+    async def _retry_loop(self):
+        while True:
+            await asyncio.sleep(self.retry_interval)
+            for notification_id, chat_id, text, attempts in self.db.get_due_notifications(time.time()):
+                try:
+                    await self._retry(notification_id, chat_id, text, attempts)
+                except Exception as e:
+                    print(f"Error retrying notification {notification_id}: {e}")
+
+    async def _retry(self, notification_id: int, chat_id: str, text: str, attempts: int):
+        response = await self._post(chat_id, text)
+        if response is not None and response.is_success:
+            self.sent += 1
+            self.db.delete_notification(notification_id)
+            return
+        if is_permanent(response) and attempts + 1 >= self.max_attempts:
+            self.dropped += 1
+            print(f"Dropping notification {notification_id} after {attempts + 1} attempts: "
+                  f"{response.status_code} {response.text[:200]}")
+            self.db.delete_notification(notification_id)
+            return
+        if response is not None and response.status_code == 429:
+            self._paused_until = max(self._paused_until, time.monotonic() + retry_after(response))
+        backoff = min(self.retry_interval * 2 ** attempts, self.max_backoff)
+        self.db.reschedule_notification(notification_id, attempts + 1, time.time() + backoff)
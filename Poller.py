@@ -0,0 +1,340 @@
+import asyncio
+import sqlite3
+import time
+from contextlib import aclosing
+from typing import AsyncIterator, Awaitable, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from Database import Database
+from Metrics import DB_CALL_SECONDS, POLL_CYCLE_SECONDS, POLL_LAG_SECONDS, RESULT_BATCH_SECONDS, RESULT_QUEUE_DEPTH, SCHEDULER_STATS
+from Providers import TrackingEvent, TrackingProvider, get_provider_class
+from ResponseCache import ResponseCache
+from Scheduler import PollScheduler
+from StateIndex import ShipmentState, StateIndex
+
+Shipment = Tuple[str, str, str]
+ResultHandler = Callable[[Shipment, List[TrackingEvent]], Awaitable[bool]]
+ReleaseHandler = Callable[[Shipment], None]
+BatchHandler = Callable[[bool], None]
+
+
+def is_delivered(events: List[TrackingEvent]) -> bool:
+    """Whether the newest event marks the parcel as delivered."""
+    return bool(events) and events[0].delivered
+
+
+def last_event_time(events: List[TrackingEvent]) -> Optional[float]:
+    """Unix timestamp of the newest event."""
+    return events[0].timestamp if events else None
+
+
+class Poller:
+    """Polls every tracked shipment concurrently through its carrier's provider.
+
+    Shipments are (ID, CODE, PROVIDER_NAME) tuples. Providers are looked up in
+    the registry by name and opened on first use; each has its own connection
+    pools and concurrency limit. All providers share one ResponseCache, so
+    other callers of `fetch` (like /track) reuse the poller's upstream calls.
+
+    With a `worker_id`, several pollers (usually one per process) share the
+    shipments in current_tracking: each only polls the ones it holds a lease
+    on, renews its leases on every refresh and takes over the leases of
+    workers that stopped renewing theirs after `lease_duration` seconds.
+
+    `run` keeps the shipments it polls in `index`, loaded once and then
+    updated incrementally, so a poll cycle doesn't go back to the database
+    for its work list or fingerprints.
+    """
+
+    def __init__(self, db: Database = None, providers: Dict[str, TrackingProvider] = None,
+                 cache: ResponseCache = None, worker_id: str = None, lease_duration: float = 180):
+        self._db = db
+        self.worker_id = worker_id
+        self.lease_duration = lease_duration
+        self.leased_until = float("inf") if worker_id is None else float("-inf")
+        self.cache = cache if cache is not None else ResponseCache()
+        self.providers: Dict[str, TrackingProvider] = {name.upper(): p for name, p in (providers or {}).items()}
+        for provider in self.providers.values():
+            if provider.cache is None:
+                provider.cache = self.cache
+        self.index = StateIndex()
+        self._opened: Set[str] = set()
+        self._unknown: Set[str] = set()
+
+    @property
+    def db(self) -> Database:
+        if self._db is None:
+            self._db = Database.get_instance()
+        return self._db
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if self.worker_id is not None and self._db is not None:
+            self.db.release_shipments(self.worker_id)
+        await asyncio.gather(*(self.providers[name].__aexit__(None, None, None) for name in self._opened))
+        self._opened.clear()
+
+    async def provider(self, name: str) -> Optional[TrackingProvider]:
+        name = name.upper()
+        provider = self.providers.get(name)
+        if provider is None:
+            provider_class = get_provider_class(name)
+            if provider_class is None:
+                if name not in self._unknown:
+                    self._unknown.add(name)
+                    print(f"No tracking provider registered for '{name}'.")
+                return None
+            provider = self.providers[name] = provider_class(cache=self.cache)
+        if name not in self._opened:
+            self._opened.add(name)
+            await provider.__aenter__()
+        return provider
+
+    def get_work(self) -> Optional[List[Tuple[Shipment, Optional[float]]]]:
+        """Returns (shipment, next_poll) for the ongoing shipments this poller is responsible for.
+
+        Without a `worker_id` that is everything listed in current_tracking;
+        otherwise the shipments leased to this worker, whose leases are renewed.
+        Returns None if the leases couldn't be renewed.
+        """
+        if self.worker_id is None:
+            rows = self.db.get_tracked_shipments()
+        else:
+            now = time.time()
+            with DB_CALL_SECONDS.labels("claim_shipments").time():
+                rows = self.db.claim_shipments(self.worker_id, now, self.lease_duration)
+            if rows is None:
+                return None
+            self.leased_until = now + self.lease_duration
+        return [(row[:3], row[3]) for row in rows]
+
+    def _checkpoint(self):
+        # Once a lease has lapsed, the shipment's row may already belong to another worker.
+        if time.time() < self.leased_until:
+            self.index.checkpoint(self.db)
+
+    def refresh_index(self, busy: Iterable[str] = ()) -> Optional[Tuple[List[ShipmentState], List[ShipmentState]]]:
+        """Brings `index` in line with the shipments this poller is responsible for, like `get_work`.
+
+        Next poll times changed since the last refresh are written first, so
+        shipments handed to another worker keep their schedule. The `busy`
+        ones, still being fetched, are not handed over: their stored next poll
+        has passed, so the new owner would fetch them again at once.
+
+        Returns:
+            The added and the removed states, or None if the leases couldn't be renewed.
+        """
+        self._checkpoint()
+        if self.worker_id is None:
+            return self.index.refresh(self.db)
+        now = time.time()
+        with DB_CALL_SECONDS.labels("claim_shipments").time():
+            rows = self.db.claim_shipments(self.worker_id, now, self.lease_duration, busy)
+        if rows is None:
+            return None
+        self.leased_until = now + self.lease_duration
+        return self.index.replace(self.db, rows)
+
+    def _load_tracking_numbers(self, provider: TrackingProvider, shipments: List[Shipment]):
+        """Hands `provider` the tracking numbers stored with `shipments`, if it takes them, once per code."""
+        if provider.tracking_numbers is None:
+            return
+        unseen = [shipment for shipment in shipments if shipment[1] not in provider.tracking_numbers]
+        if unseen:
+            stored = self.db.get_tracking_numbers(shipment[0] for shipment in unseen)
+            for shipment in unseen:
+                provider.tracking_numbers[shipment[1]] = stored.get(shipment[0])
+
+    async def fetch(self, shipment: Shipment) -> Optional[List[TrackingEvent]]:
+        """Fetches the events of one shipment, newest first, or None on failure."""
+        provider = await self.provider(shipment[2])
+        if provider is None:
+            return None
+        self._load_tracking_numbers(provider, [shipment])
+        return await provider.fetch(shipment[1])
+
+    async def fetch_many(self, shipments: List[Shipment]) -> AsyncIterator[Tuple[Shipment, Optional[List[TrackingEvent]]]]:
+        """Yields (shipment, events) as results come in, using each provider's bulk fetch."""
+        by_provider: Dict[str, Dict[str, List[Shipment]]] = {}
+        for shipment in shipments:
+            by_provider.setdefault(shipment[2].upper(), {}).setdefault(shipment[1], []).append(shipment)
+        queue: asyncio.Queue = asyncio.Queue()
+
+        async def fetch_provider(name: str, by_code: Dict[str, List[Shipment]]):
+            provider = await self.provider(name)
+            if provider is None:
+                for same_code in by_code.values():
+                    for shipment in same_code:
+                        await queue.put((shipment, None))
+                return
+            self._load_tracking_numbers(provider, [shipment for same_code in by_code.values() for shipment in same_code])
+            pending = dict(by_code)
+            try:
+                async with aclosing(provider.fetch_many(list(by_code))) as results:
+                    async for code, events in results:
+                        for shipment in pending.pop(code, ()):
+                            await queue.put((shipment, events))
+            except Exception as e:
+                # fetch_many waits for a result per shipment; report the rest as failed rather than hang.
+                print(f"Error fetching {len(pending)} codes from {name}: {e!r}")
+                for same_code in pending.values():
+                    for shipment in same_code:
+                        await queue.put((shipment, None))
+
+        tasks = [asyncio.create_task(fetch_provider(name, by_code)) for name, by_code in by_provider.items()]
+        try:
+            for _ in range(len(shipments)):
+                yield await queue.get()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def poll_once(self, shipments: List[Shipment] = None) -> List[Tuple[Shipment, Optional[List[TrackingEvent]]]]:
+        """Fetches all shipments at once; the cycle takes about as long as the slowest request."""
+        if shipments is None:
+            shipments = [shipment for shipment, _ in self.get_work() or []]
+        return [result async for result in self.fetch_many(shipments)]
+
+    async def run(self, on_result: ResultHandler, scheduler: PollScheduler = None, refresh_interval: float = 60,
+                  on_release: ReleaseHandler = None, on_batch_end: BatchHandler = None):
+        """Polls forever, each shipment whenever `scheduler` says it is due.
+
+        Fetches run in the background and go through each provider's bulk fetch,
+        so a slow provider never delays results from the others. `on_result` is
+        called for every successful fetch and returns whether the events
+        changed, which the scheduler uses to pick the next poll. Results that
+        arrive together are handled in one database transaction, which also
+        stores the fingerprints changed through `index`. Next poll times are
+        written in one batch on every refresh and when polling stops.
+
+        The work list is refreshed every `refresh_interval` seconds, which must
+        be shorter than `lease_duration` in worker mode. `on_release` is called
+        for shipments that left it, e.g. because another worker leased them;
+        results that come in for them afterwards are dropped. `on_batch_end` is
+        called after each batch with whether its transaction committed, for
+        anything `on_result` kept aside until its writes are stored.
+        """
+        if scheduler is None:
+            scheduler = PollScheduler()
+        for stat in scheduler.metrics():
+            SCHEDULER_STATS.labels(stat).set_function(lambda stat=stat: scheduler.metrics()[stat])
+        index = self.index
+        results: asyncio.Queue = asyncio.Queue()
+        in_flight: Set[asyncio.Task] = set()
+        # Shipments popped from the scheduler whose results haven't been handled yet.
+        fetching: Set[str] = set()
+        refreshed_at = float("-inf")
+
+        async def fetch_into_queue(due: List[Shipment]):
+            pending = {shipment[0] for shipment in due}
+            try:
+                with POLL_CYCLE_SECONDS.time():
+                    async with aclosing(self.fetch_many(due)) as fetched:
+                        async for result in fetched:
+                            pending.discard(result[0][0])
+                            await results.put(result)
+            except BaseException as e:
+                # Popped shipments stay unscheduled until a result comes in; count the rest as failed polls.
+                if not isinstance(e, asyncio.CancelledError):
+                    print(f"Error polling {len(pending)} shipments: {e!r}")
+                for shipment_id in pending:
+                    fetching.discard(shipment_id)
+                    if shipment_id in index and scheduler.due(shipment_id) is None:
+                        scheduler.record(shipment_id, changed=False)
+                raise
+
+        try:
+            while True:
+                if time.monotonic() - refreshed_at >= refresh_interval:
+                    changes = self.refresh_index(busy=fetching)
+                    if changes is not None:
+                        added, removed = changes
+                        for state in added:
+                            scheduler.add(state.shipment[0], due=state.next_poll)
+                        for state in removed:
+                            scheduler.remove(state.shipment[0])
+                            if on_release is not None:
+                                on_release(state.shipment)
+                    refreshed_at = time.monotonic()
+
+                now = scheduler.clock()
+                next_due = scheduler.next_due()
+                POLL_LAG_SECONDS.set(max(0.0, now - next_due) if next_due is not None else 0.0)
+                due = [index[key].shipment for key in scheduler.pop_due(now)]
+                fetching.update(shipment[0] for shipment in due)
+                if due:
+                    task = asyncio.create_task(fetch_into_queue(due))
+                    in_flight.add(task)
+                    task.add_done_callback(in_flight.discard)
+
+                next_due = scheduler.next_due()
+                wake_at = refreshed_at + refresh_interval
+                if next_due is not None:
+                    wake_at = min(wake_at, time.monotonic() + next_due - scheduler.clock())
+                # Not wait_for: it can swallow a cancellation that arrives as get() completes (bpo-42130).
+                getter = asyncio.ensure_future(results.get())
+                try:
+                    done, _ = await asyncio.wait({getter}, timeout=max(0.0, wake_at - time.monotonic()))
+                    if getter not in done:
+                        # cancel() only asks; get() may still take a result before the cancellation lands.
+                        getter.cancel()
+                        await asyncio.wait({getter})
+                finally:
+                    if not getter.done():
+                        getter.cancel()
+                if getter.cancelled():
+                    continue
+                batch = [getter.result()]
+                RESULT_QUEUE_DEPTH.set(results.qsize() + 1)
+                while not results.empty():
+                    batch.append(results.get_nowait())
+                fetching.difference_update(shipment[0] for shipment, _ in batch)
+                if time.time() >= self.leased_until:
+                    # Another worker may own these shipments by now; renew the leases before going on.
+                    for shipment, _ in batch:
+                        scheduler.record(shipment[0], changed=False)
+                    refreshed_at = float("-inf")
+                    continue
+                batch = [(shipment, events) for shipment, events in batch if shipment[0] in index]
+
+                delivered_ids = []
+                fingerprints = {shipment[0]: index[shipment[0]].fingerprint for shipment, _ in batch}
+                try:
+                    with RESULT_BATCH_SECONDS.time(), self.db.transaction():
+                        for shipment, events in batch:
+                            if events is None:
+                                scheduler.record(shipment[0], changed=False)
+                            else:
+                                changed = await on_result(shipment, events)
+                                delivered = is_delivered(events)
+                                scheduler.record(shipment[0], changed=bool(changed), delivered=delivered,
+                                                 last_change=last_event_time(events))
+                                if delivered:
+                                    self.providers[shipment[2].upper()].forget(shipment[1])
+                                    delivered_ids.append(shipment[0])
+                                    continue
+                            next_poll = scheduler.due(shipment[0])
+                            if next_poll is not None:
+                                index.set_next_poll(shipment[0], next_poll)
+                        index.flush_fingerprints(self.db)
+                except sqlite3.OperationalError as e:
+                    # E.g. the write lock stayed taken past busy_timeout. Nothing was stored, so
+                    # forget what the batch changed in memory and poll its shipments again.
+                    print(f"Database error storing poll results, polling them again: {e}")
+                    retry_at = scheduler.clock() + scheduler.min_interval
+                    for shipment_id, fingerprint in fingerprints.items():
+                        index.set_fingerprint(shipment_id, fingerprint)
+                        scheduler.remove(shipment_id)
+                        scheduler.add(shipment_id, due=retry_at)
+                    if on_batch_end is not None:
+                        on_batch_end(False)
+                    continue
+                if on_batch_end is not None:
+                    on_batch_end(True)
+                for shipment_id in delivered_ids:
+                    index.remove(shipment_id)
+        finally:
+            for task in in_flight:
+                task.cancel()
+            self._checkpoint()
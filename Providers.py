@@ -0,0 +1,306 @@
+import asyncio
+import importlib.util
+import os
+import time
+from datetime import datetime
+from typing import AsyncIterator, Dict, List, NamedTuple, Optional, Tuple, Type
+
+import httpx
+
+from Metrics import RESPONSE_CACHE_LOOKUPS, UPSTREAM_FETCH_SECONDS, UPSTREAM_RESPONSES
+from ResponseCache import CacheEntry, ResponseCache
+
+# HTTP/2 needs the optional h2 package (pip install httpx[http2]).
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+
+class TrackingEvent(NamedTuple):
+    """One tracking event, normalized across providers."""
+    timestamp: int
+    status: str
+    message: str
+    delivered: bool = False
+
+
+PROVIDERS: Dict[str, Type["TrackingProvider"]] = {}
+
+
+def register_provider(name: str):
+    """Class decorator registering a TrackingProvider under its ship_providers.NAME."""
+    def decorator(cls):
+        cls.name = name
+        PROVIDERS[name.upper()] = cls
+        return cls
+    return decorator
+
+
+def get_provider_class(name: str) -> Optional[Type["TrackingProvider"]]:
+    return PROVIDERS.get(name.upper())
+
+
+class TrackingProvider:
+    """Fetches and parses tracking data for one carrier.
+
+    Subclasses implement `build_request` and `parse`. Carriers that can look up
+    several codes in one call also set `batch_size` and implement
+    `build_batch_request` and `parse_batch`. Each provider instance owns its
+    keep-alive connection pools and its own concurrency limit, so a slow
+    carrier only queues its own requests.
+
+    httpcore scans its whole pool on every request, so large pools get slower per
+    request; connections are split into shards of at most POOL_SIZE instead.
+    When h2 is installed each shard speaks HTTP/2, so its requests are
+    multiplexed over a single connection.
+    """
+    name: str = None
+    max_concurrency = 20
+    batch_size = 1
+    http2 = True
+    POOL_SIZE = 10
+    _ssl_context = None
+    # Carriers that are sent a per-shipment tracking number rather than the bare code keep them here by
+    # code; the poller fills it in from shipments.TRACKING_NUMBER.
+    tracking_numbers: Optional[Dict[str, Optional[str]]] = None
+
+    def __init__(self, max_concurrency: int = None, timeout: float = 15.0, base_url: str = None,
+                 cache: ResponseCache = None):
+        self.cache = cache
+        if max_concurrency is not None:
+            self.max_concurrency = max_concurrency
+        if base_url is not None:
+            self.base_url = base_url
+        self.timeout = timeout
+        self._clients: List[httpx.AsyncClient] = []
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    async def __aenter__(self):
+        shards = -(-self.max_concurrency // self.POOL_SIZE)
+        size = -(-self.max_concurrency // shards)
+        limits = httpx.Limits(max_connections=size, max_keepalive_connections=size)
+        # Loading the CA bundle takes ~50ms, so every shard and provider shares one SSL context.
+        if TrackingProvider._ssl_context is None:
+            TrackingProvider._ssl_context = httpx.create_ssl_context()
+        self._clients = [httpx.AsyncClient(limits=limits, timeout=self.timeout, verify=TrackingProvider._ssl_context,
+                                           http2=self.http2 and HTTP2_AVAILABLE)
+                         for _ in range(shards)]
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await asyncio.gather(*(client.aclose() for client in self._clients))
+        self._clients = []
+
+    def client_for(self, code: str) -> httpx.AsyncClient:
+        return self._clients[hash(code) % len(self._clients)]
+
+    async def _send(self, client: httpx.AsyncClient, request: httpx.Request) -> httpx.Response:
+        """Sends `request`, recording its latency and status in the upstream metrics."""
+        started = time.perf_counter()
+        try:
+            response = await client.send(request)
+        except httpx.HTTPError:
+            UPSTREAM_FETCH_SECONDS.labels(self.name).observe(time.perf_counter() - started)
+            UPSTREAM_RESPONSES.labels(self.name, "error").inc()
+            raise
+        UPSTREAM_FETCH_SECONDS.labels(self.name).observe(time.perf_counter() - started)
+        UPSTREAM_RESPONSES.labels(self.name, response.status_code).inc()
+        return response
+
+    def forget(self, code: str):
+        """Drops anything cached for a code that is no longer tracked."""
+        if self.cache is not None:
+            self.cache.discard((self.name, code))
+
+    def build_request(self, client: httpx.AsyncClient, code: str) -> httpx.Request:
+        raise NotImplementedError
+
+    def parse(self, code: str, payload: dict) -> List[TrackingEvent]:
+        """Returns the events in `payload`, newest first."""
+        raise NotImplementedError
+
+    def build_batch_request(self, client: httpx.AsyncClient, codes: List[str]) -> httpx.Request:
+        raise NotImplementedError
+
+    def parse_batch(self, codes: List[str], payload: dict) -> Dict[str, List[TrackingEvent]]:
+        """Returns the events of every code found in `payload`, newest first."""
+        raise NotImplementedError
+
+    async def fetch(self, code: str) -> Optional[List[TrackingEvent]]:
+        """Fetches the events of one code, newest first, or None on failure.
+
+        With a cache, fresh entries are served without a request and stale ones
+        are revalidated with a conditional request.
+        """
+        if self.cache is None:
+            entry = await self._fetch(code)
+            return entry.events if entry is not None else None
+        return await self.cache.get_or_fetch((self.name, code), lambda stale: self._fetch(code, stale))
+
+    async def _fetch(self, code: str, stale: CacheEntry = None) -> Optional[CacheEntry]:
+        async with self._semaphore:
+            client = self.client_for(code)
+            try:
+                request = self.build_request(client, code)
+                if stale is not None and stale.etag:
+                    request.headers['if-none-match'] = stale.etag
+                if stale is not None and stale.last_modified:
+                    request.headers['if-modified-since'] = stale.last_modified
+                response = await self._send(client, request)
+                if response.status_code == 304 and stale is not None:
+                    return CacheEntry(stale.events, stale.etag, stale.last_modified)
+                response.raise_for_status()
+                return CacheEntry(self.parse(code, response.json()),
+                                  response.headers.get('etag'), response.headers.get('last-modified'))
+            except (httpx.HTTPError, ValueError, KeyError, TypeError) as e:
+                print(f"Error fetching '{code}' from {self.name}: {e}")
+                return None
+
+    async def fetch_batch(self, codes: List[str]) -> Dict[str, Optional[List[TrackingEvent]]]:
+        """Fetches up to `batch_size` codes in one request; failed or missing codes map to None."""
+        async with self._semaphore:
+            client = self.client_for(codes[0])
+            try:
+                response = await self._send(client, self.build_batch_request(client, codes))
+                response.raise_for_status()
+                found = self.parse_batch(codes, response.json())
+            except (httpx.HTTPError, ValueError, KeyError, TypeError) as e:
+                print(f"Error fetching {len(codes)} codes from {self.name}: {e}")
+                found = {}
+        return {code: found.get(code) for code in codes}
+
+    async def fetch_many(self, codes: List[str]) -> AsyncIterator[Tuple[str, Optional[List[TrackingEvent]]]]:
+        """Yields (code, events) for every code as soon as its result is in.
+
+        Codes are grouped into as few batch calls as `batch_size` allows; carriers
+        without a batch call get one request per code, pipelined over the pools.
+        """
+        if self.batch_size > 1:
+            if self.cache is not None:
+                missing = []
+                for code in codes:
+                    entry = self.cache.get((self.name, code))
+                    if entry is not None:
+                        self.cache.hits += 1
+                        RESPONSE_CACHE_LOOKUPS.labels("hit").inc()
+                        yield code, entry.events
+                    else:
+                        missing.append(code)
+                codes = missing
+            calls = [asyncio.ensure_future(self.fetch_batch(codes[i:i + self.batch_size]))
+                     for i in range(0, len(codes), self.batch_size)]
+            try:
+                for call in asyncio.as_completed(calls):
+                    for code, events in (await call).items():
+                        if self.cache is not None and events is not None:
+                            self.cache.put((self.name, code), CacheEntry(events))
+                        yield code, events
+            finally:
+                for call in calls:
+                    call.cancel()
+        else:
+            async def fetch_one(code: str):
+                return code, await self.fetch(code)
+
+            calls = [asyncio.ensure_future(fetch_one(code)) for code in codes]
+            try:
+                for call in asyncio.as_completed(calls):
+                    yield await call
+            finally:
+                # Stop the remaining lookups when the caller stops iterating or is cancelled.
+                for call in calls:
+                    call.cancel()
+
+
+SPX_HEADERS = {
+    'accept': 'application/json, text/plain, */*',
+    'accept-language': 'en-US,en;q=0.9,vi-VN;q=0.8,vi;q=0.7,en-GB;q=0.6',
+    'priority': 'u=1, i',
+    'sec-ch-ua': '"Chromium";v="130", "Google Chrome";v="130", "Not?A_Brand";v="99"',
+    'sec-ch-ua-mobile': '?0',
+    'sec-ch-ua-platform': '"Windows"',
+    'sec-fetch-dest': 'empty',
+    'sec-fetch-mode': 'cors',
+    'sec-fetch-site': 'same-origin',
+    'sec-gpc': '1',
+    'user-agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/130.0.0.0 Safari/537.36',
+    'x-language': 'vi',
+}
+
+SPX_DELIVERED_STATUSES = {"Delivered"}
+
+
+def load_spx_tracking_numbers(value: str = None) -> Dict[str, str]:
+    """Parses SPX_TRACKING_NUMBERS: comma-separated `code|token` values, by code.
+
+    spx.vn issues the token to its tracking page, which sends it as
+    `sls_tracking_number`; copy that value from the browser for each code.
+    Shipments added as `code|token` through the bot carry theirs already.
+    """
+    if value is None:
+        value = os.getenv("SPX_TRACKING_NUMBERS", "")
+    numbers = {}
+    for number in value.split(","):
+        number = number.strip()
+        if number:
+            numbers[number.split("|", 1)[0]] = number
+    return numbers
+
+
+@register_provider("SPX")
+class SPXProvider(TrackingProvider):
+    """SPX has no batch lookup, so codes are fetched one per request over multiplexed connections.
+
+    How spx.vn derives the token in `sls_tracking_number` is not known, so
+    it is given per shipment: stored with it when added as `code|token`, or
+    configured in SPX_TRACKING_NUMBERS (see load_spx_tracking_numbers).
+    Codes without one are sent bare, which SPX has not been seen to accept.
+    """
+    base_url = "https://spx.vn/api/v2/fleet_order/tracking/search"
+    max_concurrency = 100
+
+    def __init__(self, tracking_numbers: Dict[str, str] = None, **kwargs):
+        super().__init__(**kwargs)
+        self.tracking_numbers = tracking_numbers if tracking_numbers is not None else load_spx_tracking_numbers()
+        self._warned = False
+
+    def tracking_number(self, code: str) -> str:
+        number = self.tracking_numbers.get(code)
+        if number is None:
+            if not self._warned:
+                self._warned = True
+                print(f"No SPX token for {code} (and maybe others); add it as `{code}|<token>`, "
+                      f"or list that in SPX_TRACKING_NUMBERS.")
+            return code
+        return number
+
+    def build_request(self, client: httpx.AsyncClient, code: str) -> httpx.Request:
+        headers = dict(SPX_HEADERS, referer=f"https://spx.vn/track?{code}")
+        params = {'sls_tracking_number': self.tracking_number(code)}
+        return client.build_request("GET", self.base_url, params=params, headers=headers)
+
+    def parse(self, code: str, payload: dict) -> List[TrackingEvent]:
+        return [TrackingEvent(
+            timestamp=event['timestamp'],
+            status=event.get('status') or event.get('milestone_name'),
+            message=event.get('message'),
+            delivered=event.get('status') in SPX_DELIVERED_STATUSES or event.get('milestone_name') in SPX_DELIVERED_STATUSES,
+        ) for event in payload['data']['tracking_list']]
+
+
+@register_provider("GHN")
+class GHNProvider(TrackingProvider):
+    base_url = "https://fe-online-gateway.ghn.vn/order-tracking/public-api/client/tracking-logs"
+
+    def build_request(self, client: httpx.AsyncClient, code: str) -> httpx.Request:
+        return client.build_request("POST", self.base_url, json={"order_code": code})
+
+    def parse(self, code: str, payload: dict) -> List[TrackingEvent]:
+        events = [TrackingEvent(
+            timestamp=int(datetime.fromisoformat(log['action_at'].replace('Z', '+00:00')).timestamp()),
+            status=log.get('status'),
+            message=log.get('status_name') or log.get('status'),
+            delivered=log.get('status') == 'delivered',
+        ) for log in payload['data']['tracking_logs'] or []]
+        # GHN lists logs oldest first.
+        events.sort(key=lambda event: event.timestamp, reverse=True)
+        return events
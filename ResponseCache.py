@@ -0,0 +1,99 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Hashable, Optional
+
+from Metrics import RESPONSE_CACHE_LOOKUPS
+
+
+class CacheEntry:
+    __slots__ = ("events", "etag", "last_modified", "fetched_at")
+
+    def __init__(self, events: list, etag: str = None, last_modified: str = None):
+        self.events = events
+        self.etag = etag
+        self.last_modified = last_modified
+        self.fetched_at = time.monotonic()
+
+
+Loader = Callable[[Optional[CacheEntry]], Awaitable[Optional[CacheEntry]]]
+
+
+class ResponseCache:
+    """Bounded LRU cache of parsed tracking responses, shared by the poller and /track.
+
+    Entries younger than `ttl` seconds are served without any request. Older
+    entries stay cached (until evicted) so their ETag/Last-Modified can be sent
+    as a conditional request. Concurrent lookups of the same key share one
+    in-flight fetch.
+    """
+
+    def __init__(self, max_entries: int = 10_000, ttl: float = 5.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[Hashable, CacheEntry]" = OrderedDict()
+        self._in_flight: Dict[Hashable, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable, fresh_only: bool = True) -> Optional[CacheEntry]:
+        entry = self._entries.get(key)
+        if entry is None or (fresh_only and time.monotonic() - entry.fetched_at >= self.ttl):
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def put(self, key: Hashable, entry: CacheEntry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def discard(self, key: Hashable):
+        self._entries.pop(key, None)
+
+    async def get_or_fetch(self, key: Hashable, loader: Loader) -> Optional[list]:
+        """Returns the cached events for `key`, calling `loader(stale_entry)` when they aren't fresh.
+
+        `loader` returns the new entry, or None when the fetch failed.
+        """
+        entry = self.get(key)
+        if entry is not None:
+            self.hits += 1
+            RESPONSE_CACHE_LOOKUPS.labels("hit").inc()
+            return entry.events
+        in_flight = self._in_flight.get(key)
+        if in_flight is not None:
+            self.coalesced += 1
+            RESPONSE_CACHE_LOOKUPS.labels("coalesced").inc()
+        else:
+            self.misses += 1
+            RESPONSE_CACHE_LOOKUPS.labels("miss").inc()
+            # In a task of its own, so a caller that gives up (e.g. /track timing out) doesn't cancel
+            # the fetch for everyone else waiting on it.
+            in_flight = self._in_flight[key] = asyncio.ensure_future(self._load(key, loader))
+            in_flight.add_done_callback(lambda task: self._loaded(key, task))
+        try:
+            return await asyncio.shield(in_flight)
+        except asyncio.CancelledError:
+            if not in_flight.cancelled():
+                raise
+            # The fetch itself was cancelled, e.g. on shutdown: a failed lookup for whoever waited on it.
+            return None
+
+    async def _load(self, key: Hashable, loader: Loader) -> Optional[list]:
+        entry = await loader(self.get(key, fresh_only=False))
+        if entry is not None:
+            self.put(key, entry)
+        return entry.events if entry is not None else None
+
+    def _loaded(self, key: Hashable, task: asyncio.Future):
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        if not task.cancelled():
+            # Mark the exception as retrieved in case every waiter gave up.
+            task.exception()
@@ -0,0 +1,146 @@
+import heapq
+import time
+from typing import Callable, Dict, Hashable, List, Optional
+
+
+class _PollState:
+    __slots__ = ("interval", "due", "last_poll")
+
+    def __init__(self, interval: float, due: float, last_poll: float):
+        self.interval = interval
+        self.due = due
+        self.last_poll = last_poll
+
+
+class PollScheduler:
+    """Decides when each shipment is polled next.
+
+    Shipments sit in a heap keyed on their next due time. A shipment whose
+    tracking_list just changed is polled again after `min_interval`; every poll
+    without a change multiplies its interval by `backoff`, up to `max_interval`.
+    A shipment whose last event is old is never polled more often than
+    `staleness_factor` times that age. Delivered shipments are dropped.
+
+    `max_interval` bounds how late a change is noticed: with the default of
+    ten minutes, benchmarks/bench_scheduler.py sees changes about 5 minutes
+    after they happen at p50 and 10 at p99, for ~50x fewer requests than
+    polling every `min_interval`. An hour cuts requests by another 4.5x but
+    delays alerts to 27 and 59 minutes.
+    """
+
+    def __init__(self, min_interval: float = 10, max_interval: float = 600, backoff: float = 2.0,
+                 staleness_factor: float = 0.1, clock: Callable[[], float] = time.time):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.staleness_factor = staleness_factor
+        self.clock = clock
+        self._states: Dict[Hashable, _PollState] = {}
+        self._heap: list = []
+        self._sequence = 0
+        self.polls = 0
+        self.changes = 0
+        self.delivered = 0
+        self.baseline_polls = 0.0
+
+    def __len__(self) -> int:
+        return len(self._states)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._states
+
+    def _push(self, key: Hashable, state: _PollState):
+        self._sequence += 1
+        heapq.heappush(self._heap, (state.due, self._sequence, key))
+
+    def add(self, key: Hashable, due: Optional[float] = None):
+        """Starts scheduling `key`; it is due immediately unless `due` is given."""
+        if key in self._states:
+            return
+        now = self.clock()
+        due = now if due is None else due
+        state = _PollState(self.min_interval, due, due)
+        self._states[key] = state
+        self._push(key, state)
+
+    def remove(self, key: Hashable):
+        # The heap entry is discarded lazily when it reaches the top.
+        self._states.pop(key, None)
+
+    def due(self, key: Hashable) -> Optional[float]:
+        """When `key` is due next; None if it isn't tracked or is being polled right now."""
+        state = self._states.get(key)
+        if state is None or state.due == float("inf"):
+            return None
+        return state.due
+
+    def next_due(self) -> Optional[float]:
+        while self._heap:
+            due, _, key = self._heap[0]
+            state = self._states.get(key)
+            if state is not None and state.due == due:
+                return due
+            heapq.heappop(self._heap)
+        return None
+
+    def pop_due(self, now: Optional[float] = None, limit: Optional[int] = None) -> List[Hashable]:
+        """Returns the keys whose due time has passed, earliest first.
+
+        Popped keys stay tracked but are not returned again until `record` reschedules them.
+        """
+        if now is None:
+            now = self.clock()
+        due_keys = []
+        while (limit is None or len(due_keys) < limit) and self.next_due() is not None:
+            due, _, key = self._heap[0]
+            if due > now:
+                break
+            heapq.heappop(self._heap)
+            self._states[key].due = float("inf")
+            due_keys.append(key)
+        return due_keys
+
+    def record(self, key: Hashable, changed: bool, delivered: bool = False,
+               last_change: Optional[float] = None):
+        """Reschedules `key` after a poll.
+
+        Args:
+            key: The polled shipment.
+            changed: Whether the poll found new tracking events.
+            delivered: Whether the shipment is now delivered; it is then no longer scheduled.
+            last_change: Wall-clock time of the newest tracking event, if known.
+        """
+        state = self._states.get(key)
+        if state is None:
+            return
+        now = self.clock()
+        self.polls += 1
+        self.baseline_polls += max(now - state.last_poll, self.min_interval) / self.min_interval
+        state.last_poll = now
+        if changed:
+            self.changes += 1
+        if delivered:
+            self.delivered += 1
+            self.remove(key)
+            return
+
+        if changed:
+            interval = self.min_interval
+        else:
+            interval = state.interval * self.backoff
+        if last_change is not None:
+            interval = max(interval, (now - last_change) * self.staleness_factor)
+        state.interval = min(max(interval, self.min_interval), self.max_interval)
+        state.due = now + state.interval
+        self._push(key, state)
+
+    def metrics(self) -> Dict[str, float]:
+        """Poll counts, including how many requests a fixed `min_interval` cadence would have made."""
+        return {
+            "tracked": len(self._states),
+            "polls": self.polls,
+            "changes": self.changes,
+            "delivered": self.delivered,
+            "baseline_polls": round(self.baseline_polls),
+            "saved_requests": max(0, round(self.baseline_polls) - self.polls),
+        }
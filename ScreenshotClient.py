@@ -0,0 +1,52 @@
+from typing import Dict, NamedTuple, Optional
+
+import httpx
+
+SCREENSHOT_SERVICE_URL = "http://127.0.0.1:8931"
+
+
+class Snapshot(NamedTuple):
+    png: bytes
+    content_hash: str
+
+
+class ScreenshotClient:
+    """Asks the local screenshot service (JS-puppeteer/server.js) for tracking page captures.
+
+    The service keeps a warm browser, so a capture costs one page load instead
+    of a Chromium start. The content hash of the last capture of every code is
+    remembered and sent along, so an unchanged page yields no image at all.
+    """
+
+    def __init__(self, service_url: str = SCREENSHOT_SERVICE_URL, timeout: float = 30.0):
+        self.service_url = service_url
+        self.timeout = timeout
+        self._client: Optional[httpx.AsyncClient] = None
+        self._hashes: Dict[str, str] = {}
+
+    async def __aenter__(self):
+        self._client = httpx.AsyncClient(base_url=self.service_url, timeout=self.timeout)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self._client.aclose()
+
+    def forget(self, code: str):
+        self._hashes.pop(code, None)
+
+    async def capture(self, code: str, url: str, selector: str = None) -> Optional[Snapshot]:
+        """Returns a PNG of `url`, or None if the page didn't change since the last capture or the capture failed."""
+        payload = {"code": code, "url": url, "selector": selector, "previous_hash": self._hashes.get(code)}
+        try:
+            response = await self._client.post("/screenshot", json=payload)
+        except httpx.HTTPError as e:
+            print(f"Error capturing '{code}': {e}")
+            return None
+        if response.status_code == 304:
+            return None
+        if response.status_code != 200:
+            print(f"Error capturing '{code}': {response.status_code} {response.text[:200]}")
+            return None
+        content_hash = response.headers.get("x-content-hash", "")
+        self._hashes[code] = content_hash
+        return Snapshot(response.content, content_hash)
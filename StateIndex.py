@@ -0,0 +1,154 @@
+import sys
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from Database import Database
+from Metrics import DB_CALL_SECONDS
+
+Shipment = Tuple[str, str, str]
+Fingerprint = Tuple[int, str, Optional[str]]
+Changes = Tuple[List["ShipmentState"], List["ShipmentState"]]
+
+
+class ShipmentState:
+    """What the poll loop knows about one tracked shipment.
+
+    `shipment` is the (ID, CODE, PROVIDER_NAME) tuple handed to result
+    handlers; it is built once when the shipment is loaded.
+    """
+    __slots__ = ("shipment", "last_event_time", "head_hash", "events_hash", "next_poll")
+
+    def __init__(self, shipment: Shipment, last_event_time: Optional[int], head_hash: Optional[str],
+                 events_hash: Optional[str], next_poll: Optional[float]):
+        self.shipment = shipment
+        self.last_event_time = last_event_time
+        self.head_hash = head_hash
+        self.events_hash = events_hash
+        self.next_poll = next_poll
+
+    @property
+    def fingerprint(self) -> Optional[Fingerprint]:
+        return None if self.head_hash is None else (self.last_event_time, self.head_hash, self.events_hash)
+
+
+class StateIndex:
+    """Resident copy of current_tracking and tracking_state for the poll loop.
+
+    Loaded with one query, then kept in sync incrementally: a refresh reads
+    nothing unless another connection committed since the last one, and then
+    only the current_tracking rows added since, reconciling removals when the
+    tracked count no longer matches. Fingerprints and next
+    poll times are changed in memory and marked dirty; `flush_fingerprints`
+    and `checkpoint` write the dirty ones back in a single statement each.
+    """
+
+    def __init__(self):
+        self._states: Dict[str, ShipmentState] = {}
+        self._last_row = 0
+        self._data_version: Optional[int] = None
+        self._dirty_fingerprints: Set[str] = set()
+        self._dirty_polls: Set[str] = set()
+
+    def __len__(self) -> int:
+        return len(self._states)
+
+    def __contains__(self, shipment_id: str) -> bool:
+        return shipment_id in self._states
+
+    def __getitem__(self, shipment_id: str) -> ShipmentState:
+        return self._states[shipment_id]
+
+    def get(self, shipment_id: str) -> Optional[ShipmentState]:
+        return self._states.get(shipment_id)
+
+    def _add(self, row: int, shipment_id: str, code: str, provider: str, next_poll: Optional[float],
+             last_event_time: Optional[int], head_hash: Optional[str], events_hash: Optional[str]) -> ShipmentState:
+        # Provider names repeat for every shipment; interning keeps one copy of each.
+        state = ShipmentState((shipment_id, code, sys.intern(provider)), last_event_time, head_hash, events_hash,
+                              next_poll)
+        self._states[shipment_id] = state
+        self._last_row = max(self._last_row, row)
+        return state
+
+    def remove(self, shipment_id: str) -> Optional[ShipmentState]:
+        self._dirty_fingerprints.discard(shipment_id)
+        self._dirty_polls.discard(shipment_id)
+        return self._states.pop(shipment_id, None)
+
+    def refresh(self, db: Database) -> Changes:
+        """Loads the shipments added to current_tracking since the last refresh and drops the ones that left it.
+
+        Returns:
+            The added and the removed states.
+        """
+        # The poller's own writes go through `db` and don't change its data version.
+        data_version = db.data_version()
+        if data_version == self._data_version:
+            return [], []
+        self._data_version = data_version
+        with DB_CALL_SECONDS.labels("get_poll_states").time():
+            rows = db.get_poll_states(self._last_row)
+        added = [self._add(*row) for row in rows if row[1] not in self._states]
+        removed = []
+        if db.count_tracked_shipments() != len(self._states):
+            tracked = set(db.get_tracked_ids())
+            removed = [self.remove(shipment_id) for shipment_id in list(self._states) if shipment_id not in tracked]
+            missing = tracked - self._states.keys()
+            if missing:
+                with DB_CALL_SECONDS.labels("get_poll_states").time():
+                    rows = db.get_poll_states()
+                added += [self._add(*row) for row in rows if row[1] in missing]
+        return added, removed
+
+    def replace(self, db: Database, rows: Iterable[Tuple[str, str, str, Optional[float]]]) -> Changes:
+        """Makes the index hold exactly the (ID, CODE, PROVIDER_NAME, NEXT_POLL) `rows`, e.g. a worker's leases.
+
+        Shipments already indexed keep their in-memory state; the fingerprints
+        of new ones are read in one go.
+        """
+        rows = {row[0]: row for row in rows}
+        removed = [self.remove(shipment_id) for shipment_id in list(self._states) if shipment_id not in rows]
+        new_ids = [shipment_id for shipment_id in rows if shipment_id not in self._states]
+        fingerprints = db.get_tracking_states(new_ids)
+        added = []
+        for shipment_id in new_ids:
+            _, code, provider, next_poll = rows[shipment_id]
+            last_event_time, head_hash, events_hash = fingerprints.get(shipment_id, (None, None, None))
+            added.append(self._add(0, shipment_id, code, provider, next_poll, last_event_time, head_hash, events_hash))
+        return added, removed
+
+    def set_fingerprint(self, shipment_id: str, fingerprint: Optional[Fingerprint]):
+        """Changes a fingerprint in memory; None puts back a shipment that has none yet."""
+        state = self._states[shipment_id]
+        if fingerprint is None:
+            state.last_event_time = state.head_hash = state.events_hash = None
+            self._dirty_fingerprints.discard(shipment_id)
+            return
+        state.last_event_time, state.head_hash, state.events_hash = fingerprint
+        self._dirty_fingerprints.add(shipment_id)
+
+    def set_next_poll(self, shipment_id: str, next_poll: float):
+        state = self._states.get(shipment_id)
+        if state is not None and state.next_poll != next_poll:
+            state.next_poll = next_poll
+            self._dirty_polls.add(shipment_id)
+
+    def flush_fingerprints(self, db: Database) -> bool:
+        """Writes the fingerprints changed since the last flush."""
+        if not self._dirty_fingerprints:
+            return True
+        states = self._states
+        if not db.set_tracking_states((shipment_id, *states[shipment_id].fingerprint)
+                                      for shipment_id in self._dirty_fingerprints):
+            return False
+        self._dirty_fingerprints.clear()
+        return True
+
+    def checkpoint(self, db: Database) -> bool:
+        """Writes the next poll times changed since the last checkpoint."""
+        if not self._dirty_polls:
+            return True
+        states = self._states
+        if not db.set_next_polls((shipment_id, states[shipment_id].next_poll) for shipment_id in self._dirty_polls):
+            return False
+        self._dirty_polls.clear()
+        return True
@@ -0,0 +1,138 @@
+import asyncio
+import hmac
+import json
+import logging
+import time
+from typing import List, Optional
+
+from telegram import Update
+from telegram.ext import Application
+
+from Metrics import WEBHOOK_QUEUE_DEPTH, WEBHOOK_REQUESTS, WEBHOOK_UPDATE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+SECRET_TOKEN_HEADER = "x-telegram-bot-api-secret-token"
+MAX_UPDATE_BYTES = 1024 * 1024
+
+
+class WebhookServer:
+    """Receives Telegram updates over HTTP and hands them to an Application through a bounded queue.
+
+    A request is answered as soon as its update is queued, so slow handlers
+    never hold up Telegram; `workers` tasks run the handlers. Requests without
+    the secret token get a 403, and a full queue answers 503 so Telegram
+    retries the update later. With `webhook_url`, Telegram is pointed at it
+    once the server listens; the URL must be forwarded to `path` here.
+
+    Updates are handled concurrently, so two updates from one chat may finish
+    out of order.
+    """
+
+    def __init__(self, application: Application, secret_token: str, host: str = "127.0.0.1", port: int = 8443,
+                 path: str = "/telegram", webhook_url: str = None, workers: int = 8, max_queue: int = 1000):
+        self.application = application
+        self.secret_token = secret_token.encode()
+        self.host = host
+        self.port = port
+        self.path = path
+        self.webhook_url = webhook_url
+        self.workers = workers
+        self.max_queue = max_queue
+        self._queue: Optional[asyncio.Queue] = None
+        self._server = None
+        self._tasks: List[asyncio.Task] = []
+        self.accepted = 0
+        self.processed = 0
+        self.rejected = 0
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}{self.path}"
+
+    async def __aenter__(self):
+        self._queue = asyncio.Queue(self.max_queue)
+        WEBHOOK_QUEUE_DEPTH.set_function(self._queue.qsize)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._server = await asyncio.start_server(self._serve, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        if self.webhook_url:
+            await self.application.bot.set_webhook(self.webhook_url, secret_token=self.secret_token.decode(),
+                                                   allowed_updates=Update.ALL_TYPES)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self._server.close()
+        await self._server.wait_closed()
+        await self.drain()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def drain(self):
+        """Waits until every queued update has been handled."""
+        await self._queue.join()
+
+    def _accept(self, method: str, target: str, headers: dict, body: bytes) -> str:
+        if target.split("?")[0] != self.path:
+            WEBHOOK_REQUESTS.labels("not_found").inc()
+            return "404 Not Found"
+        if method != "POST":
+            WEBHOOK_REQUESTS.labels("not_found").inc()
+            return "405 Method Not Allowed"
+        if not hmac.compare_digest(headers.get(SECRET_TOKEN_HEADER, "").encode(), self.secret_token):
+            WEBHOOK_REQUESTS.labels("forbidden").inc()
+            return "403 Forbidden"
+        try:
+            update = Update.de_json(json.loads(body), self.application.bot)
+        except (ValueError, TypeError, KeyError, AttributeError):
+            update = None
+        if update is None:
+            WEBHOOK_REQUESTS.labels("invalid").inc()
+            return "400 Bad Request"
+        try:
+            self._queue.put_nowait((update, time.perf_counter()))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            WEBHOOK_REQUESTS.labels("queue_full").inc()
+            return "503 Service Unavailable"
+        self.accepted += 1
+        WEBHOOK_REQUESTS.labels("accepted").inc()
+        return "200 OK"
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        # Telegram keeps connections open and sends one update per request on each.
+        try:
+            while True:
+                lines = (await reader.readuntil(b"\r\n\r\n")).decode("latin-1").split("\r\n")
+                method, target = lines[0].split(" ")[:2]
+                headers = {}
+                for line in lines[1:]:
+                    if ":" in line:
+                        name, value = line.split(":", 1)
+                        headers[name.strip().lower()] = value.strip()
+                length = int(headers.get("content-length", 0))
+                if length > MAX_UPDATE_BYTES:
+                    writer.write(b"HTTP/1.1 413 Payload Too Large\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+                    await writer.drain()
+                    break
+                body = await reader.readexactly(length)
+                status = self._accept(method, target, headers, body)
+                writer.write(f"HTTP/1.1 {status}\r\nContent-Length: 0\r\n\r\n".encode())
+                await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def _worker(self):
+        while True:
+            update, received = await self._queue.get()
+            try:
+                await self.application.process_update(update)
+            except Exception:
+                logger.exception("Error handling update %s", update.update_id)
+            finally:
+                self.processed += 1
+                WEBHOOK_UPDATE_SECONDS.observe(time.perf_counter() - received)
+                self._queue.task_done()
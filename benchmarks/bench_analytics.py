@@ -0,0 +1,113 @@
+"""Compares answering /stats and /track ETAs from the incremental transit_stats against recomputing them from history.
+
+Seeds shipments with synthetic journeys (a few statuses with log-normal
+dwell times), then for growing history sizes reports: recomputing every
+aggregate from tracking_events, loading the stored aggregates, and one ETA
+query. Also checks the sketch's quantiles against exact ones.
+
+Usage: python benchmarks/bench_analytics.py [largest_shipment_count]
+"""
+import os
+import random
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Analytics import DWELL, TRANSIT, TransitStats
+from Database import Database
+from Providers import TrackingEvent
+from fakes import temp_database
+
+STATUSES = ["Order created", "Picked up", "Arrived at hub", "Departed hub", "Out for delivery"]
+# Median dwell time of each status, in hours.
+DWELL_HOURS = [6, 20, 10, 30, 4]
+
+
+def journey(rng: random.Random, start: int):
+    events = []
+    timestamp = start
+    for status, hours in zip(STATUSES, DWELL_HOURS):
+        events.append(TrackingEvent(timestamp, status, status))
+        timestamp += int(rng.lognormvariate(0, 0.6) * hours * 3600)
+    events.append(TrackingEvent(timestamp, "Delivered", "Delivered", True))
+    return events
+
+
+def seed(db: Database, stats: TransitStats, count: int, rng: random.Random, provider_id: int):
+    ids = [str(uuid.uuid4()) for _ in range(count)]
+    journeys = [journey(rng, 1_700_000_000 + rng.randrange(10 ** 7)) for _ in ids]
+    with db.transaction():
+        db.cursor.executemany("INSERT INTO shipments (ID, CODE, PROVIDER_ID, STATUS) VALUES (?, ?, ?, 1)",
+                              ((shipment_id, shipment_id[:12], provider_id) for shipment_id in ids))
+        db.add_tracking_events((shipment_id, event.timestamp, str(i), event.status, event.message)
+                               for shipment_id, events in zip(ids, journeys) for i, event in enumerate(events))
+    for events in journeys:
+        # As the poller sees them: one new event per poll, newest first.
+        for seen in range(1, len(events) + 1):
+            stats.record("SPX", events[:seen][::-1], [events[seen - 1]],
+                         since=events[seen - 2].timestamp if seen > 1 else None)
+            stats.commit()
+    stats.flush(db)
+    return journeys
+
+
+def timed(function, repeat: int = 1):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        result = function()
+    return (time.perf_counter() - started) / repeat, result
+
+
+def main(largest: int):
+    with temp_database() as db:
+        db.add_ship_provider("SPX", "https://spx.vn/track?$$CODE$$")
+        provider_id = db.get_provider_id("SPX")
+        rng = random.Random(19)
+        recorder = TransitStats()
+        journeys = []
+        in_transit = journey(rng, int(time.time()) - 3 * 86400)[:3][::-1]
+
+        size = 0
+        for target in (largest // 100, largest // 10, largest):
+            journeys += seed(db, recorder, target - size, rng, provider_id)
+            size = target
+            rebuild_time, rebuilt = timed(lambda: TransitStats.rebuild(db))
+            load_time, stats = timed(lambda: TransitStats.load(db), repeat=20)
+            eta_time, _ = timed(lambda: stats.eta("SPX", in_transit), repeat=1000)
+            print(f"{size} shipments, {size * (len(STATUSES) + 1)} events: recompute {rebuild_time * 1000:.0f}ms, "
+                  f"load {len(stats.sketches)} aggregates {load_time * 1000:.2f}ms, ETA {eta_time * 1e6:.0f}us")
+            assert rebuilt.get("SPX", TRANSIT).count == stats.get("SPX", TRANSIT).count == size
+            assert {key: sketch.count for key, sketch in rebuilt.sketches.items()} == \
+                {key: sketch.count for key, sketch in stats.sketches.items()}
+
+        exact = sorted(events[-1].timestamp - events[0].timestamp for events in journeys)
+        transit = stats.get("SPX", TRANSIT)
+        for q in (0.5, 0.9, 0.99):
+            true = exact[int(q * (len(exact) - 1))]
+            print(f"transit p{int(q * 100)}: sketch {transit.quantile(q) / 3600:.1f}h, exact {true / 3600:.1f}h, "
+                  f"error {abs(transit.quantile(q) - true) / true:.2%}")
+        print("dwell medians: " + ", ".join(f"{status} {sketch.quantile(0.5) / 3600:.1f}h"
+                                            for status, sketch in stats.slowest("SPX", DWELL, limit=len(STATUSES))))
+        eta = stats.eta("SPX", in_transit)
+        print(f"ETA from '{in_transit[0].status}': median in {(eta[0] - time.time()) / 3600:.0f}h, "
+              f"90% within {(eta[1] - time.time()) / 3600:.0f}h")
+
+        # Backfilled events, an edit of the newest event and a batch that didn't commit add no samples.
+        checked = TransitStats()
+        events = journeys[0][:3]
+        backfilled = TrackingEvent(events[0].timestamp + 1, "Backfilled", "Backfilled")
+        edited = events[-1]._replace(message="Edited")
+        checked.record("SPX", [edited, events[1], backfilled, events[0]], [backfilled, edited],
+                       since=events[-1].timestamp)
+        checked.commit()
+        checked.record("SPX", events[::-1], events)
+        checked.rollback()
+        checked.commit()
+        assert not checked.sketches
+
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 50_000)
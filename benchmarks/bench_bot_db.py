@@ -0,0 +1,121 @@
+"""Load test for ActiveBot handlers while a poller thread writes to the same database.
+
+Runs hundreds of concurrent /track and /ongoing_shipments calls, once with the
+handlers calling Database directly on the event loop and once through
+AsyncDatabase, and reports handler latency and the worst event loop stall.
+
+Usage: python benchmarks/bench_bot_db.py [concurrent_calls] [shipments]
+"""
+import asyncio
+import os
+import sys
+import threading
+import time
+import uuid
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ActiveBot
+from AsyncDatabase import AsyncDatabase
+from Database import Database
+from fakes import temp_database
+
+
+class BlockingDatabase:
+    """The old behaviour: every query runs on the event loop thread."""
+
+    def __init__(self):
+        self.db = Database.new_connection()
+
+    def __getattr__(self, name):
+        method = getattr(self.db, name)
+
+        async def call(*args, **kwargs):
+            return method(*args, **kwargs)
+
+        return call
+
+
+class FakeBot:
+    async def send_message(self, **kwargs):
+        pass
+
+
+def fake_call(text: str):
+    update = SimpleNamespace(message=SimpleNamespace(text=text), effective_chat=SimpleNamespace(id=1))
+    return update, SimpleNamespace(bot=FakeBot())
+
+
+def poller_writes(ids: list, stop: threading.Event):
+    db = Database.new_connection()
+    while not stop.is_set():
+        with db.transaction():
+            db.update_shipment_statuses((shipment_id, False) for shipment_id in ids[:5000])
+        time.sleep(0.01)
+    db.close()
+
+
+async def measure_lag(stop: asyncio.Event, lags: list):
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(0.005)
+        lags.append(time.perf_counter() - started - 0.005)
+
+
+async def load(calls: int, codes: list) -> None:
+    # No poller, like the standalone bot: /track reads the stored events instead of calling the carrier.
+    bot = ActiveBot.TelegramBot("TOKEN")
+    latencies, lags = [], []
+    stop = asyncio.Event()
+    lag_task = asyncio.create_task(measure_lag(stop, lags))
+
+    async def one(i: int):
+        started = time.perf_counter()
+        if i % 10 == 0:
+            await bot.ongoing_shipment(*fake_call("/ongoing_shipments"))
+        else:
+            await bot.track_shipment(*fake_call(f"/track {codes[i * 7919 % len(codes)]}"))
+        latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(calls)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await lag_task
+    latencies.sort()
+    print(f"  {calls} calls in {elapsed:.2f}s, latency p50 {latencies[len(latencies) // 2] * 1000:.1f} ms "
+          f"p99 {latencies[int(len(latencies) * 0.99)] * 1000:.1f} ms, "
+          f"worst event loop stall {max(lags, default=0) * 1000:.1f} ms")
+
+
+def main(calls: int, count: int):
+    with temp_database() as db:
+        db.add_ship_provider("SPX", "https://spx.vn/track?$$CODE$$")
+        provider_id = db.get_provider_id("SPX")
+        ids = [str(uuid.uuid4()) for _ in range(count)]
+        codes = [f"SPXVN{i:012d}" for i in range(count)]
+        db.cursor.executemany("INSERT INTO shipments (ID, CODE, PROVIDER_ID, STATUS) VALUES (?, ?, ?, ?)",
+                              ((ids[i], codes[i], provider_id, 0 if i % 20 == 0 else 1) for i in range(count)))
+        db.conn.commit()
+
+        stop = threading.Event()
+        writer = threading.Thread(target=poller_writes, args=(ids, stop))
+        writer.start()
+        try:
+            print("queries on the event loop:")
+            ActiveBot.db = BlockingDatabase()
+            asyncio.run(load(calls, codes))
+            print("AsyncDatabase thread pool:")
+            ActiveBot.db = AsyncDatabase()
+            asyncio.run(load(calls, codes))
+            ActiveBot.db.close()
+        finally:
+            stop.set()
+            writer.join()
+
+
+if __name__ == "__main__":
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 50_000
+    main(calls, count)
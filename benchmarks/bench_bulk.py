@@ -0,0 +1,36 @@
+"""Compares one request per code with batched lookups for a large watch list.
+
+Usage: python benchmarks/bench_bulk.py [shipments] [batch_size]
+"""
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Poller import Poller
+from fakes import FakeProvider
+
+
+async def timed(label: str, provider: FakeProvider, shipments: list):
+    async with Poller(providers={"FAKE": provider}) as poller:
+        started = time.perf_counter()
+        results = await poller.poll_once(shipments)
+        elapsed = time.perf_counter() - started
+    assert all(events is not None for _, events in results)
+    print(f"  {label:<22} {elapsed:6.2f}s  {provider.fetches:>6} upstream calls")
+
+
+async def main(count: int, batch_size: int):
+    shipments = [(f"id-{i}", f"FAKE{i:08d}", "FAKE") for i in range(count)]
+    print(f"{count} shipments, 0.2s per upstream call, 20 calls in flight:")
+    await timed("one request per code", FakeProvider(latency=0.2, max_concurrency=20), shipments)
+    await timed(f"batches of {batch_size}", FakeProvider(latency=0.2, max_concurrency=20, batch_size=batch_size),
+                shipments)
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    batch_size = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    asyncio.run(main(count, batch_size))
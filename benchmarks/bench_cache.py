@@ -0,0 +1,77 @@
+"""Measures upstream traffic saved by the shared response cache.
+
+Polls a watch list repeatedly with conditional requests, then fires bursts of
+concurrent /track-style lookups for the same codes. Also checks that a lookup
+that gives up doesn't cancel the fetch for the others waiting on it.
+
+Usage: python benchmarks/bench_cache.py [shipments] [cycles]
+"""
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Poller import Poller
+from Providers import SPXProvider
+from ResponseCache import CacheEntry, ResponseCache
+from fakes import FakeSPX
+
+
+async def run(label: str, count: int, cycles: int, cache: ResponseCache = None):
+    fake = FakeSPX(latency=0.05, change_probability=0.05)
+    shipments = [(f"id-{i}", f"SPXVN{i:012d}", "SPX") for i in range(count)]
+    async with fake.server() as server:
+        provider = SPXProvider(base_url=f"{server.url}/api/v2/fleet_order/tracking/search", cache=cache,
+                               tracking_numbers={code: f"{code}|token" for _, code, _ in shipments})
+        async with Poller(providers={"SPX": provider}, cache=cache) as poller:
+            if cache is None:
+                poller.cache = provider.cache = None
+            started = time.perf_counter()
+            for _ in range(cycles):
+                await poller.poll_once(shipments)
+            polling = time.perf_counter() - started
+            polled_requests = server.requests
+
+            # 20 users asking for the same 50 parcels at once.
+            started = time.perf_counter()
+            await asyncio.gather(*(poller.fetch(shipments[i % 50]) for i in range(1000)))
+            lookups = time.perf_counter() - started
+
+    print(f"{label}:")
+    print(f"  {cycles} poll cycles of {count}: {polling:.2f}s, {polled_requests} requests, "
+          f"{fake.not_modified} answered 304 Not Modified")
+    print(f"  1000 concurrent lookups of 50 codes: {lookups:.2f}s, {server.requests - polled_requests} requests")
+    if cache is not None:
+        print(f"  cache: {len(cache)} entries, {cache.hits} hits, {cache.misses} misses, {cache.coalesced} coalesced")
+
+
+async def abandoned_lookup():
+    cache = ResponseCache()
+
+    async def loader(stale):
+        await asyncio.sleep(0.2)
+        return CacheEntry(["event"])
+
+    # E.g. /track timing out while the poller waits on the same code.
+    first = asyncio.create_task(cache.get_or_fetch("code", loader))
+    await asyncio.sleep(0)
+    second = asyncio.create_task(cache.get_or_fetch("code", loader))
+    await asyncio.sleep(0.05)
+    first.cancel()
+    assert await second == ["event"], "a cancelled lookup cancelled the others waiting on the same fetch"
+    print("abandoned lookup: the other waiter still got its result")
+
+
+async def main(count: int, cycles: int):
+    await abandoned_lookup()
+    await run("no cache", count, cycles)
+    await run("shared cache (ttl 0, revalidate every poll)", count, cycles, ResponseCache(max_entries=count, ttl=0))
+    await run("shared cache (ttl 5s)", count, cycles, ResponseCache(max_entries=count, ttl=5))
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    cycles = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    asyncio.run(main(count, cycles))
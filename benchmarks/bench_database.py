@@ -0,0 +1,67 @@
+"""Times shipment lookups on a large database with and without the secondary indexes.
+
+Usage: python benchmarks/bench_database.py [shipments]
+"""
+import os
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Database import Database
+from fakes import temp_database
+
+INDEXES = {
+    "idx_shipments_code": "CREATE INDEX idx_shipments_code ON shipments (CODE)",
+    "idx_shipments_status_id": "CREATE INDEX idx_shipments_status_id ON shipments (STATUS, ID)",
+    "idx_tracking_events_time": "CREATE INDEX idx_tracking_events_time ON tracking_events (EVENT_TIME)",
+}
+
+
+def timed(label: str, func, repeat: int) -> float:
+    started = time.perf_counter()
+    for i in range(repeat):
+        func(i)
+    per_call = (time.perf_counter() - started) / repeat
+    print(f"  {label:<28} {per_call * 1000:9.3f} ms/call")
+    return per_call
+
+
+def run_queries(db: Database, codes: list) -> dict:
+    return {
+        "get_shipment(code)": timed("get_shipment(code)", lambda i: db.get_shipment(codes[i * 7919 % len(codes)]), 200),
+        "get_all_ongoing_shipments": timed("get_all_ongoing_shipments", lambda i: db.get_all_ongoing_shipments(), 20),
+        "get_events_between": timed("get_events_between", lambda i: db.get_events_between(i * 3600, i * 3600 + 3600), 200),
+    }
+
+
+def main(count: int):
+    with temp_database() as db:
+        db.add_ship_provider("SPX", "https://spx.vn/track?$$CODE$$")
+        provider_id = db.get_provider_id("SPX")
+
+        shipments = [(str(uuid.uuid4()), f"SPXVN{i:012d}", provider_id, 0 if i % 50 == 0 else 1) for i in range(count)]
+        db.cursor.executemany("INSERT INTO shipments (ID, CODE, PROVIDER_ID, STATUS) VALUES (?, ?, ?, ?)", shipments)
+        db.conn.commit()
+        started = time.perf_counter()
+        db.add_tracking_events((shipment_id, i * 60 + step, f"e{step}", "In transit", "Arrived at hub")
+                               for i, (shipment_id, *_) in enumerate(shipments) for step in range(5))
+        print(f"{count} shipments, {count * 5} events inserted in {time.perf_counter() - started:.2f}s")
+        codes = [shipment[1] for shipment in shipments]
+
+        print("with indexes:")
+        indexed = run_queries(db, codes)
+        for name in INDEXES:
+            db.cursor.execute(f"DROP INDEX {name}")
+        print("without indexes:")
+        unindexed = run_queries(db, codes)
+        for statement in INDEXES.values():
+            db.cursor.execute(statement)
+
+        for label in indexed:
+            print(f"  {label:<28} {unindexed[label] / indexed[label]:9.1f}x faster with indexes")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
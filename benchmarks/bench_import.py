@@ -0,0 +1,45 @@
+"""Compares adding shipments one /add_shipment at a time with one bulk import.
+
+Usage: python benchmarks/bench_import.py [shipments]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Importer import parse_shipment_lines
+from fakes import temp_database
+
+
+def main(count: int):
+    with temp_database() as db:
+        db.add_ship_provider("SPX")
+        db.add_ship_provider("GHN")
+        # Start from a database that already tracks 100k parcels.
+        with db.transaction():
+            db.import_shipments((f"OLD{i:09d}", "SPX") for i in range(100_000))
+
+        started = time.perf_counter()
+        for i in range(count):
+            shipment_id = db.insert_shipment(f"ONE{i:09d}", "SPX")
+            db.add_to_current_tracking(shipment_id)
+        one_by_one = time.perf_counter() - started
+        print(f"  one at a time   {one_by_one:8.3f}s")
+
+        # A pasted message: half new codes, a few repeated and already tracked ones.
+        lines = [f"BULK{i:09d} {'SPX' if i % 2 else 'GHN'}" for i in range(count)]
+        lines += [f"OLD{i:09d}, SPX" for i in range(20)] + lines[:20]
+        started = time.perf_counter()
+        shipments, invalid = parse_shipment_lines(lines)
+        result = db.import_shipments(shipments)
+        bulk = time.perf_counter() - started
+        print(f"  bulk import     {bulk:8.3f}s  ({len(result.added)} added, {len(result.duplicates)} duplicates, "
+              f"{one_by_one / bulk:.0f}x faster)")
+        assert len(result.added) == count and len(result.duplicates) == 40 and not invalid
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    print(f"Adding {count} shipments:")
+    main(count)
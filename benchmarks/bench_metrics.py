@@ -0,0 +1,76 @@
+"""Runs the poller and notifier under load against fakes and prints what /metrics reports per stage.
+
+Also times the instrumentation itself, so its overhead on the hot paths is known.
+
+Usage: python benchmarks/bench_metrics.py [shipments] [seconds]
+"""
+import asyncio
+import os
+import sys
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ChangeDetector import ChangeDetector, event_rows
+from Metrics import DB_CALL_SECONDS, UPSTREAM_FETCH_SECONDS, MetricsServer, histogram, summarize
+from Notifier import NotificationDispatcher
+from Poller import Poller
+from Providers import SPXProvider
+from Scheduler import PollScheduler
+from fakes import FakeSPX, FakeTelegram, ServerProcess, temp_database
+
+
+async def main(count: int, seconds: float):
+    with temp_database() as db:
+        db.add_ship_provider("SPX")
+        with db.transaction():
+            db.import_shipments((f"SPXVN{i:012d}", "SPX", f"SPXVN{i:012d}|token") for i in range(count))
+        detector = ChangeDetector(db)
+
+        with ServerProcess(FakeSPX(latency=0.1, error_rate=0.01, change_probability=0.2)) as spx:
+            telegram = FakeTelegram()
+            async with telegram.server() as telegram_server, MetricsServer(port=0) as metrics:
+                provider = SPXProvider(base_url=f"{spx.url}/api/v2/fleet_order/tracking/search")
+                async with Poller(db=db, providers={"SPX": provider}) as poller, \
+                        NotificationDispatcher("TOKEN", db=db, api_url=telegram_server.url) as dispatcher:
+
+                    async def on_result(shipment, events) -> bool:
+                        new_events = detector.diff(shipment[0], events)
+                        if new_events:
+                            with DB_CALL_SECONDS.labels("add_tracking_events").time():
+                                db.add_tracking_events(event_rows(shipment[0], new_events))
+                            dispatcher.notify(hash(shipment[1]) % 100, f"New status on `{shipment[1]}`")
+                        return bool(new_events)
+
+                    scheduler = PollScheduler(min_interval=1, max_interval=2)
+                    task = asyncio.create_task(poller.run(on_result, scheduler))
+                    await asyncio.sleep(seconds)
+                    task.cancel()
+                    await asyncio.wait({task})
+                async with httpx.AsyncClient() as client:
+                    exposition = (await client.get(f"http://127.0.0.1:{metrics.port}/metrics")).text
+
+        print(f"{count} shipments polled for {seconds:g}s; /metrics returned {len(exposition.splitlines())} lines")
+        for line in summarize():
+            print(f"  {line}")
+
+        # Cost of the instrumentation itself.
+        timer = histogram("bench_overhead_seconds", "Instrumentation overhead check.")
+        started = time.perf_counter()
+        for _ in range(100_000):
+            with timer.time():
+                pass
+        timed = (time.perf_counter() - started) / 100_000
+        started = time.perf_counter()
+        for _ in range(100_000):
+            UPSTREAM_FETCH_SECONDS.labels("SPX").observe(0.01)
+        observed = (time.perf_counter() - started) / 100_000
+        print(f"overhead: {observed * 1e6:.2f}µs per labelled observe, {timed * 1e6:.2f}µs per timed block")
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 10
+    asyncio.run(main(count, seconds))
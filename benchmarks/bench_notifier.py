@@ -0,0 +1,41 @@
+"""Drains a burst of status notifications through NotificationDispatcher against a fake Telegram API.
+
+The fake answers with 429 whenever Telegram's global or per-chat limit is
+exceeded, and fails a share of the sends, which the dispatcher must retry.
+
+Usage: python benchmarks/bench_notifier.py [notifications] [chats]
+"""
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Notifier import NotificationDispatcher
+from fakes import FakeTelegram, temp_database
+
+
+async def main(count: int, chats: int):
+    with temp_database() as db:
+        telegram = FakeTelegram(error_rate=0.02)
+        async with telegram.server() as server:
+            async with NotificationDispatcher("TOKEN", db=db, api_url=server.url, retry_interval=0.5) as dispatcher:
+                started = time.perf_counter()
+                for i in range(count):
+                    dispatcher.notify(i % chats, f"New status on your shipment `SPXVN{i:012d}`.")
+                await dispatcher.drain()
+                while db.get_due_notifications(float("inf")):
+                    await asyncio.sleep(0.1)
+                elapsed = time.perf_counter() - started
+        delivered = sum(text.count("New status") for texts in telegram.messages.values() for text in texts)
+        messages = sum(map(len, telegram.messages.values()))
+        print(f"{count} notifications for {chats} chats drained in {elapsed:.2f}s")
+        print(f"  {messages} messages sent ({messages / elapsed:.1f}/s), {delivered} notifications delivered, "
+              f"{telegram.rate_limited} 429s, {dispatcher.failed} failures retried")
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    chats = int(sys.argv[2]) if len(sys.argv) > 2 else 300
+    asyncio.run(main(count, chats))
@@ -0,0 +1,97 @@
+"""Compares one concurrent poll cycle with a sequential one against a local fake SPX.
+
+Then checks that Poller.run keeps going through idle gaps between polls, and
+that a cancelled run stops promptly while results keep arriving, which
+asyncio.wait_for used to prevent.
+
+Usage: python benchmarks/bench_poller.py [shipments] [latency_seconds]
+"""
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Poller import Poller
+from Providers import SPXProvider
+from Scheduler import PollScheduler
+from fakes import FakeProvider, FakeSPX, ServerProcess, temp_database
+
+
+async def timed_cycle(base_url: str, shipments: list, concurrency: int) -> float:
+    provider = SPXProvider(max_concurrency=concurrency, base_url=base_url,
+                           tracking_numbers={code: f"{code}|token" for _, code, _ in shipments})
+    async with Poller(providers={"SPX": provider}) as poller:
+        started = time.perf_counter()
+        results = await poller.poll_once(shipments)
+        elapsed = time.perf_counter() - started
+    failed = sum(1 for _, response in results if response is None)
+    assert failed == 0, f"{failed} requests failed"
+    return elapsed
+
+
+async def idle_run(count: int, seconds: float) -> int:
+    """Polls `count` shipments every 0.3s for `seconds`, mostly waiting in between; returns the results handled."""
+    handled = 0
+
+    async def on_result(shipment, events) -> bool:
+        nonlocal handled
+        handled += 1
+        return False
+
+    with temp_database(singleton=False) as db:
+        db.add_ship_provider("FAKE")
+        with db.transaction():
+            db.import_shipments((f"FAKE{i:08d}", "FAKE") for i in range(count))
+        async with Poller(db=db, providers={"FAKE": FakeProvider(latency=0.01)}) as poller:
+            task = asyncio.create_task(poller.run(on_result, PollScheduler(min_interval=0.3, max_interval=0.3)))
+            await asyncio.sleep(seconds)
+            assert not task.done(), f"Poller.run stopped after {handled} results: {task.exception()!r}"
+            task.cancel()
+            await asyncio.wait({task})
+        return handled
+
+
+async def cancelled_run(base_url: str, count: int) -> float:
+    """Polls `count` shipments as fast as possible for a few seconds, then returns how long run() takes to stop."""
+    async def on_result(shipment, events) -> bool:
+        return False
+
+    with temp_database() as db:
+        db.add_ship_provider("SPX")
+        with db.transaction():
+            db.import_shipments((f"SPXVN{i:012d}", "SPX", f"SPXVN{i:012d}|token") for i in range(count))
+        provider = SPXProvider(max_concurrency=500, base_url=base_url)
+        async with Poller(db=db, providers={"SPX": provider}) as poller:
+            task = asyncio.create_task(poller.run(on_result, PollScheduler(min_interval=1, max_interval=1)))
+            await asyncio.sleep(3)
+            task.cancel()
+            started = time.perf_counter()
+            await asyncio.wait({task}, timeout=10)
+            return time.perf_counter() - started if task.done() else float("inf")
+
+
+async def main(count: int, latency: float):
+    shipments = [(f"id-{i}", f"SPXVN{i:012d}", "SPX") for i in range(count)]
+    with ServerProcess(FakeSPX(latency=latency)) as server:
+        base_url = f"{server.url}/api/v2/fleet_order/tracking/search"
+        sample = shipments[:10]
+        sequential = await timed_cycle(base_url, sample, concurrency=1)
+        print(f"sequential: {len(sample)} shipments in {sequential:.2f}s "
+              f"(~{sequential / len(sample) * count:.1f}s projected for {count})")
+        concurrent = await timed_cycle(base_url, shipments, concurrency=500)
+        print(f"concurrent: {count} shipments in {concurrent:.2f}s "
+              f"(latency {latency:.2f}s, {count / concurrent:.0f} req/s)")
+        handled = await idle_run(3, seconds=2)
+        print(f"idle run: {handled} results for 3 shipments polled every 0.3s for 2s")
+        assert handled >= 3 * 4, "Poller.run stopped handling results between polls"
+        stopped = await cancelled_run(base_url, count)
+        print(f"cancelled run stopped after {stopped:.2f}s")
+        assert stopped < 1, "Poller.run did not stop within 10s of being cancelled"
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.5
+    asyncio.run(main(count, latency))
@@ -0,0 +1,51 @@
+"""Polls a fast and a slow fake carrier together and times when each one's results arrive.
+
+Usage: python benchmarks/bench_providers.py [shipments_per_provider] [slow_latency]
+"""
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Poller import Poller
+from fakes import FakeProvider, temp_database
+
+
+async def main(count: int, slow_latency: float):
+    with temp_database() as db:
+        with db.transaction():
+            for name in ("FAST", "SLOW"):
+                db.add_ship_provider(name)
+                for i in range(count):
+                    shipment_id = db.insert_shipment(f"{name}{i:08d}", name)
+                    db.add_to_current_tracking(shipment_id)
+
+        providers = {"FAST": FakeProvider(latency=0.05, max_concurrency=50),
+                     "SLOW": FakeProvider(latency=slow_latency, max_concurrency=10)}
+        finished = {}
+        seen = {"FAST": 0, "SLOW": 0}
+        started = time.perf_counter()
+
+        async def on_result(shipment, events) -> bool:
+            seen[shipment[2]] += 1
+            if seen[shipment[2]] == count:
+                finished[shipment[2]] = time.perf_counter() - started
+            return False
+
+        async with Poller(providers=providers) as poller:
+            task = asyncio.create_task(poller.run(on_result))
+            while len(finished) < 2:
+                await asyncio.sleep(0.01)
+            task.cancel()
+
+        print(f"{count} shipments per provider")
+        print(f"  FAST (0.05s, 50 concurrent): all polled after {finished['FAST']:.2f}s")
+        print(f"  SLOW ({slow_latency:g}s, 10 concurrent): all polled after {finished['SLOW']:.2f}s")
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    slow_latency = float(sys.argv[2]) if len(sys.argv) > 2 else 1.0
+    asyncio.run(main(count, slow_latency))
@@ -0,0 +1,70 @@
+"""Simulates parcels moving through the network and counts the polls the scheduler makes.
+
+Usage: python benchmarks/bench_scheduler.py [shipments] [days] [max_interval_seconds]
+"""
+import bisect
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Scheduler import PollScheduler
+
+
+class SimulatedClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def simulate(count: int, days: float, max_interval: float = None, seed: int = 0):
+    rng = random.Random(seed)
+    clock = SimulatedClock()
+    scheduler = PollScheduler(clock=clock) if max_interval is None else PollScheduler(max_interval=max_interval, clock=clock)
+    horizon = days * 86400
+
+    # Each parcel gets 4-10 events spread over 1-5 days; the last one is the delivery.
+    timelines = {}
+    for i in range(count):
+        start = rng.uniform(0, horizon / 2)
+        steps = sorted(rng.uniform(0, rng.uniform(86400, 5 * 86400)) for _ in range(rng.randint(4, 10)))
+        timelines[i] = [start + step for step in steps]
+        scheduler.add(i, due=start)
+
+    seen = {i: 0 for i in range(count)}
+    delays = []
+    while clock.now < horizon:
+        next_due = scheduler.next_due()
+        if next_due is None:
+            break
+        clock.now = max(clock.now, next_due)
+        for key in scheduler.pop_due():
+            events = timelines[key]
+            visible = bisect.bisect_right(events, clock.now)
+            changed = visible > seen[key]
+            if changed:
+                delays.append(clock.now - events[visible - 1])
+            seen[key] = visible
+            scheduler.record(key, changed, delivered=visible == len(events),
+                             last_change=events[visible - 1] if visible else None)
+
+    metrics = scheduler.metrics()
+    fixed = sum(min(events[-1], horizon) - events[0] for events in timelines.values()) / scheduler.min_interval
+    print(f"{count} shipments over {days:g} days, polled at least every {scheduler.max_interval:g}s")
+    print(f"fixed {scheduler.min_interval:g}s cadence: {fixed:,.0f} requests")
+    print(f"scheduler: {metrics['polls']:,} requests, {metrics['changes']:,} changes seen, "
+          f"{metrics['delivered']:,} delivered, {metrics['saved_requests']:,} saved")
+    delays.sort()
+    if delays:
+        print(f"detection delay: p50 {delays[len(delays) // 2] / 60:.1f} min, "
+              f"p99 {delays[int(len(delays) * 0.99)] / 60:.1f} min")
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    days = float(sys.argv[2]) if len(sys.argv) > 2 else 7
+    max_interval = float(sys.argv[3]) if len(sys.argv) > 3 else None
+    simulate(count, days, max_interval)
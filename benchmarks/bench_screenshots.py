@@ -0,0 +1,86 @@
+"""Measures snapshot latency of the pooled screenshot service (JS-puppeteer/server.js).
+
+Starts the service with node, points it at FakeSPX pages (rendered as text by
+Chromium) and times a first round of captures, a round where every page
+changed and a round where none did, which the service answers with 304
+without taking a screenshot.
+Needs `npm install puppeteer` in JS-puppeteer.
+
+Usage: python benchmarks/bench_screenshots.py [codes] [pages]
+"""
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+
+from ScreenshotClient import ScreenshotClient
+from fakes import FakeSPX, ServerProcess
+
+SERVICE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "JS-puppeteer")
+PORT = 8939
+
+
+async def wait_until_ready(service: subprocess.Popen, url: str, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while True:
+            try:
+                return (await client.get(f"{url}/health")).json()
+            except httpx.HTTPError:
+                if service.poll() is not None or time.monotonic() > deadline:
+                    raise
+                await asyncio.sleep(0.2)
+
+
+async def capture_round(client: ScreenshotClient, codes, page_url: str):
+    latencies = []
+    images = 0
+
+    async def capture(code):
+        nonlocal images
+        started = time.perf_counter()
+        snapshot = await client.capture(code, page_url + code)
+        latencies.append(time.perf_counter() - started)
+        images += snapshot is not None
+
+    started = time.perf_counter()
+    await asyncio.gather(*(capture(code) for code in codes))
+    return time.perf_counter() - started, sorted(latencies), images
+
+
+async def main(count: int, pages: int):
+    codes = [f"SPXVN{i:012d}" for i in range(count)]
+    env = dict(os.environ, SCREENSHOT_PORT=str(PORT), SCREENSHOT_PAGES=str(pages), SCREENSHOT_QUEUE=str(count))
+    service = subprocess.Popen(["node", "server.js"], cwd=SERVICE_DIR, env=env)
+    try:
+        service_url = f"http://127.0.0.1:{PORT}"
+        await wait_until_ready(service, service_url)
+        with ServerProcess(FakeSPX(latency=0.05)) as server:
+            page_url = f"{server.url}/api/v2/fleet_order/tracking/search?sls_tracking_number="
+            async with ScreenshotClient(service_url) as client:
+                for label in ("first capture", "every page changed", "nothing changed"):
+                    if label == "every page changed":
+                        # Without a previous hash the service captures as it would for a changed page.
+                        for code in codes:
+                            client.forget(code)
+                    elapsed, latencies, images = await capture_round(client, codes, page_url)
+                    print(f"{label}: {count} codes in {elapsed:.2f}s, {images} images, "
+                          f"p50 {statistics.median(latencies) * 1000:.0f}ms, "
+                          f"p99 {latencies[int(len(latencies) * 0.99) - 1] * 1000:.0f}ms")
+        async with httpx.AsyncClient() as client:
+            print(f"service: {(await client.get(f'{service_url}/health')).json()}")
+    finally:
+        service.terminate()
+        service.wait()
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    pages = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    asyncio.run(main(count, pages))
@@ -0,0 +1,110 @@
+"""Measures the poll loop's per-refresh cost and memory with and without the resident StateIndex.
+
+Before the index, every refresh re-read all tracked shipments and rebuilt
+their tuples, and every shipment's first poll looked up its fingerprint on
+its own. The index is loaded once; later refreshes only read new rows.
+
+Usage: python benchmarks/bench_state_index.py [shipments]
+"""
+import os
+import sys
+import time
+import tracemalloc
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Database import Database
+from Scheduler import PollScheduler
+from StateIndex import StateIndex
+from fakes import temp_database
+
+
+def seed(db: Database, count: int):
+    db.add_ship_provider("SPX", "https://spx.vn/track?$$CODE$$")
+    provider_id = db.get_provider_id("SPX")
+    ids = [str(uuid.uuid4()) for _ in range(count)]
+    now = time.time()
+    with db.transaction():
+        db.cursor.executemany("INSERT INTO shipments (ID, CODE, PROVIDER_ID, STATUS) VALUES (?, ?, ?, 0)",
+                              ((shipment_id, f"SPXVN{i:012d}", provider_id) for i, shipment_id in enumerate(ids)))
+        db.cursor.executemany("INSERT INTO current_tracking (SHIPMENT_ID, NEXT_POLL) VALUES (?, ?)",
+                              ((shipment_id, now + i % 3600) for i, shipment_id in enumerate(ids)))
+        db.cursor.executemany("INSERT INTO tracking_state (SHIPMENT_ID, LAST_EVENT_TIME, HEAD_HASH) VALUES (?, ?, ?)",
+                              ((shipment_id, 1_700_000_000 + i, f"{i:016x}") for i, shipment_id in enumerate(ids)))
+    return ids
+
+
+def timed(function):
+    started = time.perf_counter()
+    result = function()
+    return time.perf_counter() - started, result
+
+
+def measured(function):
+    """Returns (seconds, bytes still allocated afterwards, result)."""
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = function()
+    elapsed = time.perf_counter() - started
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return elapsed, size, result
+
+
+def main(count: int):
+    with temp_database() as db:
+        ids = seed(db, count)
+
+        def load():
+            return {row[0]: row[:3] for row in db.get_tracked_shipments()}
+
+        def reload():
+            work = [(row[:3], row[3]) for row in db.get_tracked_shipments()]
+            shipments = {shipment[0]: shipment for shipment, _ in work}
+            scheduler = PollScheduler()
+            for shipment, next_poll in work:
+                scheduler.add(shipment[0], due=next_poll)
+            return shipments, scheduler
+
+        def fingerprints():
+            return {shipment_id: db.get_tracking_state(shipment_id) for shipment_id in ids}
+
+        reload_time, _ = timed(reload)
+        lookup_time, _ = timed(fingerprints)
+        size = measured(lambda: (load(), fingerprints()))[1]
+        print(f"before: every refresh {reload_time * 1000:.0f}ms; the first cycle also spends "
+              f"{lookup_time:.2f}s on {count} fingerprint lookups; "
+              f"{size / count:.0f} bytes per shipment (tuples and fingerprints)")
+
+        size = measured(lambda: StateIndex().refresh(db))[1]
+        index = StateIndex()
+        elapsed, _ = timed(lambda: index.refresh(db))
+        print(f"index: loaded {len(index)} shipments in {elapsed * 1000:.0f}ms, {size / count:.0f} bytes per shipment")
+        elapsed, (added, removed) = timed(lambda: index.refresh(db))
+        print(f"index: refresh without changes {elapsed * 1000:.1f}ms ({len(added)} added, {len(removed)} removed)")
+
+        # Like the bot, on its own connection.
+        bot_db = Database.new_connection()
+        result = bot_db.import_shipments((f"NEWVN{i:012d}", "SPX") for i in range(100))
+        bot_db.update_shipment_statuses((shipment_id, True) for shipment_id in ids[:100])
+        bot_db.close()
+        elapsed, (added, removed) = timed(lambda: index.refresh(db))
+        print(f"index: refresh after {len(result.added)} imports and 100 deliveries {elapsed * 1000:.1f}ms "
+              f"({len(added)} added, {len(removed)} removed)")
+
+        dirty = ids[100:100 + count // 10]
+        for shipment_id in dirty:
+            index.set_next_poll(shipment_id, time.time() + 600)
+            index.set_fingerprint(shipment_id, (1_800_000_000, "0" * 16, "0" * 16))
+        with db.transaction():
+            elapsed, _ = timed(lambda: index.flush_fingerprints(db))
+        print(f"index: flushing {len(dirty)} fingerprints {elapsed * 1000:.0f}ms")
+        with db.transaction():
+            elapsed, _ = timed(lambda: index.checkpoint(db))
+        print(f"index: checkpointing {len(dirty)} next polls {elapsed * 1000:.0f}ms")
+
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
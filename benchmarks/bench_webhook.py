@@ -0,0 +1,115 @@
+"""End-to-end check of ActiveBot's webhook mode with locally posted fake updates.
+
+Posts /status updates to a WebhookServer over 40 keep-alive connections, the
+most Telegram opens by default, while the bot answers through FakeTelegram
+with a delay. Reports how fast updates are acknowledged versus handled, then
+checks the secret token, malformed bodies and the bounded queue.
+
+Usage: python benchmarks/bench_webhook.py [updates] [telegram_latency_ms]
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+
+import ActiveBot
+from Webhook import SECRET_TOKEN_HEADER, WebhookServer
+from fakes import FakeTelegram, ServerProcess, temp_database
+
+SECRET = "bench-secret"
+
+
+def status_update(update_id: int, shipment_id: str) -> dict:
+    text = f"/status {shipment_id}"
+    return {"update_id": update_id, "message": {
+        "message_id": update_id, "date": int(time.time()), "text": text,
+        "chat": {"id": 1, "type": "private"}, "from": {"id": 1, "is_bot": False, "first_name": "Ops"},
+        "entities": [{"type": "bot_command", "offset": 0, "length": len("/status")}]}}
+
+
+async def post_updates(url: str, updates, secret: str):
+    latencies = []
+    statuses = {}
+    limits = httpx.Limits(max_connections=40, max_keepalive_connections=40)
+    async with httpx.AsyncClient(limits=limits, timeout=httpx.Timeout(30, pool=None)) as client:
+        async def post(update):
+            async with semaphore:
+                started = time.perf_counter()
+                response = await client.post(url, json=update, headers={SECRET_TOKEN_HEADER: secret})
+                latencies.append(time.perf_counter() - started)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+        # One request in flight per connection, like Telegram, so latency is the server's, not the pool's.
+        semaphore = asyncio.Semaphore(40)
+        await asyncio.gather(*(post(update) for update in updates))
+    return sorted(latencies), statuses
+
+
+def _post_in_child(url: str, updates, secret: str, connection):
+    connection.send(asyncio.run(post_updates(url, updates, secret)))
+
+
+async def post_all(url: str, updates, secret: str = SECRET):
+    """Posts from a child process, so the sender's CPU time doesn't slow down the bot under test."""
+    parent, child = multiprocessing.Pipe()
+    process = multiprocessing.Process(target=_post_in_child, args=(url, updates, secret, child), daemon=True)
+    process.start()
+    result = await asyncio.get_running_loop().run_in_executor(None, parent.recv)
+    process.join()
+    return result
+
+
+async def run(count: int, latency: float, ids):
+    # ActiveBot logs every Bot API request at INFO.
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    updates = [status_update(i + 1, ids[i % len(ids)]) for i in range(count)]
+    with ServerProcess(FakeTelegram(latency=latency, global_rate=10 ** 9, per_chat_rate=10 ** 9)) as server:
+        async with ActiveBot.TelegramBot("TOKEN", api_url=server.url) as bot:
+            async with bot.webhook(SECRET, webhook_url=f"{server.url}/hook", port=0) as webhook:
+                started = time.perf_counter()
+                latencies, statuses = await post_all(webhook.url, updates)
+                acknowledged = time.perf_counter() - started
+                await webhook.drain()
+                handled = time.perf_counter() - started
+                print(f"{count} updates: acknowledged in {acknowledged:.2f}s "
+                      f"(p50 {latencies[len(latencies) // 2] * 1000:.1f} ms, "
+                      f"p99 {latencies[int(len(latencies) * 0.99) - 1] * 1000:.1f} ms), "
+                      f"all handled after {handled:.2f}s, {webhook.processed} processed, statuses {statuses}")
+
+                _, forbidden = await post_all(webhook.url, updates[:10], secret="wrong")
+                async with httpx.AsyncClient() as client:
+                    malformed = await client.post(webhook.url, content=b"{not json", headers={SECRET_TOKEN_HEADER: SECRET})
+                print(f"wrong secret: {forbidden}, malformed body: {malformed.status_code}")
+
+            # A tiny queue with slow handlers: the overflow is refused and left for Telegram to retry.
+            small = WebhookServer(bot.application, SECRET, port=0, workers=2, max_queue=50)
+            async with small:
+                _, statuses = await post_all(small.url, updates[:500])
+            print(f"queue of 50 with 2 workers, 500 updates at once: {statuses}, {small.processed} processed")
+
+
+def main(count: int, latency: float):
+    with temp_database() as db:
+        db.add_ship_provider("SPX", "https://spx.vn/track?$$CODE$$")
+        provider_id = db.get_provider_id("SPX")
+        ids = [str(uuid.uuid4()) for _ in range(1000)]
+        db.cursor.executemany("INSERT INTO shipments (ID, CODE, PROVIDER_ID, STATUS) VALUES (?, ?, ?, ?)",
+                              ((shipment_id, f"SPXVN{i:012d}", provider_id, 0) for i, shipment_id in enumerate(ids)))
+        db.conn.commit()
+        try:
+            asyncio.run(run(count, latency, ids))
+        finally:
+            ActiveBot.db.close()
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    latency = float(sys.argv[2]) / 1000 if len(sys.argv) > 2 else 0.2
+    main(count, latency)
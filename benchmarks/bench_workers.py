@@ -0,0 +1,196 @@
+"""Runs several lease-based poller workers in separate processes against one database.
+
+Each worker polls a stub carrier that takes a fixed time per lookup and has a
+bounded concurrency, so a single worker is saturated. The check fails if any
+shipment is fetched or handled twice, or not at all; a share of the
+shipments starts out leased to a dead worker to exercise lease takeover.
+
+Then polls a smaller set repeatedly while a second worker joins, and checks
+that no shipment handed over mid-fetch is polled again sooner than the
+scheduler's minimum interval.
+
+Usage: python benchmarks/bench_workers.py [shipments] [max_workers]
+"""
+import asyncio
+import multiprocessing
+import os
+import sys
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Database import Database
+from Poller import Poller
+from Scheduler import PollScheduler
+from fakes import FakeProvider, temp_database
+
+LEASE_DURATION = 2.0
+REFRESH_INTERVAL = 0.5
+
+
+def worker(db_path: str, worker_id: str, total: int, ready, start, handled, results):
+    async def run():
+        Database.DB_PATH = db_path
+        Database.get_instance()
+        ready.wait()
+        start.wait()
+        provider = FakeProvider(latency=0.05, max_concurrency=50, seed=hash(worker_id))
+        fetched = Counter()
+        fetch = provider.fetch
+
+        async def counting_fetch(code):
+            fetched[code] += 1
+            return await fetch(code)
+
+        provider.fetch = counting_fetch
+        seen = []
+
+        async def on_result(shipment, events) -> bool:
+            seen.append(shipment[0])
+            with handled.get_lock():
+                handled.value += 1
+            return False
+
+        # Each shipment is due exactly once during the run.
+        scheduler = PollScheduler(min_interval=3600)
+        async with Poller(providers={"FAKE": provider}, worker_id=worker_id, lease_duration=LEASE_DURATION) as poller:
+            task = asyncio.create_task(poller.run(on_result, scheduler, refresh_interval=REFRESH_INTERVAL))
+            while handled.value < total:
+                await asyncio.sleep(0.05)
+            task.cancel()
+        results.put((worker_id, dict(fetched), seen))
+
+    asyncio.run(run())
+
+
+def polling_worker(db_path: str, worker_id: str, delay: float, until: float, min_interval: float, results):
+    async def run():
+        Database.DB_PATH = db_path
+        Database.get_instance()
+        await asyncio.sleep(delay)
+        provider = FakeProvider(latency=0.6, max_concurrency=50, seed=hash(worker_id))
+        fetched = {}
+        fetch = provider.fetch
+
+        async def timed_fetch(code):
+            fetched.setdefault(code, []).append(time.time())
+            return await fetch(code)
+
+        provider.fetch = timed_fetch
+
+        async def on_result(shipment, events) -> bool:
+            return False
+
+        scheduler = PollScheduler(min_interval=min_interval, max_interval=min_interval)
+        async with Poller(providers={"FAKE": provider}, worker_id=worker_id, lease_duration=LEASE_DURATION) as poller:
+            task = asyncio.create_task(poller.run(on_result, scheduler, refresh_interval=REFRESH_INTERVAL))
+            await asyncio.sleep(until - time.time())
+            task.cancel()
+            await asyncio.wait({task})
+        results.put(fetched)
+
+    asyncio.run(run())
+
+
+def rebalance_trial(count: int, min_interval: float, seconds: float = 8.0) -> float:
+    """Returns the shortest time between two polls of the same shipment, across both workers."""
+    with temp_database(singleton=False) as setup:
+        db_path = Database.DB_PATH
+        with setup.transaction():
+            setup.add_ship_provider("FAKE")
+            setup.import_shipments((f"FAKE{i:08d}", "FAKE") for i in range(count))
+
+        results = multiprocessing.Queue()
+        until = time.time() + seconds
+        # The second worker joins once the first holds every lease and is polling them.
+        processes = [multiprocessing.Process(target=polling_worker,
+                                             args=(db_path, f"worker-{i}", delay, until, min_interval, results))
+                     for i, delay in enumerate((0, seconds / 3))]
+        for process in processes:
+            process.start()
+        fetched = {}
+        for _ in processes:
+            worker_fetched = results.get()
+            assert worker_fetched, "a worker polled nothing, so no shipments were handed over"
+            for code, times in worker_fetched.items():
+                fetched.setdefault(code, []).extend(times)
+        for process in processes:
+            process.join()
+
+    gaps = [later - earlier for times in fetched.values() for earlier, later in zip(sorted(times), sorted(times)[1:])]
+    assert len(fetched) == count, f"{len(fetched)} of {count} codes polled"
+    return min(gaps)
+
+
+def trial(count: int, workers: int) -> float:
+    with temp_database(singleton=False) as setup:
+        db_path = Database.DB_PATH
+        db = Database.connect(db_path)
+        with setup.transaction():
+            setup.add_ship_provider("FAKE")
+            for i in range(count):
+                setup.add_to_current_tracking(setup.insert_shipment(f"FAKE{i:08d}", "FAKE"))
+        # A worker that died holding a tenth of the shipments; its leases have expired.
+        db.execute("UPDATE current_tracking SET LEASE_OWNER = 'dead', LEASE_EXPIRES = ? WHERE ID % 10 = 0",
+                   (time.time() - 1,))
+        # Register the workers up front, so their first claims already split the work evenly.
+        db.executemany("INSERT INTO poller_workers (ID, LAST_SEEN) VALUES (?, ?)",
+                       ((f"worker-{i}", time.time()) for i in range(workers)))
+        db.commit()
+
+        ready = multiprocessing.Barrier(workers + 1)
+        start = multiprocessing.Barrier(workers + 1)
+        handled = multiprocessing.Value("i", 0)
+        results = multiprocessing.Queue()
+        processes = [multiprocessing.Process(target=worker,
+                                             args=(db_path, f"worker-{i}", count, ready, start, handled, results))
+                     for i in range(workers)]
+        for process in processes:
+            process.start()
+        ready.wait()
+        started = time.perf_counter()
+        start.wait()
+        while handled.value < count:
+            time.sleep(0.01)
+        elapsed = time.perf_counter() - started
+
+        fetched = Counter()
+        seen = Counter()
+        for _ in processes:
+            worker_id, worker_fetched, worker_seen = results.get()
+            fetched.update(worker_fetched)
+            seen.update(worker_seen)
+        for process in processes:
+            process.join()
+        db.close()
+
+    assert len(fetched) == count and max(fetched.values()) == 1, \
+        f"{len(fetched)} of {count} codes fetched, {sum(n > 1 for n in fetched.values())} more than once"
+    assert len(seen) == count and max(seen.values()) == 1, \
+        f"{len(seen)} of {count} shipments handled, {sum(n > 1 for n in seen.values())} more than once"
+    return elapsed
+
+
+def main(count: int, max_workers: int):
+    baseline = None
+    workers = 1
+    while workers <= max_workers:
+        elapsed = trial(count, workers)
+        baseline = baseline or elapsed
+        print(f"{workers} worker(s): {count} shipments in {elapsed:.2f}s ({count / elapsed:.0f}/s, "
+              f"{baseline / elapsed:.1f}x), each fetched exactly once")
+        workers *= 2
+
+    # Fetching all 200 takes the first worker 2.4s, so most are in flight at any time.
+    min_interval = 0.5
+    gap = rebalance_trial(200, min_interval)
+    print(f"rebalancing: a second worker joined while 200 shipments were polled every {min_interval:g}s; "
+          f"shortest gap between polls of one shipment {gap:.2f}s")
+    assert gap >= min_interval, "a shipment handed over mid-fetch was polled again sooner than min_interval"
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    max_workers = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    main(count, max_workers)
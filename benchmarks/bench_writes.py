@@ -0,0 +1,60 @@
+"""Compares per-call commits with one transaction per poll cycle for bulk status updates.
+
+Usage: python benchmarks/bench_writes.py [updates]
+"""
+import os
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Database import Database
+from fakes import temp_database
+
+
+def timed(label: str, func, count: int) -> float:
+    started = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - started
+    print(f"  {label:<44} {elapsed:8.3f}s  {count / elapsed:>10,.0f} updates/s")
+    return elapsed
+
+
+def main(count: int):
+    with temp_database() as db:
+        db.add_ship_provider("SPX", "https://spx.vn/track?$$CODE$$")
+        provider_id = db.get_provider_id("SPX")
+        ids = [str(uuid.uuid4()) for _ in range(count)]
+        db.cursor.executemany("INSERT INTO shipments (ID, CODE, PROVIDER_ID, STATUS) VALUES (?, ?, ?, 0)",
+                              ((shipment_id, f"SPXVN{i:012d}", provider_id) for i, shipment_id in enumerate(ids)))
+        db.conn.commit()
+
+        def per_call():
+            for shipment_id in ids:
+                db.update_shipment_status(shipment_id, True)
+
+        def one_transaction():
+            with db.transaction():
+                for shipment_id in ids:
+                    db.update_shipment_status(shipment_id, True)
+
+        def executemany():
+            with db.transaction():
+                db.update_shipment_statuses((shipment_id, True) for shipment_id in ids)
+
+        print(f"{count} status updates:")
+        db.conn.execute("PRAGMA journal_mode = DELETE")
+        db.conn.execute("PRAGMA synchronous = FULL")
+        baseline = timed("commit per call, rollback journal", per_call, count)
+        for pragma in Database.PRAGMAS:
+            db.conn.execute(pragma)
+        timed("commit per call, WAL", per_call, count)
+        batched = timed("one transaction, WAL", one_transaction, count)
+        bulk = timed("one transaction + executemany, WAL", executemany, count)
+        print(f"  speedup over baseline: {baseline / batched:,.0f}x (transaction), "
+              f"{baseline / bulk:,.0f}x (executemany)")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5000)
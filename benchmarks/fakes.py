@@ -0,0 +1,288 @@
+"""Local stand-ins for the upstream HTTP APIs and carriers, used by the benchmarks."""
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import re
+import shutil
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from typing import Awaitable, Callable, Dict, Iterator, List, Optional
+from urllib.parse import parse_qs, urlsplit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Database import Database
+from Providers import TrackingEvent, TrackingProvider, register_provider
+
+# Handlers return (status, payload) or (status, payload, extra_headers).
+Handler = Callable[[str, str, Dict[str, list], Dict[str, str], bytes], Awaitable[tuple]]
+
+REASONS = {200: "OK", 304: "Not Modified", 400: "Bad Request", 404: "Not Found",
+           429: "Too Many Requests", 500: "Internal Server Error"}
+
+
+@contextmanager
+def temp_database(singleton: bool = True) -> Iterator[Database]:
+    """A fresh database in a temporary directory, closed and deleted on exit.
+
+    Database.DB_PATH points at it, so new_connection() and worker processes
+    open the same file. The singleton can only be opened once per process;
+    pass `singleton=False` to get a connection of its own instead.
+    """
+    directory = tempfile.mkdtemp()
+    Database.DB_PATH = os.path.join(directory, "bench.sqlite")
+    db = Database.get_instance() if singleton else Database.new_connection()
+    try:
+        yield db
+    finally:
+        db.close()
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+class FakeHTTPServer:
+    """Minimal keep-alive HTTP/1.1 server answering every request with JSON."""
+
+    def __init__(self, handler: Handler, host: str = "127.0.0.1", port: int = 0):
+        self.handler = handler
+        self.host = host
+        self.port = port
+        self.requests = 0
+        self._server = None
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    async def __aenter__(self):
+        self._server = await asyncio.start_server(self._serve, self.host, self.port, backlog=4096)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                lines = head.decode("latin-1").split("\r\n")
+                method, target, _ = lines[0].split(" ", 2)
+                headers = {}
+                for line in lines[1:]:
+                    if ":" in line:
+                        name, value = line.split(":", 1)
+                        headers[name.strip().lower()] = value.strip()
+                body = b""
+                if "content-length" in headers:
+                    body = await reader.readexactly(int(headers["content-length"]))
+                parts = urlsplit(target)
+                self.requests += 1
+                status, payload, *extra = await self.handler(method, parts.path, parse_qs(parts.query), headers, body)
+                data = b"" if payload is None else json.dumps(payload).encode()
+                extra_headers = "".join(f"{name}: {value}\r\n" for name, value in (extra[0] if extra else {}).items())
+                writer.write(
+                    f"HTTP/1.1 {status} {REASONS.get(status, 'Unknown')}\r\n"
+                    f"Content-Type: application/json\r\n{extra_headers}"
+                    f"Content-Length: {len(data)}\r\n\r\n".encode() + data
+                )
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+def _serve_forever(fake, connection):
+    async def serve():
+        async with FakeHTTPServer(fake.handle) as server:
+            connection.send(server.port)
+            await asyncio.Event().wait()
+
+    asyncio.run(serve())
+
+
+class ServerProcess:
+    """Runs a fake's HTTP server in a child process, so it doesn't compete with the client for the GIL."""
+
+    def __init__(self, fake, host: str = "127.0.0.1"):
+        self.fake = fake
+        self.host = host
+        self.port = None
+        self._process = None
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def __enter__(self):
+        parent, child = multiprocessing.Pipe()
+        self._process = multiprocessing.Process(target=_serve_forever, args=(self.fake, child), daemon=True)
+        self._process.start()
+        self.port = parent.recv()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._process.terminate()
+        self._process.join()
+
+
+class FakeSPX:
+    """Serves `tracking/search` with configurable latency, errors and status changes."""
+
+    def __init__(self, latency: float = 0.1, error_rate: float = 0.0, change_probability: float = 0.0,
+                 seed: int = 0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.change_probability = change_probability
+        self.random = random.Random(seed)
+        self.events: Dict[str, list] = {}
+        self.not_modified = 0
+
+    def tracking_list(self, code: str) -> list:
+        events = self.events.get(code)
+        if events is None:
+            events = self.events[code] = [{"timestamp": 1_700_000_000, "status": "Created",
+                                           "message": "Order created"}]
+        elif self.random.random() < self.change_probability:
+            events.insert(0, {"timestamp": events[0]["timestamp"] + 3600, "status": "In transit",
+                              "message": f"Arrived at hub #{len(events)}"})
+        return events
+
+    async def handle(self, method, path, query, headers, body):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.random.random() < self.error_rate:
+            return 500, {"retcode": -1, "message": "error"}
+        code = query.get("sls_tracking_number", [""])[0].split("|")[0]
+        tracking_list = self.tracking_list(code)
+        etag = f'"{code}-{len(tracking_list)}"'
+        if headers.get("if-none-match") == etag:
+            self.not_modified += 1
+            return 304, None, {"ETag": etag}
+        return 200, {"retcode": 0, "message": "success",
+                     "data": {"sls_tracking_number": code, "tracking_list": tracking_list}}, {"ETag": etag}
+
+    def server(self) -> FakeHTTPServer:
+        return FakeHTTPServer(self.handle)
+
+
+class FakeTelegram:
+    """Serves the Bot API send methods and enforces Telegram's rate limits with 429s.
+
+    Accepts JSON, form and multipart requests, so python-telegram-bot
+    Applications and plain HTTP clients can both talk to it.
+    """
+
+    def __init__(self, latency: float = 0.05, error_rate: float = 0.0, global_rate: int = 30,
+                 per_chat_rate: int = 1, seed: int = 0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.global_rate = global_rate
+        self.per_chat_rate = per_chat_rate
+        self.random = random.Random(seed)
+        self.messages: Dict[str, list] = {}
+        self.rate_limited = 0
+        self._global_window: list = []
+        self._chat_windows: Dict[str, list] = {}
+
+    def _over_limit(self, chat_id: str, now: float) -> bool:
+        window = [t for t in self._global_window if now - t < 1]
+        chat_window = [t for t in self._chat_windows.get(chat_id, []) if now - t < 1]
+        self._global_window, self._chat_windows[chat_id] = window, chat_window
+        if len(window) >= self.global_rate or len(chat_window) >= self.per_chat_rate:
+            return True
+        window.append(now)
+        chat_window.append(now)
+        return False
+
+    @staticmethod
+    def _payload(headers: Dict[str, str], body: bytes) -> dict:
+        content_type = headers.get("content-type", "")
+        if content_type.startswith("application/json"):
+            return json.loads(body or b"{}")
+        if content_type.startswith("application/x-www-form-urlencoded"):
+            return {name: values[0] for name, values in parse_qs(body.decode()).items()}
+        # Multipart uploads (sendDocument, sendPhoto): only the chat matters here.
+        match = re.search(rb'name="chat_id"\r\n\r\n([^\r]*)', body)
+        return {"chat_id": match.group(1).decode()} if match else {}
+
+    async def handle(self, method, path, query, headers, body):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        api_method = path.rsplit("/", 1)[-1]
+        if api_method == "getMe":
+            return 200, {"ok": True, "result": {"id": 1, "is_bot": True, "first_name": "Fake", "username": "fake_bot"}}
+        payload = self._payload(headers, body)
+        chat_id = str(payload.get("chat_id"))
+        if self._over_limit(chat_id, asyncio.get_running_loop().time()):
+            self.rate_limited += 1
+            return 429, {"ok": False, "error_code": 429, "description": "Too Many Requests: retry after 1",
+                         "parameters": {"retry_after": 1}}
+        if self.random.random() < self.error_rate:
+            return 500, {"ok": False, "error_code": 500, "description": "Internal Server Error"}
+        if api_method in ("answerCallbackQuery", "setWebhook", "deleteWebhook"):
+            return 200, {"ok": True, "result": True}
+        self.messages.setdefault(chat_id, []).append(payload.get("text"))
+        return 200, {"ok": True, "result": {"message_id": sum(map(len, self.messages.values())), "date": int(time.time()),
+                                            "chat": {"id": int(chat_id) if chat_id.lstrip("-").isdigit() else chat_id,
+                                                     "type": "private"},
+                                            "text": payload.get("text")}}
+
+    def server(self) -> FakeHTTPServer:
+        return FakeHTTPServer(self.handle)
+
+
+@register_provider("FAKE")
+class FakeProvider(TrackingProvider):
+    """In-process carrier for exercising the poller without any network.
+
+    Each upstream call waits `latency` seconds and fails with probability
+    `error_rate`; every code looked up may get a new event with probability
+    `change_probability`, and a parcel is delivered after
+    `events_until_delivery` events. With `batch_size` > 1 the fake accepts
+    that many codes per call.
+    """
+    max_concurrency = 1000
+
+    def __init__(self, latency: float = 0.05, error_rate: float = 0.0, change_probability: float = 0.0,
+                 events_until_delivery: int = 8, batch_size: int = 1, seed: int = 0, **kwargs):
+        super().__init__(**kwargs)
+        self.batch_size = batch_size
+        self.latency = latency
+        self.error_rate = error_rate
+        self.change_probability = change_probability
+        self.events_until_delivery = events_until_delivery
+        self.random = random.Random(seed)
+        self.events: Dict[str, List[TrackingEvent]] = {}
+        self.fetches = 0
+
+    def _events(self, code: str) -> List[TrackingEvent]:
+        events = self.events.get(code)
+        if events is None:
+            events = self.events[code] = [TrackingEvent(1_700_000_000, "Created", "Order created")]
+        elif not events[0].delivered and self.random.random() < self.change_probability:
+            delivered = len(events) + 1 >= self.events_until_delivery
+            events.insert(0, TrackingEvent(events[0].timestamp + 3600, "Delivered" if delivered else "In transit",
+                                           "Delivered" if delivered else f"Arrived at hub #{len(events)}",
+                                           delivered))
+        return list(events)
+
+    async def _call(self) -> bool:
+        self.fetches += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self.random.random() >= self.error_rate
+
+    async def fetch(self, code: str) -> Optional[List[TrackingEvent]]:
+        async with self._semaphore:
+            return self._events(code) if await self._call() else None
+
+    async def fetch_batch(self, codes: List[str]) -> Dict[str, Optional[List[TrackingEvent]]]:
+        async with self._semaphore:
+            ok = await self._call()
+            return {code: self._events(code) if ok else None for code in codes}
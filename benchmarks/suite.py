@@ -0,0 +1,381 @@
+"""Load-test suite: drives the poller, Database and both bot layers against local fakes at several scales.
+
+Every scenario runs in its own process against a fresh database and reports
+throughput, p50/p99 latency and peak RSS. Results are saved to
+benchmarks/results/<commit>.json and compared with the newest saved run of
+an earlier commit, flagging regressions. The numbers only compare on the same
+machine, so results/ is not committed.
+
+Usage: python benchmarks/suite.py [--scales 1000,10000,100000] [--only poller,poller_run,database] [--no-save]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ChangeDetector import event_rows
+from Database import Database
+from Providers import TrackingEvent
+from fakes import FakeSPX, FakeTelegram, ServerProcess, temp_database
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+DEFAULT_SCALES = (1_000, 10_000, 100_000)
+# Relative changes against the baseline that count as a regression.
+THROUGHPUT_DROP = 0.10
+P99_RISE = 0.25
+
+
+class Step(NamedTuple):
+    """One measured step of a scenario; `latencies` is empty when only the total time matters."""
+    name: str
+    ops: int
+    seconds: float
+    latencies: List[float]
+
+
+def percentile(sorted_values: List[float], q: float) -> Optional[float]:
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+def seed_shipments(db: Database, count: int, provider: str = "SPX") -> List[str]:
+    """Adds `count` tracked shipments and returns their codes."""
+    if db.get_provider_id(provider) is None:
+        db.add_ship_provider(provider)
+    codes = [f"{provider}VN{i:012d}" for i in range(count)]
+    db.import_shipments((code, provider, f"{code}|token") for code in codes)
+    return codes
+
+
+async def timed_calls(calls, latencies: List[float]):
+    for call in calls:
+        started = time.perf_counter()
+        await call()
+        latencies.append(time.perf_counter() - started)
+
+
+async def scenario_database(scale: int) -> List[Step]:
+    db = Database.get_instance()
+    steps = []
+    started = time.perf_counter()
+    codes = seed_shipments(db, scale)
+    steps.append(Step("import", scale, time.perf_counter() - started, []))
+
+    rng = random.Random(0)
+    latencies = []
+    started = time.perf_counter()
+    for code in rng.choices(codes, k=2000):
+        call_started = time.perf_counter()
+        db.get_shipment(code)
+        latencies.append(time.perf_counter() - call_started)
+    steps.append(Step("lookup", 2000, time.perf_counter() - started, latencies))
+
+    # What the poller writes when every shipment got three new events in one cycle.
+    ids = [row[0] for row in db.get_tracked_shipments()]
+    events = [TrackingEvent(1_700_000_000 + i * 3600, "In transit", f"Arrived at hub #{i}") for i in range(3)]
+    started = time.perf_counter()
+    with db.transaction():
+        for shipment_id in ids:
+            db.add_tracking_events(event_rows(shipment_id, events))
+            db.set_tracking_state(shipment_id, events[-1].timestamp, "0" * 16)
+    steps.append(Step("write_cycle", len(ids), time.perf_counter() - started, []))
+
+    latencies = []
+    after_id = None
+    started = time.perf_counter()
+    for _ in range(200):
+        call_started = time.perf_counter()
+        page = db.get_ongoing_shipments_page(after_id, 20)
+        latencies.append(time.perf_counter() - call_started)
+        if not page:
+            break
+        after_id = page[-1][0]
+    steps.append(Step("page", len(latencies), time.perf_counter() - started, latencies))
+    return steps
+
+
+async def scenario_poller(scale: int) -> List[Step]:
+    from Poller import Poller
+    from Providers import SPXProvider
+    from ResponseCache import ResponseCache
+
+    db = Database.get_instance()
+    seed_shipments(db, scale)
+    shipments = [row[:3] for row in db.get_tracked_shipments()]
+    steps = []
+    with ServerProcess(FakeSPX(latency=0.05, error_rate=0.01, change_probability=0.1)) as server:
+        provider = SPXProvider(base_url=f"{server.url}/api/v2/fleet_order/tracking/search")
+        latencies: List[float] = []
+        send = provider._send
+
+        async def timed_send(client, request):
+            started = time.perf_counter()
+            try:
+                return await send(client, request)
+            finally:
+                latencies.append(time.perf_counter() - started)
+
+        provider._send = timed_send
+        # A zero TTL makes the second cycle revalidate every entry with If-None-Match.
+        async with Poller(db=db, providers={"SPX": provider}, cache=ResponseCache(max_entries=scale, ttl=0)) as poller:
+            for name in ("cycle", "revalidate"):
+                latencies.clear()
+                started = time.perf_counter()
+                await poller.poll_once(shipments)
+                steps.append(Step(name, scale, time.perf_counter() - started, list(latencies)))
+    return steps
+
+
+async def scenario_poller_run(scale: int) -> List[Step]:
+    """Poller.run over two rounds of every shipment; at small scales it waits idle in between."""
+    from Poller import Poller
+    from Providers import SPXProvider
+    from Scheduler import PollScheduler
+
+    db = Database.get_instance()
+    seed_shipments(db, scale)
+    # Longer than a round takes at 1,000 shipments, so run() has to wait for the second one.
+    min_interval = 5.0
+    handled: Dict[str, List[float]] = {}
+    rounds = Counter()
+
+    async def on_result(shipment, events) -> bool:
+        times = handled.setdefault(shipment[0], [])
+        times.append(time.perf_counter())
+        rounds[len(times)] += 1
+        return False
+
+    steps = []
+    with ServerProcess(FakeSPX(latency=0.05, change_probability=0.1)) as server:
+        provider = SPXProvider(base_url=f"{server.url}/api/v2/fleet_order/tracking/search")
+        async with Poller(db=db, providers={"SPX": provider}) as poller:
+            scheduler = PollScheduler(min_interval=min_interval, max_interval=min_interval)
+            task = asyncio.create_task(poller.run(on_result, scheduler))
+            for name, round_number in (("first_round", 1), ("second_round", 2)):
+                started = time.perf_counter()
+                while rounds[round_number] < scale:
+                    if task.done():
+                        task.result()
+                        raise RuntimeError(f"Poller.run returned after {rounds[round_number]} of round {round_number}")
+                    await asyncio.sleep(0.01)
+                elapsed = time.perf_counter() - started
+                lateness = []
+                if round_number == 2:
+                    # How late each shipment was polled again, past min_interval.
+                    lateness = [max(0.0, times[1] - times[0] - min_interval) for times in handled.values()]
+                steps.append(Step(name, scale, elapsed, lateness))
+            task.cancel()
+            await asyncio.wait({task})
+    return steps
+
+
+def telegram_server() -> ServerProcess:
+    # Rate limits are lifted: the client side is what is being measured.
+    return ServerProcess(FakeTelegram(latency=0, global_rate=10 ** 9, per_chat_rate=10 ** 9))
+
+
+async def scenario_bot_api(scale: int) -> List[Step]:
+    from Bot_API import TelegramBot
+
+    count = min(scale, 2000)
+    with telegram_server() as server:
+        bot = TelegramBot("TOKEN", "1", api_url=server.url)
+        latencies = []
+        started = time.perf_counter()
+        for i in range(count):
+            call_started = time.perf_counter()
+            assert bot.send_message(f"New status on your shipment `SPXVN{i:012d}`.") is not None
+            latencies.append(time.perf_counter() - call_started)
+        return [Step("send_message", count, time.perf_counter() - started, latencies)]
+
+
+async def scenario_active_bot(scale: int) -> List[Step]:
+    from telegram import Update
+    import ActiveBot
+
+    # ActiveBot logs every Bot API request at INFO.
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    db = Database.get_instance()
+    seed_shipments(db, scale)
+    ids = [row[0] for row in db.get_tracked_shipments()]
+    user = {"id": 1, "is_bot": False, "first_name": "Ops"}
+    chat = {"id": 1, "type": "private"}
+    update_ids = iter(range(1, 10 ** 9))
+
+    def command(text: str) -> dict:
+        update_id = next(update_ids)
+        entity = {"type": "bot_command", "offset": 0, "length": len(text.split()[0])}
+        return {"update_id": update_id, "message": {"message_id": update_id, "date": int(time.time()), "chat": chat,
+                                                    "from": user, "text": text, "entities": [entity]}}
+
+    def callback(data: str) -> dict:
+        update_id = next(update_ids)
+        return {"update_id": update_id, "callback_query": {
+            "id": str(update_id), "from": user, "chat_instance": "1", "data": data,
+            "message": {"message_id": 1, "date": int(time.time()), "chat": chat, "text": "Ongoing shipments:"}}}
+
+    steps = []
+    with telegram_server() as server:
+        bot = ActiveBot.TelegramBot("TOKEN", api_url=server.url)
+        application = bot.application
+        await application.initialize()
+
+        async def run(name: str, updates: List[dict]):
+            latencies = []
+            started = time.perf_counter()
+            await timed_calls([lambda update=update: application.process_update(Update.de_json(update, application.bot))
+                               for update in updates], latencies)
+            steps.append(Step(name, len(updates), time.perf_counter() - started, latencies))
+
+        rng = random.Random(0)
+        await run("status", [command(f"/status {shipment_id}") for shipment_id in rng.choices(ids, k=1000)])
+        page_ends = [page[-1][0] for page in (db.get_ongoing_shipments_page(after, 20) for after in [None] + ids[19:2000:20])
+                     if page]
+        await run("ongoing_pages", [command("/ongoing_shipments")] + [callback(f"ongoing:{after}") for after in page_ends[:99]])
+        await run("bulk_add", [command("/add_shipment\n" + "\n".join(f"NEWVN{i:012d} SPX" for i in range(1000)))])
+        await run("export", [command("/export csv")])
+        await application.shutdown()
+    ActiveBot.db.close()
+    return steps
+
+
+SCENARIOS: Dict[str, Callable] = {
+    "database": scenario_database,
+    "poller": scenario_poller,
+    "poller_run": scenario_poller_run,
+    "bot_api": scenario_bot_api,
+    "active_bot": scenario_active_bot,
+}
+
+
+def _run_scenario(name: str, scale: int, connection):
+    try:
+        with temp_database():
+            steps = asyncio.run(SCENARIOS[name](scale))
+        peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        results = {}
+        for step in steps:
+            latencies = sorted(step.latencies)
+            results[f"{name}.{step.name}@{scale}"] = {
+                "ops": step.ops,
+                "seconds": round(step.seconds, 4),
+                "throughput": round(step.ops / step.seconds, 1) if step.seconds else None,
+                "p50_ms": round(percentile(latencies, 0.5) * 1000, 3) if latencies else None,
+                "p99_ms": round(percentile(latencies, 0.99) * 1000, 3) if latencies else None,
+                "peak_rss_mb": round(peak_mb, 1),
+            }
+        connection.send(results)
+    except BaseException as e:
+        connection.send(e)
+        raise
+
+
+def run_scenario(name: str, scale: int) -> dict:
+    """Runs one scenario in a fresh process, so peak memory and module state are its own."""
+    parent, child = multiprocessing.Pipe()
+    process = multiprocessing.Process(target=_run_scenario, args=(name, scale, child))
+    process.start()
+    result = parent.recv()
+    process.join()
+    if isinstance(result, BaseException):
+        raise result
+    return result
+
+
+def git(*args: str) -> str:
+    return subprocess.run(["git", *args], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+
+
+def load_baseline(commit: str) -> Optional[dict]:
+    """The saved run of the newest commit before `commit` (or of `commit` itself for uncommitted work)."""
+    dirty = bool(git("status", "--porcelain", "--untracked-files=no"))
+    history = git("rev-list", "--max-count=200", commit if dirty else f"{commit}~1").split()
+    for sha in history:
+        path = os.path.join(RESULTS_DIR, f"{sha[:12]}.json")
+        if os.path.exists(path):
+            with open(path) as file:
+                return json.load(file)
+    return None
+
+
+def is_regression(current: dict, previous: dict) -> bool:
+    if current["throughput"] and previous.get("throughput"):
+        if current["throughput"] < previous["throughput"] * (1 - THROUGHPUT_DROP):
+            return True
+    if current["p99_ms"] and previous.get("p99_ms"):
+        if current["p99_ms"] > previous["p99_ms"] * (1 + P99_RISE):
+            return True
+    return False
+
+
+def print_report(results: dict, baseline: Optional[dict]):
+    previous = baseline["results"] if baseline else {}
+    header = f"{'step':<34} {'ops/s':>12} {'p50 ms':>9} {'p99 ms':>9} {'peak MB':>8}"
+    if baseline:
+        header += f"  vs {baseline['commit'][:12]}"
+    print(header)
+    regressions = 0
+    for key, result in results.items():
+        line = (f"{key:<34} {result['throughput'] or 0:>12,.1f} {result['p50_ms'] if result['p50_ms'] is not None else '-':>9} "
+                f"{result['p99_ms'] if result['p99_ms'] is not None else '-':>9} {result['peak_rss_mb']:>8}")
+        if key in previous and previous[key].get("throughput"):
+            change = result["throughput"] / previous[key]["throughput"] - 1
+            line += f"  {change:+.0%} ops/s"
+            if is_regression(result, previous[key]):
+                line += "  REGRESSION"
+                regressions += 1
+        print(line)
+    if baseline:
+        print(f"{regressions} regression(s) against {baseline['commit'][:12]}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--scales", default=",".join(map(str, DEFAULT_SCALES)),
+                        help="comma-separated shipment counts (default: %(default)s)")
+    parser.add_argument("--only", default=",".join(SCENARIOS), help="comma-separated scenarios (default: all)")
+    parser.add_argument("--no-save", action="store_true", help="don't write results/<commit>.json")
+    args = parser.parse_args()
+
+    commit = git("rev-parse", "HEAD")
+    results = {}
+    for name in args.only.split(","):
+        for scale in map(int, args.scales.split(",")):
+            print(f"running {name} at {scale:,} shipments...", file=sys.stderr)
+            results.update(run_scenario(name, scale))
+
+    baseline = load_baseline(commit)
+    print_report(results, baseline)
+    if not args.no_save:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        dirty = bool(git("status", "--porcelain", "--untracked-files=no"))
+        path = os.path.join(RESULTS_DIR, f"{commit[:12]}{'-dirty' if dirty else ''}.json")
+        saved = {}
+        if os.path.exists(path):
+            with open(path) as file:
+                saved = json.load(file)["results"]
+        saved.update(results)
+        with open(path, "w") as file:
+            json.dump({"commit": commit, "dirty": dirty, "date": datetime.now(timezone.utc).isoformat(),
+                       "python": platform.python_version(), "machine": platform.machine(),
+                       "cpus": os.cpu_count(), "results": saved}, file, indent=2)
+        print(f"saved to {os.path.relpath(path, ROOT)}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
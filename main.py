@@ -1,71 +1,142 @@
+import asyncio
+import logging
 import os
+import secrets
+from contextlib import AsyncExitStack
 from dotenv import load_dotenv
-import json
-
-import requests
-
-headers = {
-    'accept': 'application/json, text/plain, */*',
-    'accept-language': 'en-US,en;q=0.9,vi-VN;q=0.8,vi;q=0.7,en-GB;q=0.6',
-    'priority': 'u=1, i',
-    'referer': 'https://spx.vn/track?SPXVN04842113686B',
-    'sec-ch-ua': '"Chromium";v="130", "Google Chrome";v="130", "Not?A_Brand";v="99"',
-    'sec-ch-ua-mobile': '?0',
-    'sec-ch-ua-platform': '"Windows"',
-    'sec-fetch-dest': 'empty',
-    'sec-fetch-mode': 'cors',
-    'sec-fetch-site': 'same-origin',
-    'sec-gpc': '1',
-    'user-agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/130.0.0.0 Safari/537.36',
-    'x-language': 'vi',
-}
-
-params = {
-    'sls_tracking_number': 'SPXVN04842113686B|1731949825ed30c9e1c3e17f7ab6db22962369c4f217898f2fee26c9a87bead74d7513e26a',
-}
-from time import sleep
-
-while True:
-    old_data: dict = None
-
-    if os.path.isfile('old.json'):
-        try:
-            with open('old.json', 'r+') as f:
-                old_data = json.load(f)
-        except:
-            ...
-
-    old_tracking_list: list = []
-    if old_data != None:
-        old_tracking_list = old_data['data']['tracking_list']
-
-    response = requests.get('https://spx.vn/api/v2/fleet_order/tracking/search', params=params, headers=headers).json()
-    print(response)
-    tracking_list = response['data']['tracking_list']
-
-    with open('old.json', 'w+') as f:
-        json.dump(response, f)
-        
-    if len(tracking_list) > len(old_tracking_list):
-        from dotenv import load_dotenv
-        from Bot_API import TelegramBot
-        import os
-        load_dotenv()
-        bot_token = os.getenv("BOT_TOKEN")
-        chat_id = os.getenv("CHAT_ID")
-        url = os.getenv("TRACK_URL")
-
-        if not bot_token or not chat_id:
-            print("Error: BOT_TOKEN or CHAT_ID not found in .env file.")
-            exit(1)
-
-        bot = TelegramBot(bot_token, chat_id)
-        
-        tracking_message = tracking_list[0]['message']
-
-        message = f"New status on your shipment.\n{tracking_message}\nPlease check: {url}"
-        response = bot.send_message(message)
-        if response:
-            print(response)
-    sleep(10)
+from telegram.helpers import escape_markdown
 
+from ActiveBot import TelegramBot
+from Analytics import TransitStats
+from ChangeDetector import ChangeDetector, event_rows
+from Database import Database
+from Metrics import DB_CALL_SECONDS, MetricsServer, log_summary
+from Notifier import NotificationDispatcher
+from Poller import Poller, is_delivered
+from ScreenshotClient import ScreenshotClient
+
+load_dotenv()
+bot_token = os.getenv("BOT_TOKEN")
+chat_id = os.getenv("CHAT_ID")
+url = os.getenv("TRACK_URL")
+# Set a distinct POLLER_WORKER_ID per process to split the tracked shipments between several pollers.
+worker_id = os.getenv("POLLER_WORKER_ID")
+# Set METRICS_PORT to serve /metrics on that local port (a different one per process when running several pollers);
+# set METRICS_LOG_INTERVAL to also log a summary.
+metrics_port = os.getenv("METRICS_PORT")
+metrics_log_interval = float(os.getenv("METRICS_LOG_INTERVAL", "0"))
+# Point SCREENSHOT_URL at JS-puppeteer/server.js to attach a snapshot of the tracking page to status changes.
+screenshot_url = os.getenv("SCREENSHOT_URL")
+# With BOT_WEBHOOK_URL set, the command bot runs in this process too, fed by a webhook server on BOT_WEBHOOK_PORT.
+webhook_url = os.getenv("BOT_WEBHOOK_URL")
+webhook_secret = os.getenv("BOT_WEBHOOK_SECRET") or secrets.token_urlsafe(32)
+webhook_host = os.getenv("BOT_WEBHOOK_HOST", "127.0.0.1")
+webhook_port = int(os.getenv("BOT_WEBHOOK_PORT", "8443"))
+# Delivery-time samples are added to transit_stats this often (in seconds), and on exit.
+stats_flush_interval = float(os.getenv("STATS_FLUSH_INTERVAL", "60"))
+
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+
+if not bot_token or not chat_id:
+    print("Error: BOT_TOKEN or CHAT_ID not found in .env file.")
+    exit(1)
+
+dispatcher = NotificationDispatcher(bot_token)
+poller = Poller(worker_id=worker_id)
+detector = ChangeDetector(index=poller.index)
+screenshots = ScreenshotClient(screenshot_url) if screenshot_url else None
+# Tracking page URL templates by provider name, with $$CODE$$ standing in for the tracking code.
+tracking_urls = {}
+snapshot_tasks = set()
+transit_stats = TransitStats()
+
+
+async def send_snapshot(code: str, page_url: str, delivered: bool):
+    snapshot = await screenshots.capture(code, page_url)
+    if delivered:
+        screenshots.forget(code)
+    if snapshot is not None:
+        await dispatcher.send_photo(chat_id, snapshot.png, caption=f"Tracking page of {code}")
+
+
+async def wait_for_snapshots():
+    await asyncio.gather(*snapshot_tasks, return_exceptions=True)
+
+
+async def flush_stats(interval: float):
+    while True:
+        await asyncio.sleep(interval)
+        transit_stats.flush(Database.get_instance())
+
+
+async def on_result(shipment, events) -> bool:
+    shipment_id, code = shipment[0], shipment[1]
+    fingerprint = detector.fingerprint(shipment_id)
+    first_poll = fingerprint is None
+    new_events = detector.diff(shipment_id, events)
+
+    db = Database.get_instance()
+    if first_poll or new_events:
+        with DB_CALL_SECONDS.labels("add_tracking_events").time():
+            db.add_tracking_events(event_rows(shipment_id, events if first_poll else new_events))
+        if first_poll:
+            transit_stats.record(shipment[2], events, events)
+        else:
+            transit_stats.record(shipment[2], events, new_events, since=fingerprint[0])
+
+    delivered = is_delivered(events)
+    if delivered:
+        db.update_shipment_status(shipment_id, True)
+        db.remove_from_current_tracking(shipment_id)
+        detector.forget(shipment_id)
+
+    if new_events:
+        # Carrier text and the URL go into Markdown as-is otherwise, and a stray _ or * makes Telegram reject it.
+        tracking_messages = "\n".join(escape_markdown(event.message or "") for event in new_events)
+        message = f"New status on your shipment `{code}`.\n{tracking_messages}\nPlease check: {escape_markdown(url or '')}"
+        dispatcher.notify(chat_id, message)
+        page_url = tracking_urls.get(shipment[2])
+        if screenshots is not None and page_url:
+            task = asyncio.create_task(send_snapshot(code, page_url.replace("$$CODE$$", code), delivered))
+            snapshot_tasks.add(task)
+            task.add_done_callback(snapshot_tasks.discard)
+    return bool(new_events)
+
+
+def on_batch_end(committed: bool):
+    # Samples only count once the events they came from are stored; a failed batch is polled again.
+    if committed:
+        transit_stats.commit()
+    else:
+        transit_stats.rollback()
+
+
+async def main():
+    async with AsyncExitStack() as stack:
+        if metrics_port:
+            await stack.enter_async_context(MetricsServer(port=int(metrics_port)))
+        if metrics_log_interval > 0:
+            summary = asyncio.create_task(log_summary(metrics_log_interval))
+            stack.callback(summary.cancel)
+        # Registered before the poller, so it runs after the poller has stopped.
+        stack.callback(lambda: transit_stats.flush(Database.get_instance()))
+        stats_flusher = asyncio.create_task(flush_stats(stats_flush_interval))
+        stack.callback(stats_flusher.cancel)
+        await stack.enter_async_context(poller)
+        await stack.enter_async_context(dispatcher)
+        if webhook_url:
+            bot = await stack.enter_async_context(TelegramBot(bot_token, poller=poller))
+            await stack.enter_async_context(bot.webhook(webhook_secret, webhook_url, webhook_host, webhook_port))
+        if screenshots is not None:
+            await stack.enter_async_context(screenshots)
+            stack.push_async_callback(wait_for_snapshots)
+            tracking_urls.update((name, url) for _, name, url in Database.get_instance().get_all_providers() if url)
+        await poller.run(on_result, on_release=lambda shipment: detector.forget(shipment[0]),
+                         on_batch_end=on_batch_end)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())